@@ -1,30 +1,97 @@
 import os
 import uuid
 import json
+import hashlib
+import time
+import asyncio
+import threading
+import shutil
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
 import fitz           # PyMuPDF
 import pytesseract
 import cv2
 import numpy as np
-from pdf2image import convert_from_path
-from multiprocessing import Pool, cpu_count
+from multiprocessing import Pool, cpu_count, current_process
 from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from tqdm import tqdm
-from typing import List, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
 
 # ---------------------- CONFIG & GLOBALS ----------------------
 DATA_FOLDER = "./data"   # Where PDFs are stored locally
 OUTPUT_FOLDER = "./data_extraction_output"
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# Content-addressed extraction cache: <sha256>.<config hash>.json per extracted
+# PDF, plus a manifest (filename -> size/mtime/sha256) so unchanged files are
+# not even re-hashed. Entries are tied to the extraction settings (see
+# extraction_config_hash), so changing those re-extracts everything.
+USE_EXTRACTION_CACHE = True
+EXTRACTION_VERSION = 2  # bump when extraction/OCR logic changes output
+CACHE_FOLDER = "./data_extraction_cache"
+MANIFEST_PATH = os.path.join(CACHE_FOLDER, "manifest.json")
+os.makedirs(CACHE_FOLDER, exist_ok=True)
+
 # e.g. `tesseract-ocr-ara` package for Arabic
 PYTESSERACT_CONFIG = r'--psm 6 -l ara'  # page segmentation + Arabic language
 
+# Page-level OCR: pages are handed to workers in windows of OCR_PAGE_WINDOW pages;
+# each worker renders and OCRs one page at a time, so memory stays bounded.
+OCR_PAGE_WINDOW = 4
+OCR_PAGE_WORKERS = max(1, cpu_count() - 1)
+
+# OCR rendering: PyMuPDF rasterizes pages straight into grayscale buffers.
+# The DPI is picked per page (see choose_ocr_dpi) within [OCR_MIN_DPI, OCR_MAX_DPI].
+OCR_MIN_DPI = 150
+OCR_BASE_DPI = 200
+OCR_MAX_DPI = 300
+OCR_MAX_PIXELS = 12_000_000   # per-page pixel budget, oversized pages get a lower DPI
+OCR_DENSE_INK_RATIO = 0.12    # thumbnails darker than this are treated as dense small print
+OCR_BINARIZE = False          # Otsu-binarize pages before Tesseract
+
+# A page whose text layer has fewer characters than this is treated as scanned
+TEXT_PAGE_MIN_CHARS = 10
+
+# Background extraction jobs: at most JOB_MAX_WORKERS extractions run at once,
+# and at most JOB_MAX_PENDING may be queued or running before we answer 429.
+# Only one folder extraction runs at a time (it rewrites the manifest); a
+# second one is answered with 409.
+JOB_MAX_WORKERS = 2
+JOB_MAX_PENDING = 8
+JOB_TTL_SECONDS = 3600  # finished jobs are forgotten after this long
+
+# Uploads up to UPLOAD_SPOOL_MAX_BYTES are extracted from memory. Larger ones
+# are copied (in UPLOAD_CHUNK_SIZE chunks) to a temporary file, which is opened
+# by path, so OCR workers get the path instead of a copy of the bytes each.
+UPLOAD_CHUNK_SIZE = 1 << 20
+UPLOAD_SPOOL_MAX_BYTES = 64 << 20
+
 app = FastAPI(title="Data Extraction Service", version="1.0")
 
 
 # ---------------------- UTILS & OCR FUNCTIONS ----------------------
+# A PDF "source" is either a file path or the raw PDF bytes (in-memory uploads).
+PdfSource = Union[str, bytes]
+
+# Raw PDF bytes shared with OCR pool workers through the pool initializer,
+# so an in-memory PDF is sent once per worker rather than once per window.
+worker_pdf_bytes: Optional[bytes] = None
+
+
+def open_pdf(source: PdfSource) -> "fitz.Document":
+    """
+    Opens a PDF with PyMuPDF from a path or from in-memory bytes.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+def init_ocr_worker(pdf_bytes: Optional[bytes]):
+    global worker_pdf_bytes
+    worker_pdf_bytes = pdf_bytes
+
 def is_text_pdf(pdf_path: str) -> bool:
     """
     Use PyMuPDF to check if the PDF has any text.
@@ -53,49 +120,337 @@ def extract_text_pdf(pdf_path: str) -> str:
             extracted.append(page.get_text())
     return "\n".join(extracted)
 
-def ocr_scanned_pdf(pdf_path: str) -> str:
+def pixmap_to_array(pix: "fitz.Pixmap") -> np.ndarray:
+    """
+    Zero-copy view of a single-channel PyMuPDF pixmap as a (height, width) uint8 array.
+    The view does not keep the pixmap alive: use it only while `pix` is
+    referenced, or copy it.
+    """
+    buf = np.frombuffer(pix.samples_mv, dtype=np.uint8)
+    return buf.reshape(pix.height, pix.stride)[:, :pix.width]
+
+def scan_native_dpi(page: "fitz.Page") -> Optional[int]:
+    """
+    Resolution of the largest image drawn on the page (i.e. the scan itself),
+    in pixels per inch of page space. None if the page has no images.
+    """
+    infos = [i for i in page.get_image_info() if i.get("width")]
+    if not infos:
+        return None
+    largest = max(infos, key=lambda i: fitz.Rect(i["bbox"]).get_area())
+    bbox_width_in = fitz.Rect(largest["bbox"]).width / 72
+    if bbox_width_in <= 0:
+        return None
+    return int(largest["width"] / bbox_width_in)
+
+def choose_ocr_dpi(page: "fitz.Page") -> int:
+    """
+    Picks a rendering DPI for one page:
+      1) OCR_BASE_DPI, raised to OCR_MAX_DPI for dense small print
+         (judged from the ink ratio of a 36 DPI thumbnail).
+      2) Never above the scan's own resolution: extra pixels add no detail.
+      3) Clamped to [OCR_MIN_DPI, OCR_MAX_DPI], then capped so the page fits
+         in OCR_MAX_PIXELS (large-format pages).
+    """
+    dpi = OCR_BASE_DPI
+
+    thumb = page.get_pixmap(dpi=36, colorspace=fitz.csGRAY, alpha=False)
+    ink_ratio = float((pixmap_to_array(thumb) < 128).mean())
+    if ink_ratio > OCR_DENSE_INK_RATIO:
+        dpi = OCR_MAX_DPI
+
+    native_dpi = scan_native_dpi(page)
+    if native_dpi:
+        dpi = min(dpi, native_dpi)
+
+    dpi = max(OCR_MIN_DPI, min(dpi, OCR_MAX_DPI))
+
+    area_in2 = (page.rect.width / 72) * (page.rect.height / 72)
+    if area_in2 > 0:
+        dpi = min(dpi, int((OCR_MAX_PIXELS / area_in2) ** 0.5))
+    return dpi
+
+def render_page_gray(page: "fitz.Page", dpi: Optional[int] = None) -> np.ndarray:
+    """
+    Rasterizes a page with PyMuPDF directly into a grayscale uint8 array
+    (no poppler subprocess, no RGB/PIL intermediates).
+    Applies Otsu binarization when OCR_BINARIZE is set.
+    The returned array owns its memory (the pixmap is freed on return).
+    """
+    if dpi is None:
+        dpi = choose_ocr_dpi(page)
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    view = pixmap_to_array(pix)
+    if OCR_BINARIZE:
+        # threshold writes a new array
+        _, image = cv2.threshold(view, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    else:
+        image = view.copy()
+    return image
+
+def ocr_page_array(image: np.ndarray) -> str:
+    """
+    OCR a single rendered page (grayscale numpy array) with pytesseract.
+    """
+    page_text = pytesseract.image_to_string(image, config=PYTESSERACT_CONFIG)
+    return page_text.strip()
+
+def ocr_page_window(args) -> List[str]:
     """
-    For a scanned PDF, convert each page to an image, then OCR with pytesseract.
-    Returns combined text from all pages.
+    Render pages [first_page, last_page] (1-based, inclusive) of a PDF and OCR them,
+    one page at a time. Runs inside a pool worker.
+    A source of None means the PDF bytes handed to init_ocr_worker.
+    Returns the page texts in page order.
     """
+    source, first_page, last_page = args
+    if source is None:
+        source = worker_pdf_bytes
+
+    text_blocks = []
     try:
-        pages = convert_from_path(pdf_path)
+        with open_pdf(source) as doc:
+            for page_no in range(first_page, last_page + 1):
+                image = render_page_gray(doc[page_no - 1])
+                text_blocks.append(ocr_page_array(image))
     except Exception as e:
-        print(f"[ERROR] pdf2image failed on {pdf_path}: {e}")
-        return ""
+        print(f"[ERROR] OCR failed on pages {first_page}-{last_page}: {e}")
+    # Pad pages we never got to, so page order is preserved
+    text_blocks.extend([""] * (last_page - first_page + 1 - len(text_blocks)))
+    return text_blocks
+
+def ocr_pages(source: PdfSource, page_numbers: List[int], num_workers: Optional[int] = None) -> List[str]:
+    """
+    OCR the given pages (1-based) of a PDF and return their texts in the same order.
+    Contiguous runs of pages are grouped into windows of at most OCR_PAGE_WINDOW,
+    which are fanned out over a worker pool when there is more than one window;
+    inside a daemon pool worker (folder mode) we stay serial.
+    """
+    windows = []
+    for page_no in sorted(page_numbers):
+        if windows:
+            _, first, last = windows[-1]
+            if page_no == last + 1 and last - first + 1 < OCR_PAGE_WINDOW:
+                windows[-1] = (source, first, page_no)
+                continue
+        windows.append((source, page_no, page_no))
+
+    if num_workers is None:
+        num_workers = OCR_PAGE_WORKERS
+    num_workers = min(num_workers, len(windows))
+    # Daemonic processes are not allowed to have children
+    if current_process().daemon:
+        num_workers = 1
 
     text_blocks = []
-    for page_image in pages:
-        # Convert PIL image to OpenCV (numpy array)
-        open_cv_image = cv2.cvtColor(np.array(page_image), cv2.COLOR_RGB2BGR)
-        # OCR with Tesseract
-        page_text = pytesseract.image_to_string(open_cv_image, config=PYTESSERACT_CONFIG)
-        text_blocks.append(page_text.strip())
+    if num_workers > 1:
+        shared_bytes = None
+        if isinstance(source, (bytes, bytearray)):
+            shared_bytes = source
+            windows = [(None, first, last) for _, first, last in windows]
+        with Pool(processes=num_workers, initializer=init_ocr_worker, initargs=(shared_bytes,)) as pool:
+            # imap keeps window order, so pages come back in order
+            for window_texts in pool.imap(ocr_page_window, windows):
+                text_blocks.extend(window_texts)
+    else:
+        for window in windows:
+            text_blocks.extend(ocr_page_window(window))
+
+    page_texts = dict(zip(sorted(page_numbers), text_blocks))
+    return [page_texts[page_no] for page_no in page_numbers]
+
+def ocr_scanned_pdf(pdf_path: PdfSource, num_workers: Optional[int] = None) -> str:
+    """
+    For a scanned PDF, render pages in windows of OCR_PAGE_WINDOW, OCR them
+    with pytesseract and return combined text from all pages (in page order).
+    """
+    try:
+        with open_pdf(pdf_path) as doc:
+            page_count = doc.page_count
+    except Exception as e:
+        print(f"[ERROR] Could not open PDF: {e}")
+        return ""
+
+    return "\n".join(ocr_pages(pdf_path, list(range(1, page_count + 1)), num_workers))
+
+def extract_pdf_pages(source: PdfSource, num_workers: Optional[int] = None) -> Tuple[str, List[dict]]:
+    """
+    Single-pass hybrid extraction: opens the PDF once, keeps the PyMuPDF text
+    layer of every page that has one (at least TEXT_PAGE_MIN_CHARS characters)
+    and OCRs only the remaining pages.
+    Returns (text, pages) where `pages` lists, per page, the method used and
+    the [start, end) character offsets of that page inside `text`.
+    """
+    page_texts = []
+    ocr_page_numbers = []
+    try:
+        with open_pdf(source) as doc:
+            for page_no, page in enumerate(doc, start=1):
+                text = page.get_text()
+                if len(text.strip()) >= TEXT_PAGE_MIN_CHARS:
+                    page_texts.append(text)
+                else:
+                    page_texts.append(None)
+                    ocr_page_numbers.append(page_no)
+    except Exception as e:
+        print(f"[WARN] Could not open PDF: {e}")
+        return "", []
+
+    if ocr_page_numbers:
+        ocr_texts = ocr_pages(source, ocr_page_numbers, num_workers)
+        for page_no, text in zip(ocr_page_numbers, ocr_texts):
+            page_texts[page_no - 1] = text
+
+    pages = []
+    offset = 0
+    ocr_set = set(ocr_page_numbers)
+    for page_no, text in enumerate(page_texts, start=1):
+        pages.append({
+            "page": page_no,
+            "method": "ocr" if page_no in ocr_set else "text",
+            "start": offset,
+            "end": offset + len(text),
+        })
+        offset += len(text) + 1  # "\n" separator between pages
+
+    return "\n".join(page_texts), pages
+
+
+# ---------------------- EXTRACTION CACHE ----------------------
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """
+    SHA-256 of a file's content, read in blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-    return "\n".join(text_blocks)
+def content_sha256(source: PdfSource) -> str:
+    """
+    SHA-256 of a PDF given as a path or as in-memory bytes.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        return hashlib.sha256(source).hexdigest()
+    return file_sha256(source)
+
+def pdf_id_from_hash(content_hash: str) -> str:
+    """
+    Deterministic document id derived from the PDF content hash,
+    so the same PDF always gets the same id across runs.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, content_hash))
+
+def extraction_config_hash() -> str:
+    """
+    Hash of every setting that changes the text extracted from a PDF.
+    """
+    config = {
+        "version": EXTRACTION_VERSION,
+        "tesseract": PYTESSERACT_CONFIG,
+        "text_page_min_chars": TEXT_PAGE_MIN_CHARS,
+        "ocr_dpi": [OCR_MIN_DPI, OCR_BASE_DPI, OCR_MAX_DPI],
+        "ocr_max_pixels": OCR_MAX_PIXELS,
+        "ocr_dense_ink_ratio": OCR_DENSE_INK_RATIO,
+        "ocr_binarize": OCR_BINARIZE,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+def cache_path(content_hash: str) -> str:
+    """
+    Cache file for this content under the current extraction settings.
+    """
+    return os.path.join(CACHE_FOLDER, f"{content_hash}.{extraction_config_hash()[:16]}.json")
+
+def load_manifest() -> dict:
+    """
+    Loads the extraction manifest (filename -> {size, mtime_ns, sha256, config, output}).
+    """
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[WARN] Could not read manifest {MANIFEST_PATH}: {e}")
+        return {}
+
+def save_manifest(manifest: dict):
+    """
+    Atomically writes the extraction manifest (through a temporary file of
+    its own, so concurrent writers never share one).
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_FOLDER, prefix="manifest.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, MANIFEST_PATH)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def load_cached_extraction(content_hash: str) -> dict:
+    """
+    Returns the cached extraction for this content hash (and the current
+    extraction settings), or {} on a miss.
+    """
+    cache_file = cache_path(content_hash)
+    if not os.path.exists(cache_file):
+        return {}
+    try:
+        with open(cache_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[WARN] Corrupt cache entry {cache_file}: {e}")
+        return {}
+
+def save_cached_extraction(content_hash: str, data: dict):
+    """
+    Stores an extraction result under its content hash and the current
+    extraction settings (through a temporary file of its own, so concurrent
+    uploads of the same PDF never share one).
+    """
+    cache_file = cache_path(content_hash)
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_FOLDER, prefix=content_hash + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, cache_file)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
 
 
 # ---------------------- MAIN EXTRACTION LOGIC ----------------------
-def process_pdf_file(pdf_path: str) -> dict:
+def process_pdf_file(
+    pdf_path: PdfSource,
+    content_hash: Optional[str] = None,
+    file_name: Optional[str] = None
+) -> dict:
     """
     Main function that:
-    1) Checks if PDF is text-based or scanned
-    2) Extracts text
+    1) Extracts text page by page (text layer where present, OCR otherwise)
+    2) Labels the document as text, scanned or mixed
     3) Returns a final dict with all the data
+    `pdf_path` may also be the raw PDF bytes, in which case `file_name` is required.
     """
-    file_name = os.path.basename(pdf_path)
+    if file_name is None:
+        file_name = os.path.basename(pdf_path)
     if not file_name.lower().endswith(".pdf"):
         return {}
 
-    pdf_id = str(uuid.uuid4())
-    text_based = is_text_pdf(pdf_path)
-    
-    if text_based:
-        extracted_text = extract_text_pdf(pdf_path)
+    if content_hash is None:
+        content_hash = content_sha256(pdf_path)
+    pdf_id = pdf_id_from_hash(content_hash)
+    extracted_text, pages = extract_pdf_pages(pdf_path)
+
+    ocr_count = sum(1 for p in pages if p["method"] == "ocr")
+    if ocr_count == 0:
         extraction_method = "text_pdf"
-    else:
-        extracted_text = ocr_scanned_pdf(pdf_path)
+    elif ocr_count == len(pages):
         extraction_method = "scanned_pdf"
+    else:
+        extraction_method = "mixed_pdf"
     output_data = {
         "id": pdf_id,
         "filename": file_name,
@@ -103,35 +458,107 @@ def process_pdf_file(pdf_path: str) -> dict:
         "metadata": {
             "source_type": "pdf",
             "extraction_method": extraction_method,
+            "content_hash": content_hash,
+            "pages": pages,
         }
         }
 
     return output_data
 
 
-def process_and_save_pdf(pdf_path: str) -> str:
+def save_extraction_output(data: dict, out_file_path: str):
     """
-    Orchestrates the PDF processing and saves output JSON to disk.
-    Returns the path to the JSON file.
+    Writes one extraction result as JSON to `out_file_path`.
     """
-    data = process_pdf_file(pdf_path)
-    if not data:
-        return ""
+    with open(out_file_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def process_and_save_pdf_cached(args) -> Tuple[str, bool, dict, dict]:
+    """
+    Cache-aware version of process_and_save_pdf.
+    `args` is (pdf_path, manifest_entry, with_data); manifest_entry may be None.
+    - If size/mtime and the extraction settings match the manifest entry and
+      its output JSON still exists, the PDF is not read at all (the output JSON is only loaded if `with_data`).
+    - Otherwise the file is hashed; a known hash reuses the cached extraction.
+    - Only new content is actually extracted (and then cached).
+    Returns (json_path, cache_hit, new_manifest_entry, data); `data` is the
+    extraction dict when `with_data` is set, else {}.
+    """
+    pdf_path, manifest_entry, with_data = args
+    file_name = os.path.basename(pdf_path)
+    if not file_name.lower().endswith(".pdf"):
+        return "", False, {}, {}
 
-    out_file_name = os.path.splitext(os.path.basename(pdf_path))[0] + ".json"
+    out_file_name = os.path.splitext(file_name)[0] + ".json"
     out_file_path = os.path.join(OUTPUT_FOLDER, out_file_name)
 
-    with open(out_file_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    stat = os.stat(pdf_path)
+    config_hash = extraction_config_hash()
+    if (
+        USE_EXTRACTION_CACHE
+        and manifest_entry
+        and manifest_entry.get("size") == stat.st_size
+        and manifest_entry.get("mtime_ns") == stat.st_mtime_ns
+        and manifest_entry.get("config") == config_hash
+        and manifest_entry.get("output") == out_file_path
+        and os.path.exists(out_file_path)
+    ):
+        data = {}
+        if with_data:
+            with open(out_file_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        return out_file_path, True, manifest_entry, data
+
+    content_hash = file_sha256(pdf_path)
+    data = load_cached_extraction(content_hash) if USE_EXTRACTION_CACHE else {}
+    cache_hit = bool(data)
+    if cache_hit:
+        data["filename"] = file_name
+    else:
+        data = process_pdf_file(pdf_path, content_hash)
+        if not data:
+            return "", False, {}, {}
+        if USE_EXTRACTION_CACHE and data["metadata"]["pages"]:
+            save_cached_extraction(content_hash, data)
+
+    save_extraction_output(data, out_file_path)
+
+    new_entry = {
+        "filename": file_name,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": content_hash,
+        "config": config_hash,
+        "output": out_file_path,
+    }
+    return out_file_path, cache_hit, new_entry, data if with_data else {}
+
 
+def process_and_save_pdf(pdf_path: str) -> str:
+    """
+    Orchestrates the PDF processing and saves output JSON to disk.
+    Unchanged content is served from the extraction cache.
+    Returns the path to the JSON file.
+    """
+    out_file_path, _, _, _ = process_and_save_pdf_cached((pdf_path, None, False))
     return out_file_path
 
 
-def process_all_pdfs_in_folder(folder_path: str) -> List[str]:
+def iter_pdfs_in_folder(
+    folder_path: str,
+    with_data: bool = True,
+    progress: Optional[Callable[[int, int], None]] = None
+) -> Iterator[Tuple[str, dict]]:
     """
-    Parallelize processing of all PDFs in the folder
-    using multiprocessing.Pool.
-    Returns a list of JSON files generated.
+    Parallelize processing of all PDFs in the folder using multiprocessing.Pool,
+    yielding (json_path, data) for each document as soon as its worker finishes
+    (imap_unordered, so completion order rather than folder order).
+    `data` is the extraction dict, handed back by the worker directly instead of
+    being re-read from OUTPUT_FOLDER; it is {} when `with_data` is False.
+    Files unchanged since the last run (per the manifest) are skipped, and
+    known content is served from the extraction cache.
+    `progress(done, total)` is called after each file, if given.
     """
     pdf_files = [
         os.path.join(folder_path, f)
@@ -140,19 +567,44 @@ def process_all_pdfs_in_folder(folder_path: str) -> List[str]:
     ]
     if not pdf_files:
         print("[INFO] No PDF files found in folder.")
-        return []
+        return
 
     # Use multiple CPU cores
     num_workers = max(1, cpu_count() - 1)
     print(f"[INFO] Found {len(pdf_files)} PDF files. Using {num_workers} workers...")
 
-    results = []
-    with Pool(processes=num_workers) as pool:
-        # tqdm for a progress bar, chunksize=1 for demonstration
-        for res in tqdm(pool.imap(process_and_save_pdf, pdf_files), total=len(pdf_files)):
-            results.append(res)
+    manifest = load_manifest()
+    tasks = [(p, manifest.get(os.path.basename(p)), with_data) for p in pdf_files]
 
-    return results
+    done = 0
+    cache_hits = 0
+    try:
+        with Pool(processes=num_workers) as pool:
+            for res, hit, entry, data in tqdm(
+                pool.imap_unordered(process_and_save_pdf_cached, tasks), total=len(tasks)
+            ):
+                done += 1
+                cache_hits += int(hit)
+                if entry:
+                    manifest[entry["filename"]] = entry
+                if progress:
+                    progress(done, len(tasks))
+                yield res, data
+    finally:
+        # Also runs when a streaming client disconnects early
+        save_manifest(manifest)
+        print(f"[INFO] Extraction cache: {cache_hits} hits, {done - cache_hits} misses.")
+
+
+def process_all_pdfs_in_folder(
+    folder_path: str,
+    progress: Optional[Callable[[int, int], None]] = None
+) -> List[str]:
+    """
+    Processes all PDFs in the folder (see iter_pdfs_in_folder).
+    Returns a list of JSON files generated.
+    """
+    return [res for res, _ in iter_pdfs_in_folder(folder_path, False, progress)]
 
 
 # ---------------------- FASTAPI DATA MODELS ----------------------
@@ -162,62 +614,262 @@ class ExtractionResponse(BaseModel):
     metadata: dict
     tables: Optional[List[dict]] = None
 
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str  # queued | running | done | failed
+    progress: dict
+    error: Optional[str] = None
+
 #“file upload” and “folder processing” in a single endpoint for demonstration.
 #you might separate them.
 
-# ---------------------- FASTAPI ROUTES ----------------------
-@app.get("/health")
-def health_check():
-    """A simple health check."""
-    return {"status": "ok", "message": "Data Extraction Service is running"}
+# ---------------------- BACKGROUND JOBS ----------------------
+job_executor = ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix="extract")
+# Writes upload results to OUTPUT_FOLDER off the request path
+persist_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="persist")
+jobs: Dict[str, dict] = {}
+jobs_lock = threading.Lock()
 
-@app.post("/extract", response_model=List[ExtractionResponse])
-async def extract_endpoint(
-    file: Optional[UploadFile] = File(None),
-    process_folder: bool = False
-):
+
+def extract_upload(
+    source: PdfSource,
+    file_name: str,
+    persist: bool = True,
+    progress: Optional[Callable[[int, int], None]] = None
+) -> List[dict]:
     """
-    Endpoint to extract text (and optional table data).
-    - If `file` is provided, we process that single PDF.
-    - If `process_folder` is True, we process all PDFs in `DATA_FOLDER`.
-    Returns a list of extraction results.
+    Extracts one uploaded PDF, given as in-memory bytes or as the path of a
+    spooled temporary file (which is deleted afterwards).
+    Known content is served from the extraction cache. If `persist` is set,
+    the result is written to OUTPUT_FOLDER in the background.
+    Returns a one-element list with the extraction dict.
     """
-    results = []
+    try:
+        content_hash = content_sha256(source)
+        data = load_cached_extraction(content_hash) if USE_EXTRACTION_CACHE else {}
+        if data:
+            data["filename"] = file_name
+        else:
+            data = process_pdf_file(source, content_hash, file_name)
+            if not data:
+                raise RuntimeError("Extraction failed.")
+            if USE_EXTRACTION_CACHE and data["metadata"]["pages"]:
+                save_cached_extraction(content_hash, data)
+    finally:
+        # Clean up the spooled file, if any
+        if isinstance(source, str):
+            os.remove(source)
+
+    if progress:
+        progress(1, 1)
+    if persist:
+        out_file_path = os.path.join(OUTPUT_FOLDER, os.path.splitext(file_name)[0] + ".json")
+        persist_executor.submit(save_extraction_output, data, out_file_path)
+    return [data]
+
+
+def extract_folder(progress: Optional[Callable[[int, int], None]] = None) -> List[dict]:
+    """
+    Extracts every PDF in DATA_FOLDER. Returns the list of extraction dicts.
+    """
+    return [data for res, data in iter_pdfs_in_folder(DATA_FOLDER, True, progress) if res]
 
-    if file:
-        # Single file scenario
-        if not file.filename.lower().endswith(".pdf"):
-            raise HTTPException(status_code=400, detail="File must be a PDF.")
 
-        # Save uploaded file to a temp path
-        temp_pdf_path = os.path.join(DATA_FOLDER, f"upload_{uuid.uuid4()}.pdf")
-        with open(temp_pdf_path, "wb") as f:
-            f.write(await file.read())
+def run_job(job_id: str, keep_result: bool, fn: Callable, *args) -> List[dict]:
+    """
+    Executes `fn(*args, progress=...)` in the job executor, recording its
+    status, progress and error in `jobs`. The result is kept on the job (for
+    /jobs/{job_id}/result) only if `keep_result` is set; it is always returned.
+    """
+    job = jobs[job_id]
+
+    def progress(done: int, total: int):
+        job["progress"] = {"done": done, "total": total}
+
+    job["status"] = "running"
+    try:
+        result = fn(*args, progress=progress)
+        if keep_result:
+            job["result"] = result
+        job["status"] = "done"
+        return result
+    except Exception as e:
+        print(f"[ERROR] Job {job_id} failed: {e}")
+        job["status"] = "failed"
+        job["error"] = str(e)
+        raise
+    finally:
+        job["finished_at"] = time.time()
+
+
+def register_job(folder: bool = False) -> str:
+    """
+    Creates a queued job entry and returns its id. `folder` marks a folder
+    extraction.
+    Raises HTTP 429 when JOB_MAX_PENDING jobs are already queued or running,
+    and HTTP 409 for a folder extraction while another one is.
+    """
+    with jobs_lock:
+        now = time.time()
+        for old_id in [
+            jid for jid, j in jobs.items()
+            if j.get("finished_at") and now - j["finished_at"] > JOB_TTL_SECONDS
+        ]:
+            del jobs[old_id]
+
+        pending = {jid: j for jid, j in jobs.items() if j["status"] in ("queued", "running")}
+        if len(pending) >= JOB_MAX_PENDING:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many extraction jobs in progress, retry later."
+            )
+        if folder:
+            running = [jid for jid, j in pending.items() if j["folder"]]
+            if running:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Folder extraction {running[0]} is already in progress."
+                )
+
+        job_id = str(uuid.uuid4())
+        jobs[job_id] = {
+            "status": "queued",
+            "folder": folder,
+            "progress": {"done": 0, "total": 0},
+            "result": None,
+            "error": None,
+            "finished_at": None,
+        }
+    return job_id
+
+
+def submit_job(fn: Callable, *args, folder: bool = False, keep_result: bool = True) -> Tuple[str, Future]:
+    """
+    Queues `fn(*args)` on the bounded job executor.
+    Returns (job_id, future).
+    """
+    job_id = register_job(folder)
+    future = job_executor.submit(run_job, job_id, keep_result, fn, *args)
+    return job_id, future
+
+
+def stream_folder_extraction(job_id: str) -> Iterator[str]:
+    """
+    Extracts DATA_FOLDER and yields one NDJSON line (an ExtractionResponse)
+    per document as soon as its worker finishes.
+    Starlette iterates this in its threadpool, so it does not block the event
+    loop; it still counts against JOB_MAX_PENDING through its job entry.
+    Results are not kept on the job.
+    """
+    job = jobs[job_id]
+
+    def progress(done: int, total: int):
+        job["progress"] = {"done": done, "total": total}
+
+    job["status"] = "running"
+    try:
+        for res, data in iter_pdfs_in_folder(DATA_FOLDER, True, progress):
+            if res:
+                yield to_extraction_responses([data])[0].model_dump_json() + "\n"
+        job["status"] = "done"
+    except Exception as e:
+        print(f"[ERROR] Job {job_id} failed: {e}")
+        job["status"] = "failed"
+        job["error"] = str(e)
+        raise
+    finally:
+        if job["status"] == "running":
+            # Client went away before the stream finished
+            job["status"] = "failed"
+            job["error"] = "Stream closed by client."
+        job["finished_at"] = time.time()
+
+
+class JobStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse for a job registered before the response starts.
+    If the stream never ran to the end (e.g. the client disconnected or
+    sending the headers failed before the generator was started, so its
+    `finally` never ran), the job is marked failed, so it does not stay
+    queued forever and block later folder extractions.
+    """
+
+    def __init__(self, content: Iterator[str], job_id: str, **kwargs):
+        super().__init__(content, **kwargs)
+        self.job_id = job_id
 
-        # Process
-        out_json_path = process_and_save_pdf(temp_pdf_path)
-        if not out_json_path:
-            raise HTTPException(status_code=500, detail="Extraction failed.")
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            job = jobs.get(self.job_id)
+            if job is not None and job["status"] in ("queued", "running"):
+                job["status"] = "failed"
+                job["error"] = "Stream closed by client."
+                job["finished_at"] = time.time()
 
-        # Read JSON back to return it
-        with open(out_json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
 
-        # Clean up
-        os.remove(temp_pdf_path)
+def spool_upload(upload_file) -> str:
+    """
+    Copies an upload's file object to a named temporary PDF file in
+    UPLOAD_CHUNK_SIZE chunks. Returns its path.
+    """
+    upload_file.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as spool:
+        try:
+            shutil.copyfileobj(upload_file, spool, UPLOAD_CHUNK_SIZE)
+        except BaseException:
+            spool.close()
+            os.remove(spool.name)
+            raise
+    return spool.name
+
+
+async def read_upload(file: UploadFile) -> PdfSource:
+    """
+    Returns the PDF bytes of an upload of at most UPLOAD_SPOOL_MAX_BYTES, or
+    the path of a temporary file a larger upload was spooled to.
+    """
+    size = file.size
+    if size is None:
+        size = await asyncio.to_thread(file.file.seek, 0, os.SEEK_END)
+        await file.seek(0)
+    if size <= UPLOAD_SPOOL_MAX_BYTES:
+        return await file.read()
+    # Starlette's own spool file is closed with the request, and a /jobs
+    # extraction outlives it, so copy to a file of our own
+    return await asyncio.to_thread(spool_upload, file.file)
+
+
+async def submit_extraction(
+    file: Optional[UploadFile],
+    process_folder: bool,
+    persist: bool = True,
+    keep_result: bool = True
+) -> Tuple[str, Future]:
+    """
+    Validates the request, reads an uploaded PDF into memory (or a spooled
+    temporary file) and queues its extraction. Returns (job_id, future).
+    With keep_result=False the results are only handed back through the
+    future, not kept on the job.
+    """
+    if file:
+        # Single file scenario
+        if not file.filename.lower().endswith(".pdf"):
+            raise HTTPException(status_code=400, detail="File must be a PDF.")
 
-        # Return as a list
-        results.append(data)
+        source = await read_upload(file)
+        try:
+            return submit_job(
+                extract_upload, source, os.path.basename(file.filename), persist, keep_result=keep_result
+            )
+        except HTTPException:
+            if isinstance(source, str):
+                os.remove(source)
+            raise
     elif process_folder:
         # Process entire folder
-        json_files = process_all_pdfs_in_folder(DATA_FOLDER)
-        # Load each JSON and append to results
-        for jf in json_files:
-            if not jf:
-                continue
-            with open(jf, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                results.append(data)
+        return submit_job(extract_folder, folder=True, keep_result=keep_result)
     else:
         # No file and no folder flag -> error
         raise HTTPException(
@@ -225,17 +877,108 @@ async def extract_endpoint(
             detail="No file was uploaded or process_folder not specified."
         )
 
-    # Convert raw dict to Pydantic models for a consistent response
-    pydantic_results = []
-    for r in results:
-        pydantic_results.append(ExtractionResponse(
+
+def to_extraction_responses(results: List[dict]) -> List[ExtractionResponse]:
+    """
+    Convert raw dicts to Pydantic models for a consistent response.
+    """
+    return [
+        ExtractionResponse(
             filename=r["filename"],
             text=r["text"],
             metadata=r["metadata"],
             tables=r.get("tables", [])
-        ))
+        )
+        for r in results
+    ]
+
+
+def get_job_or_404(job_id: str) -> dict:
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}.")
+    return job
 
-    return pydantic_results
+
+# ---------------------- FASTAPI ROUTES ----------------------
+@app.get("/health")
+def health_check():
+    """A simple health check."""
+    return {"status": "ok", "message": "Data Extraction Service is running"}
+
+@app.post("/extract", response_model=List[ExtractionResponse])
+async def extract_endpoint(
+    file: Optional[UploadFile] = File(None),
+    process_folder: bool = False,
+    stream: bool = False,
+    persist: bool = True
+):
+    """
+    Endpoint to extract text (and optional table data).
+    - If `file` is provided, we process that single PDF from memory (spooled
+      to a temporary file above UPLOAD_SPOOL_MAX_BYTES). The JSON is written
+      to OUTPUT_FOLDER in the background only if `persist` is True.
+    - If `process_folder` is True, we process all PDFs in `DATA_FOLDER`.
+      With `stream=True`, results are streamed as NDJSON (one ExtractionResponse
+      per line) as each document finishes, instead of one list at the end.
+    The work runs on the background job executor, so the event loop stays free;
+    this endpoint simply waits for the job to finish.
+    Returns a list of extraction results.
+    """
+    if stream and process_folder and not file:
+        job_id = register_job(folder=True)
+        return JobStreamingResponse(
+            stream_folder_extraction(job_id),
+            job_id,
+            media_type="application/x-ndjson",
+            headers={"X-Job-Id": job_id}
+        )
+
+    # The results go back in this response; the job entry does not keep them
+    _, future = await submit_extraction(file, process_folder, persist, keep_result=False)
+    try:
+        results = await asyncio.wrap_future(future)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Extraction failed: {e}")
+
+    return to_extraction_responses(results)
+
+@app.post("/jobs", response_model=JobStatusResponse, status_code=202)
+async def submit_job_endpoint(
+    file: Optional[UploadFile] = File(None),
+    process_folder: bool = False,
+    persist: bool = True
+):
+    """
+    Same inputs as /extract, but returns immediately with a job id.
+    Poll `/jobs/{job_id}` for status and progress, then fetch `/jobs/{job_id}/result`.
+    Returns 429 when the job queue is full.
+    """
+    job_id, _ = await submit_extraction(file, process_folder, persist)
+    return job_status_endpoint(job_id)
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+def job_status_endpoint(job_id: str):
+    """Status and progress ({done, total} documents) of an extraction job."""
+    job = get_job_or_404(job_id)
+    return JobStatusResponse(
+        job_id=job_id,
+        status=job["status"],
+        progress=job["progress"],
+        error=job["error"]
+    )
+
+@app.get("/jobs/{job_id}/result", response_model=List[ExtractionResponse])
+def job_result_endpoint(job_id: str):
+    """Extraction results of a finished job (409 while it is still running)."""
+    job = get_job_or_404(job_id)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=500, detail=f"Extraction failed: {job['error']}")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}.")
+    if job["result"] is None:
+        raise HTTPException(status_code=410, detail="Job results were returned by /extract and not kept.")
+    return to_extraction_responses(job["result"])
 
 
 # ---------------------- ENTRY POINT ----------------------
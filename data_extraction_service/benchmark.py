@@ -0,0 +1,364 @@
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+from typing import List
+
+import cv2
+import fitz           # PyMuPDF
+import numpy as np
+import pytesseract
+from pdf2image import convert_from_path
+
+import app as extraction
+from app import (
+    PYTESSERACT_CONFIG,
+    TEXT_PAGE_MIN_CHARS,
+    open_pdf,
+    choose_ocr_dpi,
+    render_page_gray,
+    ocr_page_array,
+    extract_text_pdf,
+    ocr_scanned_pdf,
+    process_pdf_file,
+    save_extraction_output,
+)
+
+# ---------------------- CONFIG ----------------------
+BENCH_FOLDER = "./benchmark_pdfs"   # where synthetic PDFs are generated
+SCAN_DPI = 150                      # resolution of the synthetic "scans"
+WORDS_PER_PAGE = 350
+
+# Small MSA vocabulary for synthetic pages
+ARABIC_WORDS = [
+    "الجامعة", "الطالب", "القبول", "التسجيل", "السنة", "التحضيرية", "البرنامج",
+    "الدراسة", "الكلية", "المقرر", "الفصل", "الدراسي", "الاختبار", "النهائي",
+    "الموعد", "الطلبات", "الشروط", "المعدل", "التراكمي", "الساعات", "المعتمدة",
+    "اللائحة", "التنفيذية", "عمادة", "شؤون", "الطلاب", "المنحة", "السكن",
+    "في", "من", "إلى", "على", "أن", "هذا", "التي", "الذي", "يجب", "يتم",
+    "خلال", "بعد", "قبل", "وفق", "حسب", "لجنة", "قرار", "مجلس", "المادة",
+]
+
+
+# ---------------------- SYNTHETIC ARABIC PDFS ----------------------
+def synthetic_page_text(rng: random.Random, n_words: int = WORDS_PER_PAGE) -> str:
+    """
+    Random Arabic paragraphs built from ARABIC_WORDS.
+    """
+    words = [rng.choice(ARABIC_WORDS) for _ in range(n_words)]
+    paragraphs = [" ".join(words[i:i + 60]) + "." for i in range(0, n_words, 60)]
+    return "\n\n".join(paragraphs)
+
+
+def add_text_page(doc: "fitz.Document", text: str):
+    """
+    Appends an A4 page with `text` as a real (selectable) right-to-left text layer.
+    insert_htmlbox shapes Arabic and falls back to MuPDF's built-in Noto fonts.
+    """
+    page = doc.new_page(width=595, height=842)
+    html = "".join(f"<p>{p}</p>" for p in text.split("\n\n"))
+    page.insert_htmlbox(
+        page.rect + (50, 50, -50, -50),
+        html,
+        css="* {font-size: 11pt; direction: rtl; text-align: right;}"
+    )
+
+
+def add_scanned_page(doc: "fitz.Document", text: str, rng: random.Random):
+    """
+    Appends a page that only contains an image of `text` (no text layer),
+    rendered at SCAN_DPI in grayscale with a little noise, like a scan.
+    """
+    with fitz.open() as tmp:
+        add_text_page(tmp, text)
+        pix = tmp[0].get_pixmap(dpi=SCAN_DPI, colorspace=fitz.csGRAY, alpha=False)
+
+    image = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    noise = np.random.default_rng(rng.randrange(1 << 30)).integers(-20, 20, image.shape)
+    noisy = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    _, png = cv2.imencode(".png", noisy)
+
+    page = doc.new_page(width=595, height=842)
+    page.insert_image(page.rect, stream=png.tobytes())
+
+
+def make_synthetic_pdf(path: str, kind: str, pages: int, seed: int = 0) -> str:
+    """
+    Writes a synthetic Arabic PDF of `pages` pages to `path`:
+      - "text": every page has a text layer
+      - "scanned": every page is an image only
+      - "mixed": text pages with every third page scanned (e.g. scanned appendices)
+    Returns `path`.
+    """
+    rng = random.Random(seed)
+    with fitz.open() as doc:
+        for i in range(pages):
+            text = synthetic_page_text(rng)
+            scanned = kind == "scanned" or (kind == "mixed" and i % 3 == 2)
+            if scanned:
+                add_scanned_page(doc, text, rng)
+            else:
+                add_text_page(doc, text)
+        doc.save(path, deflate=True)
+    return path
+
+
+# ---------------------- RENDER + OCR PER PAGE ----------------------
+def benchmark_pdf2image_page(pdf_path: str, page_no: int) -> dict:
+    """
+    Previous OCR path for one page:
+    poppler (pdf2image, 200 DPI RGB) -> PIL -> np.array -> RGB2BGR -> Tesseract.
+    """
+    t0 = time.perf_counter()
+    page_image = convert_from_path(pdf_path, first_page=page_no, last_page=page_no)[0]
+    open_cv_image = cv2.cvtColor(np.array(page_image), cv2.COLOR_RGB2BGR)
+    t1 = time.perf_counter()
+    text = pytesseract.image_to_string(open_cv_image, config=PYTESSERACT_CONFIG).strip()
+    t2 = time.perf_counter()
+    return {
+        "render_s": t1 - t0,
+        "ocr_s": t2 - t1,
+        "pixels": int(open_cv_image.shape[0] * open_cv_image.shape[1]),
+        "chars": len(text),
+    }
+
+
+def benchmark_fitz_page(doc, page_no: int) -> dict:
+    """
+    Current OCR path for one page:
+    PyMuPDF grayscale pixmap at an adaptive DPI -> Tesseract.
+    """
+    page = doc[page_no - 1]
+    t0 = time.perf_counter()
+    dpi = choose_ocr_dpi(page)
+    image = render_page_gray(page, dpi)
+    t1 = time.perf_counter()
+    text = ocr_page_array(image)
+    t2 = time.perf_counter()
+    return {
+        "render_s": t1 - t0,
+        "ocr_s": t2 - t1,
+        "pixels": int(image.shape[0] * image.shape[1]),
+        "chars": len(text),
+        "dpi": dpi,
+    }
+
+
+def summarize(runs: List[dict]) -> dict:
+    """
+    Mean per-page render/OCR/total time and image size over `runs`.
+    """
+    n = max(1, len(runs))
+    render_s = sum(r["render_s"] for r in runs) / n
+    ocr_s = sum(r["ocr_s"] for r in runs) / n
+    return {
+        "pages": len(runs),
+        "render_s_per_page": render_s,
+        "ocr_s_per_page": ocr_s,
+        "total_s_per_page": render_s + ocr_s,
+        "pixels_per_page": sum(r["pixels"] for r in runs) / n,
+        "chars_per_page": sum(r["chars"] for r in runs) / n,
+    }
+
+
+def benchmark_render(pdf_path: str, max_pages: int = 10) -> dict:
+    """
+    Compares the pdf2image and PyMuPDF OCR paths on the first `max_pages`
+    pages of a (scanned) PDF. Returns per-path summaries and the speedup.
+    """
+    with open_pdf(pdf_path) as doc:
+        page_numbers = list(range(1, min(max_pages, doc.page_count) + 1))
+        fitz_runs = [benchmark_fitz_page(doc, p) for p in page_numbers]
+    poppler_runs = [benchmark_pdf2image_page(pdf_path, p) for p in page_numbers]
+
+    baseline = summarize(poppler_runs)
+    current = summarize(fitz_runs)
+    return {
+        "pdf": pdf_path,
+        "pdf2image_rgb": baseline,
+        "fitz_gray_adaptive": current,
+        "dpi_per_page": [r["dpi"] for r in fitz_runs],
+        "speedup_per_page": baseline["total_s_per_page"] / max(current["total_s_per_page"], 1e-9),
+    }
+
+
+# ---------------------- EXTRACTION SUITE ----------------------
+def peak_rss_mb() -> dict:
+    """
+    Peak resident set size of this process and of its largest finished child
+    (OCR pool workers), in MB. ru_maxrss is in KB on Linux.
+    """
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def stage_breakdown(pdf_path: str) -> dict:
+    """
+    Serial, instrumented pass over the document timing each stage the way
+    extract_pdf_pages runs it: text layer, render (scanned pages) and OCR.
+    """
+    stages = {"text_s": 0.0, "render_s": 0.0, "ocr_s": 0.0, "ocr_pages": 0}
+    with open_pdf(pdf_path) as doc:
+        for page in doc:
+            t0 = time.perf_counter()
+            text = page.get_text()
+            stages["text_s"] += time.perf_counter() - t0
+            if len(text.strip()) >= TEXT_PAGE_MIN_CHARS:
+                continue
+            t1 = time.perf_counter()
+            image = render_page_gray(page)
+            t2 = time.perf_counter()
+            ocr_page_array(image)
+            stages["render_s"] += t2 - t1
+            stages["ocr_s"] += time.perf_counter() - t2
+            stages["ocr_pages"] += 1
+    return stages
+
+
+def run_extraction_path(pdf_path: str, path: str, workers: int) -> dict:
+    """
+    Runs one extraction path on one PDF in this process and measures it:
+      - "hybrid": process_pdf_file (per-page text layer / OCR)
+      - "text": extract_text_pdf
+      - "ocr": ocr_scanned_pdf
+    `workers` sets the OCR page pool size. The result JSON is then written
+    to a temp folder to time the write stage.
+    """
+    extraction.OCR_PAGE_WORKERS = workers
+    with open_pdf(pdf_path) as doc:
+        pages = doc.page_count
+
+    t0 = time.perf_counter()
+    if path == "hybrid":
+        data = process_pdf_file(pdf_path)
+    elif path == "text":
+        data = {"text": extract_text_pdf(pdf_path)}
+    elif path == "ocr":
+        data = {"text": ocr_scanned_pdf(pdf_path, workers)}
+    else:
+        raise ValueError(f"Unknown extraction path: {path}")
+    extract_s = time.perf_counter() - t0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        t1 = time.perf_counter()
+        save_extraction_output(data, os.path.join(tmp_dir, "out.json"))
+        write_s = time.perf_counter() - t1
+
+    return {
+        "pdf": os.path.basename(pdf_path),
+        "path": path,
+        "workers": workers,
+        "pages": pages,
+        "extract_s": extract_s,
+        "write_s": write_s,
+        "pages_per_s": pages / max(extract_s, 1e-9),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_suite(
+    kinds: List[str],
+    pages: int,
+    workers_list: List[int],
+    seed: int = 0,
+    bench_folder: str = BENCH_FOLDER
+) -> dict:
+    """
+    Generates one synthetic PDF per kind, then runs every applicable
+    extraction path with every worker count. Each run happens in a fresh
+    subprocess so its peak RSS is its own. Stage times come from a serial
+    instrumented pass per document.
+    """
+    os.makedirs(bench_folder, exist_ok=True)
+    paths_by_kind = {"text": ["hybrid", "text"], "scanned": ["hybrid", "ocr"], "mixed": ["hybrid"]}
+
+    report = {
+        "config": {
+            "pages": pages,
+            "workers": workers_list,
+            "seed": seed,
+            "ocr_page_window": extraction.OCR_PAGE_WINDOW,
+            "ocr_binarize": extraction.OCR_BINARIZE,
+        },
+        "documents": [],
+        "runs": [],
+    }
+    for kind in kinds:
+        pdf_path = os.path.join(bench_folder, f"synthetic_{kind}_{pages}p.pdf")
+        t0 = time.perf_counter()
+        make_synthetic_pdf(pdf_path, kind, pages, seed)
+        report["documents"].append({
+            "kind": kind,
+            "pdf": os.path.basename(pdf_path),
+            "generate_s": time.perf_counter() - t0,
+            "stages": stage_breakdown(pdf_path),
+        })
+
+        for path in paths_by_kind[kind]:
+            # Text-layer extraction does not use the OCR pool
+            for workers in ([1] if path == "text" else workers_list):
+                cmd = [
+                    sys.executable, os.path.abspath(__file__), "run",
+                    pdf_path, "--path", path, "--workers", str(workers)
+                ]
+                out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+                # The run prints its JSON result as the last line
+                run = json.loads(out.strip().splitlines()[-1])
+                run["kind"] = kind
+                report["runs"].append(run)
+                print(
+                    f"[INFO] {kind} / {path} / workers={workers}: {run['pages_per_s']:.2f} pages/s",
+                    file=sys.stderr
+                )
+
+    return report
+
+
+# ---------------------- MAIN ----------------------
+if __name__ == "__main__":
+    """
+    Usage (from this folder):
+      python benchmark.py render path/to/scanned.pdf --pages 10
+      python benchmark.py suite --pages 20 --workers 1 2 4 --output bench.json
+    """
+    parser = argparse.ArgumentParser(description="Data extraction benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    render_parser = subparsers.add_parser("render", help="pdf2image vs PyMuPDF per-page OCR")
+    render_parser.add_argument("pdf", help="PDF to benchmark (ideally scanned)")
+    render_parser.add_argument("--pages", type=int, default=10, help="max pages to run")
+
+    suite_parser = subparsers.add_parser("suite", help="synthetic Arabic PDFs x extraction paths x workers")
+    suite_parser.add_argument("--kinds", nargs="+", default=["text", "scanned", "mixed"],
+                              choices=["text", "scanned", "mixed"])
+    suite_parser.add_argument("--pages", type=int, default=20, help="pages per synthetic PDF")
+    suite_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    suite_parser.add_argument("--seed", type=int, default=0)
+    suite_parser.add_argument("--output", default=None, help="write the JSON report here")
+
+    # Internal: one measured run, used by `suite` in a fresh process
+    run_parser = subparsers.add_parser("run")
+    run_parser.add_argument("pdf")
+    run_parser.add_argument("--path", default="hybrid", choices=["hybrid", "text", "ocr"])
+    run_parser.add_argument("--workers", type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == "render":
+        print(json.dumps(benchmark_render(args.pdf, args.pages), indent=2))
+    elif args.command == "suite":
+        report = run_suite(args.kinds, args.pages, args.workers, args.seed)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"[INFO] Wrote {args.output}", file=sys.stderr)
+        else:
+            print(json.dumps(report, indent=2))
+    elif args.command == "run":
+        print(json.dumps(run_extraction_path(args.pdf, args.path, args.workers)))
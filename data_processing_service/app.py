@@ -2,8 +2,16 @@ import os
 import json
 import re
 import uuid
+import hashlib
+import zlib
+import tempfile
+import threading
+import numpy as np
+from bisect import bisect_left, bisect_right
+from typing import Iterator, List, Optional, Tuple
 from tqdm import tqdm
 from multiprocessing import Pool, cpu_count
+from transformers import AutoTokenizer
 
 # -- Camel Tools imports --
 from camel_tools.utils.dediac import dediac_ar
@@ -15,6 +23,9 @@ from camel_tools.utils.normalize import (
     normalize_teh_marbuta_ar
 )
 
+# Fast normalizer, shared with the Retrieval Service (query normalization)
+from normalize import WHITESPACE_RE, clean_arabic_text
+
 # ---------------------- CONFIGURATION ----------------------
 INPUT_FOLDER = "./data_extraction_output"  # folder with JSON from Data Extraction
 OUTPUT_FOLDER = "./processed_chunks"       # where we'll store chunked JSON
@@ -23,10 +34,64 @@ os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 CHUNK_SIZE = 512
 CHUNK_OVERLAP = 50
 
+# Unit of CHUNK_SIZE / CHUNK_OVERLAP for fixed-size chunking:
+#   "wordpiece" -> wordpieces of the embedding model's fast tokenizer; chunks
+#                  are capped at EMBEDDING_MAX_TOKENS (incl. [CLS]/[SEP]) so
+#                  the Embedding Service never truncates them
+#   "words"     -> camel_tools words (the embedding model may truncate chunks)
+CHUNK_SIZE_UNIT = "wordpiece"
+EMBEDDING_MODEL_NAME = "CAMeL-Lab/bert-base-arabic-camelbert-msa"  # same as the Embedding Service
+EMBEDDING_MAX_TOKENS = 512
+TOKEN_COUNT_BATCH_SIZE = 256  # chunk texts per tokenizer call when counting wordpieces
+
+# Worker processes already run in parallel
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
 USE_SEMANTIC_CHUNKING = False  # switch to True if you want paragraph-based chunking
 
+# On-disk hand-off format for the Embedding Service:
+#   "jsonl" -> <name>_chunks.jsonl, one compact JSON record per line (streamable)
+#   "json"  -> <name>_chunks.json, the legacy indented JSON array
+CHUNK_OUTPUT_FORMAT = "jsonl"
+
+# Incremental re-processing: the manifest remembers, per input JSON, its hash,
+# the chunking config it was processed with and how many chunks it produced.
+# Ids of chunks that disappear are appended to DELETE_LIST_PATH for the
+# Embedding Service to remove from Qdrant.
+PROCESSING_VERSION = 2  # bump when cleaning/chunking logic changes output
+MANIFEST_PATH = os.path.join(OUTPUT_FOLDER, "processing_manifest.json")
+DELETE_LIST_PATH = os.path.join(OUTPUT_FOLDER, "deleted_chunk_ids.txt")
+
+# Scheduling: pages (or page-less documents) longer than SEGMENT_TARGET_CHARS
+# are cut at paragraph breaks. Input JSON files larger than
+# SPLIT_THRESHOLD_BYTES are cleaned & tokenized as several segments of about
+# SEGMENT_TARGET_CHARS, spread over the pool and stitched back together before
+# chunking. Documents are scheduled largest-first; a large one is only read
+# and split when its turn comes, and at most MAX_SEGMENTS_IN_FLIGHT segment
+# texts are queued or being processed at a time.
+SEGMENT_TARGET_CHARS = 200_000
+SPLIT_THRESHOLD_BYTES = 1 << 20
+MAX_SEGMENTS_IN_FLIGHT = 32
+
+# Near-duplicate chunk elimination, run over all chunk files after chunking:
+# exact duplicates by text hash, near duplicates by MinHash/LSH over word
+# shingles of the normalized text. Duplicates get metadata["duplicate_of"]
+# (the Embedding Service skips them) and the canonical chunk lists the
+# documents it was found in (metadata["source_docs"]).
+USE_CHUNK_DEDUP = True
+DEDUP_SHINGLE_SIZE = 5     # words per shingle
+DEDUP_NUM_PERM = 128       # MinHash permutations
+DEDUP_BANDS = 16           # LSH bands of DEDUP_NUM_PERM // DEDUP_BANDS rows
+DEDUP_THRESHOLD = 0.85     # estimated Jaccard similarity for a near duplicate
+DEDUP_REPORT_PATH = os.path.join(OUTPUT_FOLDER, "dedup_report.json")
+# Per chunk file: text hashes + MinHash signatures, reused while the chunk
+# file is unchanged, so a run only hashes the files that were (re)written
+DEDUP_SIGNATURE_FOLDER = os.path.join(OUTPUT_FOLDER, "dedup_signatures")
+
 # ---------------------- ARABIC TEXT CLEANING ----------------------
-def clean_arabic_text(text: str) -> str:
+PARAGRAPH_BREAK_RE = re.compile(r"\n\s*\n")
+
+def clean_arabic_text_reference(text: str) -> str:
     """
     Cleans & normalizes Arabic text:
       1) Removes tatweel/kashida (ـــ).
@@ -35,7 +100,8 @@ def clean_arabic_text(text: str) -> str:
       4) Removes diacritics.
       5) Normalizes various Alef forms, Teh Marbuta, Alef Maksura, etc.
 
-    Adjust the steps or remove any you don’t need.
+    Original step-by-step implementation (seven full passes), kept as the
+    reference that clean_arabic_text is verified against (see benchmark.py).
     """
 
     # 1) Remove tatweel
@@ -62,6 +128,36 @@ def clean_arabic_text(text: str) -> str:
     return text
 
 
+def clean_pages(raw_text: str, pages: Optional[List[dict]]) -> Tuple[str, List[int], List[int]]:
+    """
+    Cleans a document page by page, using the page offsets recorded by the
+    Data Extraction Service (metadata["pages"]), and joins the cleaned pages
+    with single spaces. `pages` may also be the units from document_units.
+    Returns (cleaned_text, page_offsets, page_numbers): where each non-empty
+    page starts in cleaned_text, and its page number. Without page offsets,
+    the whole text is cleaned at once and both lists are empty.
+    """
+    if not pages:
+        return clean_arabic_text(raw_text), [], []
+
+    parts = []
+    page_offsets = []
+    page_numbers = []
+    offset = 0
+    for page in pages:
+        cleaned = clean_arabic_text(raw_text[page["start"]:page["end"]])
+        if not cleaned:
+            continue
+        if parts:
+            parts.append(" ")
+            offset += 1
+        page_offsets.append(offset)
+        page_numbers.append(page["page"])
+        parts.append(cleaned)
+        offset += len(cleaned)
+    return "".join(parts), page_offsets, page_numbers
+
+
 # ---------------------- TOKENIZATION ----------------------
 def tokenize_arabic(text: str) -> list:
     """
@@ -71,118 +167,990 @@ def tokenize_arabic(text: str) -> list:
     tokens = simple_word_tokenize(text)
     return tokens
 
+def token_offsets(text: str, tokens: List[str]) -> Tuple[List[int], List[int]]:
+    """
+    Locates each token in `text` (tokens are in order and non-overlapping).
+    Returns (starts, ends): the [start, end) character offsets of every token.
+    """
+    starts = []
+    ends = []
+    cursor = 0
+    for token in tokens:
+        start = text.find(token, cursor)
+        if start < 0:
+            # Should not happen for simple_word_tokenize output; keep going
+            start = cursor
+        cursor = start + len(token)
+        starts.append(start)
+        ends.append(cursor)
+    return starts, ends
+
+embedding_tokenizer = None
+
+def get_embedding_tokenizer():
+    """
+    Loads the embedding model's fast tokenizer once per process.
+    """
+    global embedding_tokenizer
+    if embedding_tokenizer is None:
+        embedding_tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME, use_fast=True)
+    return embedding_tokenizer
+
+def wordpiece_words(text: str) -> Tuple[List[int], List[int], List[int]]:
+    """
+    Tokenizes the whole text once with the embedding tokenizer and groups the
+    wordpieces by pre-tokenized word.
+    Returns (starts, ends, costs): the [start, end) character offsets of every
+    word and how many wordpieces it takes.
+    """
+    encoding = get_embedding_tokenizer()(
+        text, add_special_tokens=False, return_offsets_mapping=True, verbose=False
+    )
+    starts = []
+    ends = []
+    costs = []
+    previous = None
+    for word, (start, end) in zip(encoding.word_ids(), encoding["offset_mapping"]):
+        if word != previous:
+            starts.append(start)
+            ends.append(end)
+            costs.append(1)
+            previous = word
+        else:
+            ends[-1] = end
+            costs[-1] += 1
+    return starts, ends, costs
+
+def count_wordpieces(texts: List[str]) -> List[int]:
+    """
+    Wordpieces (without [CLS]/[SEP]) per text, tokenized in batches.
+    """
+    tokenizer = get_embedding_tokenizer()
+    counts = []
+    for i in range(0, len(texts), TOKEN_COUNT_BATCH_SIZE):
+        encoded = tokenizer(
+            texts[i:i + TOKEN_COUNT_BATCH_SIZE],
+            add_special_tokens=False, return_attention_mask=False, verbose=False
+        )
+        counts.extend(len(ids) for ids in encoded["input_ids"])
+    return counts
+
 # ---------------------- CHUNKING ----------------------
-def chunk_text_fixed(tokens, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+# Chunks are (start, end) character spans over the cleaned text; the chunk
+# strings are only sliced out when records are serialized.
+def chunk_spans_fixed(starts: List[int], ends: List[int], chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
     """
-    Fixed-size chunking by token count.
+    Fixed-size chunking by token count, over token boundary offsets.
     E.g., chunk_size=512, overlap=50 => each chunk has 512 tokens, with
     50-token overlap with the previous chunk.
     """
-    chunks = []
+    spans = []
     start = 0
-    while start < len(tokens):
-        end = min(start + chunk_size, len(tokens))
-        chunk_tokens = tokens[start:end]
-        chunks.append(" ".join(chunk_tokens))
+    while start < len(starts):
+        end = min(start + chunk_size, len(starts))
+        spans.append((starts[start], ends[end - 1]))
         start += (chunk_size - overlap)
-    return chunks
+    return spans
+
+def wordpiece_chunk_size() -> int:
+    """
+    Wordpiece budget per chunk: CHUNK_SIZE, leaving room for [CLS]/[SEP].
+    """
+    return min(CHUNK_SIZE, EMBEDDING_MAX_TOKENS - 2)
+
+def chunk_spans_wordpiece(
+    starts: List[int],
+    ends: List[int],
+    costs: List[int],
+    budget: int,
+    overlap=CHUNK_OVERLAP
+) -> Tuple[List[Tuple[int, int]], List[int]]:
+    """
+    Packs whole words (see wordpiece_words) into chunks of at most `budget`
+    wordpieces; each chunk repeats the last ~`overlap` wordpieces of the
+    previous one. A single word longer than the budget is a chunk on its own.
+    Returns (spans, wordpiece_counts).
+    """
+    prefix = [0]
+    for cost in costs:
+        prefix.append(prefix[-1] + cost)
+
+    spans = []
+    counts = []
+    first = 0
+    while first < len(starts):
+        last = max(first + 1, bisect_right(prefix, prefix[first] + budget) - 1)
+        spans.append((starts[first], ends[last - 1]))
+        counts.append(prefix[last] - prefix[first])
+        if last >= len(starts):
+            break
+        first = max(first + 1, bisect_left(prefix, prefix[last] - overlap))
+    return spans, counts
 
-def chunk_text_semantic(text: str) -> list:
+def chunk_spans_semantic(text: str) -> List[Tuple[int, int]]:
     """
     Example "semantic" chunking by paragraph or heading breaks.
     Real-world usage could get more sophisticated (e.g. ML-based segmenters).
     """
     # Split on blank lines => paragraphs
-    paragraphs = re.split(r"\n\s*\n", text.strip())
-    paragraphs = [p.strip() for p in paragraphs if p.strip()]
-    return paragraphs
+    bounds = []
+    start = 0
+    for m in re.finditer(r"\n\s*\n", text):
+        bounds.append((start, m.start()))
+        start = m.end()
+    bounds.append((start, len(text)))
+
+    spans = []
+    for start, end in bounds:
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            spans.append((start, end))
+    return spans
+
+def span_pages(
+    span: Tuple[int, int],
+    page_offsets: List[int],
+    page_numbers: List[int]
+) -> Tuple[Optional[int], Optional[int]]:
+    """
+    First and last page number covered by a [start, end) span (see clean_pages).
+    """
+    if not page_offsets:
+        return None, None
+    first = max(0, bisect_right(page_offsets, span[0]) - 1)
+    last = max(0, bisect_left(page_offsets, span[1]) - 1)
+    return page_numbers[first], page_numbers[last]
+
+
+# ---------------------- DOCUMENT SEGMENTS ----------------------
+# A document is cleaned as a list of units: its pages, with pages longer than
+# SEGMENT_TARGET_CHARS cut at paragraph breaks. Large documents are cleaned &
+# tokenized as runs of consecutive units (segments) on different workers.
+# Cleaned units are always joined with single spaces and tokens never cross
+# whitespace, so stitching the segments gives exactly the cleaned text and
+# token offsets of a single pass, and chunk spans (overlap included) are then
+# computed over the whole document as usual.
+def split_unit(raw_text: str, start: int, end: int, max_chars: int) -> List[Tuple[int, int]]:
+    """
+    Cuts raw_text[start:end] into [start, end) pieces of at most `max_chars`,
+    at the last paragraph break before the limit (or the last whitespace, if
+    there is no paragraph break).
+    """
+    bounds = []
+    while end - start > max_chars:
+        limit = start + max_chars
+        cut = 0
+        for pattern in (PARAGRAPH_BREAK_RE, WHITESPACE_RE):
+            for m in pattern.finditer(raw_text, start + 1, limit):
+                cut = m.end()
+            if cut:
+                break
+        cut = cut or limit
+        bounds.append((start, cut))
+        start = cut
+    bounds.append((start, end))
+    return bounds
+
+def document_units(
+    raw_text: str,
+    pages: Optional[List[dict]],
+    max_chars: int = SEGMENT_TARGET_CHARS
+) -> List[dict]:
+    """
+    The units a document is cleaned in, as {"page", "start", "end"} dicts like
+    metadata["pages"]. Without page data the whole text is one unit (page None).
+    """
+    if not pages:
+        pages = [{"page": None, "start": 0, "end": len(raw_text)}]
+    units = []
+    for page in pages:
+        for start, end in split_unit(raw_text, page["start"], page["end"], max_chars):
+            units.append({"page": page["page"], "start": start, "end": end})
+    return units
+
+def document_segments(units: List[dict], target_chars: int = SEGMENT_TARGET_CHARS) -> List[List[dict]]:
+    """
+    Groups consecutive units into segments of about `target_chars`.
+    """
+    segments = []
+    current = []
+    size = 0
+    for unit in units:
+        length = unit["end"] - unit["start"]
+        if current and size + length > target_chars:
+            segments.append(current)
+            current = []
+            size = 0
+        current.append(unit)
+        size += length
+    if current:
+        segments.append(current)
+    return segments
+
+def clean_and_tokenize(raw_text: str, units: List[dict]) -> Tuple[str, List[int], List[int], List[int], List[int], List[int]]:
+    """
+    Cleans `units` of `raw_text` (see clean_pages) and locates the tokens.
+    Returns (cleaned_text, page_offsets, page_numbers, token_starts, token_ends, token_costs):
+    tokens are camel_tools words, or with CHUNK_SIZE_UNIT = "wordpiece" the
+    embedding tokenizer's words and their wordpiece counts (costs is empty
+    otherwise). The token lists are empty with semantic chunking.
+    """
+    cleaned_text, page_offsets, page_numbers = clean_pages(raw_text, units)
+    if USE_SEMANTIC_CHUNKING:
+        return cleaned_text, page_offsets, page_numbers, [], [], []
+    if CHUNK_SIZE_UNIT == "wordpiece":
+        starts, ends, costs = wordpiece_words(cleaned_text)
+        return cleaned_text, page_offsets, page_numbers, starts, ends, costs
+    starts, ends = token_offsets(cleaned_text, tokenize_arabic(cleaned_text))
+    return cleaned_text, page_offsets, page_numbers, starts, ends, []
+
+def stitch_segments(segments: List[tuple]) -> Tuple[str, List[int], List[int], List[int], List[int], List[int]]:
+    """
+    Joins per-segment clean_and_tokenize results, in document order, into the
+    result of one clean_and_tokenize call over all their units.
+    """
+    parts = []
+    page_offsets = []
+    page_numbers = []
+    starts = []
+    ends = []
+    costs = []
+    offset = 0
+    for cleaned, seg_page_offsets, seg_page_numbers, seg_starts, seg_ends, seg_costs in segments:
+        if not cleaned:
+            continue
+        if parts:
+            parts.append(" ")
+            offset += 1
+        page_offsets.extend(o + offset for o in seg_page_offsets)
+        page_numbers.extend(seg_page_numbers)
+        starts.extend(s + offset for s in seg_starts)
+        ends.extend(e + offset for e in seg_ends)
+        costs.extend(seg_costs)
+        parts.append(cleaned)
+        offset += len(cleaned)
+    return "".join(parts), page_offsets, page_numbers, starts, ends, costs
+
+
+# ---------------------- INCREMENTAL PROCESSING ----------------------
+def chunking_config_hash() -> str:
+    """
+    Hash of every setting that changes the chunks produced for a document.
+    """
+    config = {
+        "version": PROCESSING_VERSION,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "semantic": USE_SEMANTIC_CHUNKING,
+        "format": CHUNK_OUTPUT_FORMAT,
+        "dedup": USE_CHUNK_DEDUP,
+        "unit": CHUNK_SIZE_UNIT,
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "embedding_max_tokens": EMBEDDING_MAX_TOKENS,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()
+
+def chunk_id(text_hash: str, chunk_index: int) -> str:
+    """
+    Deterministic chunk id from the document text hash and the chunk position.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, f"{text_hash}:{chunk_index}"))
+
+def manifest_chunk_ids(entry: Optional[dict]) -> List[str]:
+    """
+    Chunk ids a manifest entry's document was last indexed with.
+    """
+    if not entry or not entry.get("text_sha256"):
+        return []
+    return [chunk_id(entry["text_sha256"], i) for i in range(entry.get("chunk_count", 0))]
+
+def load_manifest() -> dict:
+    """
+    Loads the processing manifest (input filename -> entry).
+    """
+    if not os.path.exists(MANIFEST_PATH):
+        return {}
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[WARN] Could not read manifest {MANIFEST_PATH}: {e}")
+        return {}
+
+def save_manifest(manifest: dict):
+    """
+    Atomically writes the processing manifest (through a temporary file of
+    its own, so concurrent writers never share one).
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(MANIFEST_PATH)), prefix="manifest.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, MANIFEST_PATH)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def append_delete_list(chunk_ids: List[str]):
+    """
+    Appends chunk ids (one per line) to DELETE_LIST_PATH.
+    """
+    if not chunk_ids:
+        return
+    with open(DELETE_LIST_PATH, "a", encoding="utf-8") as f:
+        f.writelines(cid + "\n" for cid in chunk_ids)
+
+def remove_output(entry: Optional[dict], keep: str = ""):
+    """
+    Removes the chunk file a manifest entry points at, unless it is `keep`.
+    """
+    old_output = (entry or {}).get("output")
+    if old_output and old_output != keep and os.path.exists(old_output):
+        os.remove(old_output)
 
 
 # ---------------------- MAIN PROCESSING ----------------------
-def process_single_json(json_path: str) -> str:
+def load_document(json_path: str, entry: Optional[dict]) -> Tuple[Optional[tuple], Optional[dict]]:
     """
-    Reads one JSON file, cleans & normalizes Arabic text, splits into chunks,
-    and saves an output JSON with chunked records.
-    Returns the path to the new JSON file, or "" on failure.
+    Checks one input JSON against its manifest entry (may be None) and loads it.
+    The document is skipped when its size/mtime, or else its content hash,
+    and the chunking config match the manifest entry and its output exists.
+    Returns (result, doc): for skipped, empty or unreadable documents, result
+    is the final process_single_json_incremental result and doc is None;
+    otherwise result is None and doc holds what write_document needs.
     """
+    config_hash = chunking_config_hash()
+    base_name = os.path.splitext(os.path.basename(json_path))[0]
+    out_file_name = f"{base_name}_chunks.{CHUNK_OUTPUT_FORMAT}"
+    out_path = os.path.join(OUTPUT_FOLDER, out_file_name)
+
+    stat = os.stat(json_path)
+    up_to_date = (
+        entry
+        and entry.get("config") == config_hash
+        and entry.get("output") == out_path
+        and os.path.exists(out_path)
+    )
+    if up_to_date and entry.get("size") == stat.st_size and entry.get("mtime_ns") == stat.st_mtime_ns:
+        return (out_path, True, entry, []), None
+
     try:
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(json_path, "rb") as f:
+            raw_bytes = f.read()
+        source_hash = hashlib.sha256(raw_bytes).hexdigest()
+        if up_to_date and entry.get("source_sha256") == source_hash:
+            # Touched but unchanged
+            return (out_path, True, {**entry, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}, []), None
+        data = json.loads(raw_bytes)
+        del raw_bytes
     except Exception as e:
         print(f"[ERROR] Failed to load JSON {json_path}: {e}")
-        return ""
+        return ("", False, {}, []), None
 
     raw_text = data.get("text", "")
     if not raw_text.strip():
         print(f"[WARN] No text found in {json_path}. Skipping.")
-        return ""
+        remove_output(entry)
+        return ("", False, {}, manifest_chunk_ids(entry)), None
+
+    return None, {
+        "json_path": json_path,
+        "entry": entry,
+        "out_path": out_path,
+        "config": config_hash,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "source_sha256": source_hash,
+        "text_sha256": hashlib.sha256(raw_text.encode("utf-8")).hexdigest(),
+        "data": data,
+    }
 
-    cleaned_text = clean_arabic_text(raw_text)
 
-    # Either do semantic chunking or fixed chunking
+def write_document(doc: dict, analysis: tuple) -> Tuple[str, bool, dict, List[str]]:
+    """
+    Chunks a loaded document (see load_document) from its clean_and_tokenize
+    result and saves the chunked records (JSONL by default, see CHUNK_OUTPUT_FORMAT).
+    Chunk ids are derived from the text hash and chunk position.
+    Returns (chunk_file_path, False, new_manifest_entry, deleted_chunk_ids);
+    the path is "" on failure.
+    """
+    json_path, entry, out_path = doc["json_path"], doc["entry"], doc["out_path"]
+    text_hash = doc["text_sha256"]
+    cleaned_text, page_offsets, page_numbers, starts, ends, costs = analysis
+
+    # Either do semantic chunking or fixed chunking (by words or wordpieces)
+    token_counts = None
     if USE_SEMANTIC_CHUNKING:
-        text_chunks = chunk_text_semantic(cleaned_text)
+        spans = chunk_spans_semantic(cleaned_text)
+    elif CHUNK_SIZE_UNIT == "wordpiece":
+        spans, token_counts = chunk_spans_wordpiece(starts, ends, costs, wordpiece_chunk_size(), CHUNK_OVERLAP)
     else:
-        # Tokenize -> chunk
-        tokens = tokenize_arabic(cleaned_text)
-        text_chunks = chunk_text_fixed(tokens, CHUNK_SIZE, CHUNK_OVERLAP)
+        spans = chunk_spans_fixed(starts, ends, CHUNK_SIZE, CHUNK_OVERLAP)
+    del starts, ends, costs
+    if token_counts is None:
+        token_counts = count_wordpieces([cleaned_text[start:end] for start, end in spans])
 
-    processed_records = []
-    base_id = data.get("id") or str(uuid.uuid4())
+    data = doc["data"]
+    base_id = data.get("id") or str(uuid.uuid5(uuid.NAMESPACE_OID, text_hash))
     filename = data.get("filename", "unknown_file")
 
-    for i, chunk in enumerate(text_chunks):
-        record_id = str(uuid.uuid4())
-        record = {
-            "id": record_id,
-            "text": chunk,
-            "metadata": {
-                "filename": filename,
-                "original_doc_id": base_id,
-                "chunk_index": i
+    def iter_records():
+        for i, (start, end) in enumerate(spans):
+            page_start, page_end = span_pages((start, end), page_offsets, page_numbers)
+            yield {
+                "id": chunk_id(text_hash, i),
+                # Sliced here, at serialization time
+                "text": cleaned_text[start:end],
+                "metadata": {
+                    "filename": filename,
+                    "original_doc_id": base_id,
+                    "chunk_index": i,
+                    "char_start": start,
+                    "char_end": end,
+                    "page_start": page_start,
+                    "page_end": page_end,
+                    "token_count": token_counts[i]
+                }
             }
-        }
-        processed_records.append(record)
-
-    # Write out the new JSON file
-    base_name = os.path.basename(json_path)
-    out_file_name = base_name.replace(".json", "_chunks.json")
-    out_path = os.path.join(OUTPUT_FOLDER, out_file_name)
 
     try:
-        with open(out_path, "w", encoding="utf-8") as f_out:
-            json.dump(processed_records, f_out, ensure_ascii=False, indent=2)
+        write_chunk_records(iter_records(), out_path)
     except Exception as e:
         print(f"[ERROR] Failed to write processed JSON for {json_path}: {e}")
-        return ""
+        return "", False, {}, []
+    remove_output(entry, keep=out_path)
+
+    new_entry = {
+        "size": doc["size"],
+        "mtime_ns": doc["mtime_ns"],
+        "source_sha256": doc["source_sha256"],
+        "config": doc["config"],
+        "text_sha256": text_hash,
+        "chunk_count": len(spans),
+        "wordpieces": sum(token_counts),
+        # Chunks the Embedding Service will cut at EMBEDDING_MAX_TOKENS
+        "truncated_chunks": sum(1 for n in token_counts if n + 2 > EMBEDDING_MAX_TOKENS),
+        "output": out_path,
+    }
+    new_ids = set(manifest_chunk_ids(new_entry))
+    deleted_ids = [cid for cid in manifest_chunk_ids(entry) if cid not in new_ids]
+    return out_path, False, new_entry, deleted_ids
 
+
+def process_single_json_incremental(args) -> Tuple[str, bool, dict, List[str]]:
+    """
+    Reads one JSON file, cleans & normalizes Arabic text, splits into chunks,
+    and saves the chunked records, in one go (see load_document / write_document).
+    `args` is (json_path, manifest_entry); manifest_entry may be None.
+    Returns (chunk_file_path, skipped, new_manifest_entry, deleted_chunk_ids);
+    the path is "" on failure.
+    """
+    result, doc = load_document(*args)
+    if result is not None:
+        return result
+    raw_text = doc["data"]["text"]
+    units = document_units(raw_text, (doc["data"].get("metadata") or {}).get("pages"), SEGMENT_TARGET_CHARS)
+    return write_document(doc, clean_and_tokenize(raw_text, units))
+
+
+def process_single_json(json_path: str) -> str:
+    """
+    Processes one JSON file (see process_single_json_incremental), ignoring the manifest.
+    Returns the path to the new chunk file, or "" on failure.
+    """
+    out_path, _, _, _ = process_single_json_incremental((json_path, None))
     return out_path
 
 
+def write_chunk_records(records, out_path: str):
+    """
+    Writes chunk records to `out_path`:
+      - *.jsonl: appends one compact JSON object per line as records are produced
+      - *.json: legacy indented JSON array
+    """
+    with open(out_path, "w", encoding="utf-8") as f_out:
+        if out_path.endswith(".jsonl"):
+            for record in records:
+                f_out.write(json.dumps(record, ensure_ascii=False))
+                f_out.write("\n")
+        else:
+            json.dump(list(records), f_out, ensure_ascii=False, indent=2)
+
+
+def report_truncation(manifest: dict):
+    """
+    Prints how many chunks of the whole corpus exceed EMBEDDING_MAX_TOKENS
+    wordpieces, i.e. are truncated by the Embedding Service.
+    """
+    entries = [e for e in manifest.values() if "truncated_chunks" in e]
+    chunks = sum(e["chunk_count"] for e in entries)
+    truncated = sum(e["truncated_chunks"] for e in entries)
+    wordpieces = sum(e["wordpieces"] for e in entries)
+    print(f"[INFO] Wordpieces: {wordpieces} in {chunks} chunks "
+          f"(avg {wordpieces / max(1, chunks):.0f}); {truncated} chunks "
+          f"({truncated / max(1, chunks):.1%}) exceed {EMBEDDING_MAX_TOKENS} and will be truncated.")
+
+
+def init_processing_worker():
+    """
+    Pool initializer: runs the cleaning & tokenization path once per worker,
+    so camel_tools' one-off setup and loading the embedding tokenizer are not
+    paid inside the first task.
+    """
+    sample = "تهيئة العامل"
+    clean_and_tokenize(sample, document_units(sample, None))
+    count_wordpieces([sample])
+
+
+def run_processing_task(task) -> Tuple[str, str, tuple]:
+    """
+    Runs one scheduled pool task and tags its result.
+    `task` is (kind, file_name, args):
+      - ("document", file_name, (json_path, entry)) -> process_single_json_incremental
+      - ("segment", file_name, (index, raw_text, units)) -> (index, clean_and_tokenize(...))
+      - ("result", file_name, result): a large document that load_document
+        already settled (skipped, empty or unreadable), passed through as is
+    """
+    kind, file_name, args = task
+    if kind == "result":
+        return task
+    if kind == "segment":
+        index, raw_text, units = args
+        return kind, file_name, (index, clean_and_tokenize(raw_text, units))
+    return kind, file_name, process_single_json_incremental(args)
+
+
+def schedule_tasks(
+    input_folder: str,
+    all_files: List[str],
+    manifest: dict,
+    split_docs: dict,
+    in_flight: threading.Semaphore,
+    stop: threading.Event
+) -> Iterator[tuple]:
+    """
+    Yields the pool tasks for `all_files`, largest file first.
+    Files up to SPLIT_THRESHOLD_BYTES are one "document" task each. Larger
+    ones are loaded only when their turn comes and, unless load_document
+    settles them (a "result" task), split into "segment" tasks; their
+    load_document docs go into `split_docs` by file name, with a slot per
+    segment result.
+    Each segment task takes a slot of `in_flight`, which the caller releases
+    per segment result, so the parent holds at most one large document plus
+    MAX_SEGMENTS_IN_FLIGHT segment texts at a time. Runs on the pool's task
+    thread; stops waiting for a slot once `stop` is set.
+    """
+    sized_files = sorted(
+        ((os.path.getsize(os.path.join(input_folder, f)), f) for f in all_files), reverse=True
+    )
+    for size, file_name in sized_files:
+        json_path = os.path.join(input_folder, file_name)
+        entry = manifest.get(file_name)
+        if size <= SPLIT_THRESHOLD_BYTES:
+            yield "document", file_name, (json_path, entry)
+            continue
+
+        result, doc = load_document(json_path, entry)
+        if result is not None:
+            yield "result", file_name, result
+            continue
+        raw_text = doc["data"]["text"]
+        del doc["data"]["text"]
+        units = document_units(raw_text, (doc["data"].get("metadata") or {}).get("pages"), SEGMENT_TARGET_CHARS)
+        segments = document_segments(units, SEGMENT_TARGET_CHARS)
+        doc["segments"] = [None] * len(segments)
+        doc["pending"] = len(segments)
+        split_docs[file_name] = doc
+        for i, seg_units in enumerate(segments):
+            while not in_flight.acquire(timeout=0.1):
+                if stop.is_set():
+                    return
+            seg_start, seg_end = seg_units[0]["start"], seg_units[-1]["end"]
+            seg_units = [{**u, "start": u["start"] - seg_start, "end": u["end"] - seg_start} for u in seg_units]
+            yield "segment", file_name, (i, raw_text[seg_start:seg_end], seg_units)
+        del raw_text
+
+
 def process_all_json_files(input_folder: str):
     """
     Scans for .json files in the input folder, processes them in parallel,
     and writes chunked JSON outputs to OUTPUT_FOLDER.
+    Large documents are split into segments that are cleaned & tokenized on
+    different workers and stitched back together (see schedule_tasks), and
+    documents run largest-first, so one huge file does not leave the other
+    workers idle at the end. Tasks are produced as the pool consumes them.
+    Documents whose source JSON and chunking config are unchanged since the
+    last run are skipped; chunk ids that disappeared (changed or removed
+    documents, new duplicates) are appended to DELETE_LIST_PATH.
+    With USE_CHUNK_DEDUP, duplicate chunks are then marked (see dedup_chunks).
     """
     all_files = [f for f in os.listdir(input_folder) if f.lower().endswith(".json")]
+    manifest = load_manifest()
+
+    # Documents removed from the input folder since the last run
+    deleted_ids = []
+    for removed in set(manifest) - set(all_files):
+        deleted_ids.extend(manifest_chunk_ids(manifest[removed]))
+        remove_output(manifest.pop(removed))
+
     if not all_files:
         print(f"[INFO] No JSON files found in {input_folder}. Nothing to do.")
+        append_delete_list(deleted_ids)
+        save_manifest(manifest)
         return
 
-    json_paths = [os.path.join(input_folder, f) for f in all_files]
-    print(f"[INFO] Found {len(json_paths)} JSON files. Processing in parallel...")
+    print(f"[INFO] Found {len(all_files)} JSON files. Processing in parallel...")
 
-    num_workers = max(1, cpu_count() - 1)
     results = []
+    skipped = 0
 
-    with Pool(processes=num_workers) as pool:
-        for result_path in tqdm(pool.imap(process_single_json, json_paths), total=len(json_paths)):
-            results.append(result_path)
+    def record(file_name: str, result: Tuple[str, bool, dict, List[str]]):
+        nonlocal skipped
+        result_path, was_skipped, entry, gone = result
+        skipped += int(was_skipped)
+        deleted_ids.extend(gone)
+        if entry:
+            manifest[file_name] = entry
+            if not was_skipped:
+                results.append(result_path)
+        elif gone:
+            # Document emptied: its chunks were deleted
+            manifest.pop(file_name, None)
+        # On failure the old entry is kept, so its chunks are still tracked
+
+    split_docs = {}
+    in_flight = threading.Semaphore(MAX_SEGMENTS_IN_FLIGHT)
+    stop = threading.Event()
+    tasks = schedule_tasks(input_folder, all_files, manifest, split_docs, in_flight, stop)
+    split_count = 0
+    segment_count = 0
+
+    num_workers = max(1, cpu_count() - 1)
+    with Pool(processes=num_workers, initializer=init_processing_worker) as pool, \
+            tqdm(total=len(all_files)) as progress:
+        try:
+            for kind, file_name, payload in pool.imap_unordered(run_processing_task, tasks):
+                if kind != "segment":
+                    record(file_name, payload)
+                    progress.update()
+                    continue
+                in_flight.release()
+                doc = split_docs[file_name]
+                index, analysis = payload
+                doc["segments"][index] = analysis
+                doc["pending"] -= 1
+                if doc["pending"] == 0:
+                    # Last segment in: stitch, chunk over the whole document, write
+                    segments = split_docs.pop(file_name)["segments"]
+                    split_count += 1
+                    segment_count += len(segments)
+                    record(file_name, write_document(doc, stitch_segments(segments)))
+                    progress.update()
+        finally:
+            # Lets the task thread finish if we stop early
+            stop.set()
+    if split_count:
+        print(f"[INFO] Split {split_count} large document(s) into {segment_count} segments.")
+
+    # Identical documents share chunk ids: keep ids another document still has
+    if deleted_ids:
+        live_ids = {cid for e in manifest.values() for cid in manifest_chunk_ids(e)}
+        deleted_ids = [cid for cid in deleted_ids if cid not in live_ids]
 
-    print("[INFO] Done. Generated chunked JSON:")
+    if USE_CHUNK_DEDUP:
+        chunk_entries = sorted((e for e in manifest.values() if e.get("output")), key=lambda e: e["output"])
+        deleted_ids.extend(dedup_chunks(chunk_entries, num_workers))
+
+    append_delete_list(deleted_ids)
+    save_manifest(manifest)
+
+    report_truncation(manifest)
+    print(f"[INFO] Done. {skipped} unchanged, {len(results)} (re)processed, "
+          f"{len(deleted_ids)} chunk ids added to {DELETE_LIST_PATH}.")
     for r in results:
-        if r:
-            print("  -", r)
+        print("  -", r)
+
+
+# ---------------------- NEAR-DUPLICATE CHUNKS ----------------------
+# Universal hashes (a * h + b mod 2^64, high 32 bits) standing in for the
+# MinHash permutations; fixed seed so signatures are stable across runs.
+MINHASH_RNG = np.random.default_rng(0)
+MINHASH_A = MINHASH_RNG.integers(1, 2**63, DEDUP_NUM_PERM, dtype=np.uint64) | np.uint64(1)
+MINHASH_B = MINHASH_RNG.integers(0, 2**63, DEDUP_NUM_PERM, dtype=np.uint64)
+SHINGLE_PRIME = np.uint64(1099511628211)  # combines word hashes into shingle hashes
+
+DEDUP_KEYS = ("duplicate_of", "source_docs", "duplicate_count")
+
+
+def shingle_hashes(text: str, size: int = DEDUP_SHINGLE_SIZE) -> np.ndarray:
+    """
+    Distinct 64-bit hashes of the `size`-word shingles of `text` (one shingle
+    of all words for shorter texts).
+    """
+    words = text.split()
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    word_hashes = np.fromiter(
+        (zlib.crc32(w.encode("utf-8")) for w in words), dtype=np.uint64, count=len(words)
+    )
+    n = max(1, len(words) - size + 1)
+    hashes = np.zeros(n, dtype=np.uint64)
+    for k in range(min(size, len(words))):
+        hashes = hashes * SHINGLE_PRIME + word_hashes[k:k + n]
+    return np.unique(hashes)
+
+
+def minhash_signature(hashes: np.ndarray) -> np.ndarray:
+    """
+    DEDUP_NUM_PERM-value MinHash signature of a set of shingle hashes.
+    """
+    if hashes.size == 0:
+        return np.full(DEDUP_NUM_PERM, np.iinfo(np.uint32).max, dtype=np.uint32)
+    permuted = (np.outer(MINHASH_A, hashes) + MINHASH_B[:, None]) >> np.uint64(32)
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def read_chunk_records(out_path: str) -> List[dict]:
+    """
+    Reads back a chunk file written by write_chunk_records.
+    """
+    with open(out_path, "r", encoding="utf-8") as f:
+        if out_path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+def chunk_file_signatures(out_path: str) -> List[dict]:
+    """
+    Per-record dedup info for one chunk file: ids, source document, text hash,
+    MinHash signature and the dedup metadata currently in the file.
+    """
+    items = []
+    for record in read_chunk_records(out_path):
+        metadata = record.get("metadata", {})
+        text = record.get("text", "")
+        items.append({
+            "path": out_path,
+            "id": record["id"],
+            "filename": metadata.get("filename"),
+            "original_doc_id": metadata.get("original_doc_id"),
+            "text_sha256": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            "signature": minhash_signature(shingle_hashes(text)),
+            "dedup": {k: metadata[k] for k in DEDUP_KEYS if k in metadata},
+        })
+    return items
+
+
+def signature_cache_path(out_path: str) -> str:
+    return os.path.join(DEDUP_SIGNATURE_FOLDER, os.path.basename(out_path) + ".npz")
+
+
+def signature_cache_key(out_path: str, entry: dict) -> dict:
+    """
+    What the stored signatures of a chunk file are valid for: the document
+    text and chunking config of its manifest entry, the file's size/mtime
+    (dedup rewrites refresh it) and the MinHash parameters.
+    """
+    stat = os.stat(out_path)
+    return {
+        "text_sha256": entry.get("text_sha256"),
+        "config": entry.get("config"),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "shingle_size": DEDUP_SHINGLE_SIZE,
+        "num_perm": DEDUP_NUM_PERM,
+    }
+
+
+def load_signature_cache(out_path: str, key: dict) -> Optional[List[dict]]:
+    """
+    The stored chunk_file_signatures items of a chunk file, or None when
+    there are none for `key`.
+    """
+    cache_path = signature_cache_path(out_path)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with np.load(cache_path) as data:
+            info = json.loads(str(data["info"]))
+            if info["key"] != key:
+                return None
+            signatures = data["signatures"]
+    except Exception as e:
+        print(f"[WARN] Unreadable dedup signatures {cache_path}: {e}")
+        return None
+    return [
+        {**item, "path": out_path, "signature": signature}
+        for item, signature in zip(info["items"], signatures)
+    ]
+
+
+def save_signature_cache(out_path: str, key: dict, items: List[dict]):
+    os.makedirs(DEDUP_SIGNATURE_FOLDER, exist_ok=True)
+    cache_path = signature_cache_path(out_path)
+    tmp_path = f"{cache_path[:-len('.npz')]}.{os.getpid()}.tmp.npz"
+    info = {
+        "key": key,
+        "items": [{k: v for k, v in item.items() if k not in ("path", "signature")} for item in items],
+    }
+    signatures = np.array([item["signature"] for item in items], dtype=np.uint32).reshape(len(items), DEDUP_NUM_PERM)
+    np.savez(tmp_path, info=np.array(json.dumps(info, ensure_ascii=False)), signatures=signatures)
+    os.replace(tmp_path, cache_path)
+
+
+def cached_chunk_file_signatures(args) -> Tuple[List[dict], bool]:
+    """
+    chunk_file_signatures of one chunk file, from DEDUP_SIGNATURE_FOLDER when
+    the file is unchanged since they were stored.
+    `args` is (chunk_file_path, manifest_entry).
+    Returns (items, computed).
+    """
+    out_path, entry = args
+    key = signature_cache_key(out_path, entry)
+    items = load_signature_cache(out_path, key)
+    if items is not None:
+        return items, False
+    items = chunk_file_signatures(out_path)
+    save_signature_cache(out_path, key, items)
+    return items, True
+
+
+def rewrite_dedup_metadata(out_path: str, dedup: List[dict]):
+    """
+    Replaces the dedup metadata of every record in a chunk file (atomically).
+    """
+    records = read_chunk_records(out_path)
+    for record, annotation in zip(records, dedup):
+        metadata = record.setdefault("metadata", {})
+        for k in DEDUP_KEYS:
+            metadata.pop(k, None)
+        metadata.update(annotation)
+    root, ext = os.path.splitext(out_path)
+    tmp_path = f"{root}.tmp{ext}"
+    write_chunk_records(records, tmp_path)
+    os.replace(tmp_path, out_path)
+
+
+def dedup_chunks(chunk_entries: List[dict], num_workers: int = 1) -> List[str]:
+    """
+    Finds exact and near-duplicate chunks across the chunk files of
+    `chunk_entries` (manifest entries) and collapses each group onto its
+    first chunk (in file order): the canonical chunk gets
+    "source_docs" / "duplicate_count", the others "duplicate_of". Only files
+    whose dedup metadata changed are rewritten. Writes DEDUP_REPORT_PATH.
+    Signatures are only computed for chunk files that changed since the last
+    run (see cached_chunk_file_signatures).
+    Returns the ids of chunks that just became duplicates (to delete from Qdrant).
+    """
+    entries_by_path = {e["output"]: e for e in chunk_entries}
+    items = []
+    computed_files = 0
+    with Pool(processes=num_workers) as pool:
+        for file_items, computed in tqdm(
+            pool.imap(cached_chunk_file_signatures, list(entries_by_path.items())),
+            total=len(entries_by_path), desc="Dedup signatures"
+        ):
+            items.extend(file_items)
+            computed_files += int(computed)
+
+    # Signatures of chunk files that no longer exist
+    if os.path.isdir(DEDUP_SIGNATURE_FOLDER):
+        live = {os.path.basename(signature_cache_path(p)) for p in entries_by_path}
+        for name in os.listdir(DEDUP_SIGNATURE_FOLDER):
+            if name not in live:
+                os.remove(os.path.join(DEDUP_SIGNATURE_FOLDER, name))
+
+    # Union-find; the root of a group is always its smallest index
+    parent = list(range(len(items)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i: int, j: int):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+
+    # 1) Exact duplicates
+    first_by_hash = {}
+    for i, item in enumerate(items):
+        union(first_by_hash.setdefault(item["text_sha256"], i), i)
+    exact_duplicates = len(items) - len(first_by_hash)
+
+    # 2) Near duplicates among distinct texts: LSH buckets, then a signature check
+    rows = DEDUP_NUM_PERM // DEDUP_BANDS
+    for band in range(DEDUP_BANDS):
+        buckets = {}
+        for i in first_by_hash.values():
+            key = items[i]["signature"][band * rows:(band + 1) * rows].tobytes()
+            first = buckets.setdefault(key, i)
+            if first != i and find(first) != find(i):
+                similarity = np.count_nonzero(items[first]["signature"] == items[i]["signature"]) / DEDUP_NUM_PERM
+                if similarity >= DEDUP_THRESHOLD:
+                    union(first, i)
+
+    groups = {}
+    for i in range(len(items)):
+        groups.setdefault(find(i), []).append(i)
+
+    # 3) New dedup metadata, per file
+    new_duplicates = []
+    changed_files = set()
+    for root, members in groups.items():
+        sources = {}
+        for i in members:
+            sources.setdefault((items[i]["original_doc_id"], items[i]["filename"]), None)
+        for i in members:
+            if i != root:
+                annotation = {"duplicate_of": items[root]["id"]}
+                # (a copy of an identical document has the canonical's own id)
+                if "duplicate_of" not in items[i]["dedup"] and items[i]["id"] != items[root]["id"]:
+                    new_duplicates.append(items[i]["id"])
+            elif len(members) > 1:
+                annotation = {
+                    "source_docs": [{"filename": f, "original_doc_id": d} for d, f in sources],
+                    "duplicate_count": len(members) - 1,
+                }
+            else:
+                annotation = {}
+            if annotation != items[i]["dedup"]:
+                changed_files.add(items[i]["path"])
+            items[i]["dedup"] = annotation
+
+    by_file = {}
+    for item in items:
+        if item["path"] in changed_files:
+            by_file.setdefault(item["path"], []).append(item)
+    for out_path, file_items in by_file.items():
+        rewrite_dedup_metadata(out_path, [item["dedup"] for item in file_items])
+        # Same texts, new dedup metadata and mtime
+        save_signature_cache(out_path, signature_cache_key(out_path, entries_by_path[out_path]), file_items)
+
+    duplicates = len(items) - len(groups)
+    report = {
+        "chunks": len(items),
+        "canonical_chunks": len(groups),
+        "exact_duplicates": exact_duplicates,
+        "near_duplicates": duplicates - exact_duplicates,
+        "dedup_ratio": duplicates / max(1, len(items)),
+        "files_rewritten": len(by_file),
+        "files_signed": computed_files,
+    }
+    with open(DEDUP_REPORT_PATH, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[INFO] Dedup: {duplicates}/{len(items)} chunks are duplicates "
+          f"({exact_duplicates} exact, {duplicates - exact_duplicates} near), "
+          f"dedup ratio {report['dedup_ratio']:.1%} "
+          f"(signatures computed for {computed_files}/{len(entries_by_path)} files).")
+    return new_duplicates
 
 
 if __name__ == "__main__":
@@ -190,6 +1158,6 @@ if __name__ == "__main__":
     Usage:
       1) Place extracted JSON files in `INPUT_FOLDER`.
       2) Run `python app.py`.
-      3) Check `OUTPUT_FOLDER` for new _chunks.json files.
+      3) Check `OUTPUT_FOLDER` for new _chunks.jsonl files.
     """
     process_all_json_files(INPUT_FOLDER)
@@ -0,0 +1,190 @@
+import os
+import sys
+import time
+import json
+import random
+import argparse
+from typing import List
+
+from app import (
+    INPUT_FOLDER,
+    clean_arabic_text,
+    clean_arabic_text_reference,
+)
+from normalize import needs_nfkc, strip_tatweel_whitespace
+
+# ---------------------- CONFIG ----------------------
+# Hand-picked cases around the tricky spots: tatweel next to whitespace,
+# diacritics between spaces, ligatures / presentation forms that NFKC expands,
+# combining hamza/madda that compose under NFKC, non-breaking spaces.
+EDGE_CASES = [
+    "",
+    "   ",
+    "الجامعــــة",
+    "كلمة ـ كلمة",
+    "ـ بداية",
+    "نهاية ـ",
+    "a َ b",
+    "َ a",
+    "مُحَمَّدٌ رَسُولُ اللَّهِ",
+    "إلى أين؟ آمنة ٱلكتاب مستشفى مدرسة",
+    "﷽ ﷼ ﷺ",
+    "ﹰﹱ ﺍﻻ",
+    "آ أ إ اـٓ",
+    "eـ́",
+    "سطر أول\n\n\tسطر ثان",
+    "١٢٣ 123 ٤٥٦",
+]
+
+# Characters the fuzzer draws from
+FUZZ_CHARS = (
+    list("ابتثجحخدذرسشصضطظعغفقكلمنهويءآأإىةٱ ")
+    + ["ً", "َ", "ّ", "ْ", "ٰ", "ـ", "ٓ", "ٔ", "ٕ"]
+    + ["\n", "\t", " ", "﷼", "﷽", "ﷺ", "ﹰ", "ﹱ", "ﺍ", "ﻻ"]
+    + ["e", "́", "1", "٣"]
+)
+
+
+# ---------------------- CORPUS ----------------------
+def load_corpus(input_folder: str = INPUT_FOLDER) -> List[str]:
+    """
+    Texts of all extracted JSON documents in `input_folder`.
+    """
+    texts = []
+    if not os.path.isdir(input_folder):
+        return texts
+    for file_name in sorted(os.listdir(input_folder)):
+        if not file_name.lower().endswith(".json"):
+            continue
+        with open(os.path.join(input_folder, file_name), "r", encoding="utf-8") as f:
+            texts.append(json.load(f).get("text", ""))
+    return texts
+
+
+def fuzz_corpus(n: int, seed: int = 0) -> List[str]:
+    """
+    `n` short random strings over FUZZ_CHARS.
+    """
+    rng = random.Random(seed)
+    return ["".join(rng.choice(FUZZ_CHARS) for _ in range(rng.randint(0, 16))) for _ in range(n)]
+
+
+# ---------------------- VERIFY + BENCHMARK ----------------------
+def verify_normalizer(texts: List[str]) -> List[int]:
+    """
+    Returns the indices of texts where clean_arabic_text differs from
+    clean_arabic_text_reference.
+    """
+    return [
+        i for i, text in enumerate(texts)
+        if clean_arabic_text(text) != clean_arabic_text_reference(text)
+    ]
+
+
+def time_normalizer(fn, texts: List[str], repeats: int = 3) -> float:
+    """
+    Best-of-`repeats` wall time (seconds) to normalize all texts.
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        for text in texts:
+            fn(text)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def time_normalizers(texts: List[str], repeats: int = 3) -> dict:
+    """
+    Times the fused and reference normalizers on `texts`.
+    """
+    total_chars = sum(len(t) for t in texts)
+    fused_s = time_normalizer(clean_arabic_text, texts, repeats)
+    reference_s = time_normalizer(clean_arabic_text_reference, texts, repeats)
+    return {
+        "documents": len(texts),
+        "chars": total_chars,
+        "reference_s": reference_s,
+        "fused_s": fused_s,
+        "reference_mchars_per_s": total_chars / max(reference_s, 1e-9) / 1e6,
+        "fused_mchars_per_s": total_chars / max(fused_s, 1e-9) / 1e6,
+        "speedup": reference_s / max(fused_s, 1e-9),
+    }
+
+
+def runs_nfkc(text: str) -> bool:
+    """
+    True if clean_arabic_text has to run NFKC on `text`.
+    """
+    return needs_nfkc(strip_tatweel_whitespace(text))
+
+
+def benchmark_normalizer(texts: List[str], repeats: int = 3) -> dict:
+    """
+    Times the normalizers separately on plain texts and on texts that need
+    NFKC (ligatures, presentation forms, ﷺ, ...): the fused normalizer only
+    skips NFKC on the former. Warns for every group where it is slower.
+    """
+    nfkc = [runs_nfkc(t) for t in texts]
+    groups = {
+        "plain": [t for t, n in zip(texts, nfkc) if not n],
+        "nfkc": [t for t, n in zip(texts, nfkc) if n],
+    }
+    report = {}
+    for name, group in groups.items():
+        if not group:
+            continue
+        report[name] = time_normalizers(group, repeats)
+        if report[name]["speedup"] < 1:
+            print(
+                f"[WARN] clean_arabic_text is slower than the reference on {name} texts "
+                f"(speedup {report[name]['speedup']:.2f}).",
+                file=sys.stderr
+            )
+    return report
+
+
+# ---------------------- MAIN ----------------------
+if __name__ == "__main__":
+    """
+    Usage (from this folder):
+      python benchmark.py normalize [--input-folder ./data_extraction_output] [--fuzz 100000]
+    Exits with status 1 if the fused normalizer differs from the reference.
+    """
+    parser = argparse.ArgumentParser(description="Data processing benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    norm_parser = subparsers.add_parser("normalize", help="verify + time clean_arabic_text")
+    norm_parser.add_argument("--input-folder", default=INPUT_FOLDER)
+    norm_parser.add_argument("--fuzz", type=int, default=100000, help="random strings to verify on")
+    norm_parser.add_argument("--repeats", type=int, default=3)
+
+    args = parser.parse_args()
+    if args.command == "normalize":
+        corpus = load_corpus(args.input_folder)
+        checks = {
+            "edge_cases": EDGE_CASES,
+            "fuzz": fuzz_corpus(args.fuzz),
+            "corpus": corpus,
+        }
+        report = {"verify": {}, "benchmark": None}
+        failed = False
+        for name, texts in checks.items():
+            mismatches = verify_normalizer(texts)
+            failed = failed or bool(mismatches)
+            report["verify"][name] = {
+                "texts": len(texts),
+                "mismatches": len(mismatches),
+                "examples": [texts[i][:80] for i in mismatches[:5]],
+            }
+        if not corpus:
+            print(f"[WARN] No JSON documents in {args.input_folder}; timing on the fuzz strings.", file=sys.stderr)
+        # Without a corpus: one plain and one NFKC-needing text from the fuzz strings
+        bench_texts = corpus or [
+            " ".join(t for t in checks["fuzz"] if not runs_nfkc(t)),
+            " ".join(t for t in checks["fuzz"] if runs_nfkc(t)),
+        ]
+        report["benchmark"] = benchmark_normalizer(bench_texts, args.repeats)
+
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        sys.exit(1 if failed else 0)
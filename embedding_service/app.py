@@ -1,78 +1,598 @@
 import os
 import json
-import torch
-from typing import List
-from transformers import AutoTokenizer, AutoModel
-from qdrant_client import QdrantClient
-from qdrant_client.models import (
-    VectorParams, Distance, PointStruct
-)
+import time
+import queue
+import hashlib
+import sqlite3
+import threading
+import urllib.request
+import numpy as np
+from typing import TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple
 from tqdm import tqdm
 
+from lazy_resource import LazyResource
+
+if TYPE_CHECKING:
+    import onnxruntime as ort
+    import torch
+    from qdrant_client.models import PointStruct
+
 # ------------------ CONFIG ------------------
 # Model and Tokenizer
 MODEL_NAME = "CAMeL-Lab/bert-base-arabic-camelbert-msa"
-TOKENIZER = AutoTokenizer.from_pretrained(MODEL_NAME)
-MODEL = AutoModel.from_pretrained(MODEL_NAME)
 
-# If you have a GPU, you can uncomment this:
-device = "cuda" if torch.cuda.is_available() else "cpu"
-MODEL.to(device)
+# Inference backend:
+#   "torch" -> the PyTorch model in full precision (GPU if available)
+#   "onnx"  -> ONNX Runtime on CPU, using the model exported by
+#              `python export_onnx.py` (int8 dynamically quantized if ONNX_QUANTIZE)
+EMBED_BACKEND = "torch"
+ONNX_MODEL_DIR = "./onnx_model"
+ONNX_QUANTIZE = True
+ONNX_MODEL_PATH = os.path.join(ONNX_MODEL_DIR, "model.int8.onnx" if ONNX_QUANTIZE else "model.onnx")
+ONNX_INTRA_OP_THREADS = 0  # 0 = let ONNX Runtime decide
+
+# The tokenizer, model / ONNX session, vector store client and embedding cache are
+# created on first use (see LAZY INIT), so importing this module is cheap
+# (torch and the Qdrant models are imported there too).
+
+# Identifies the vectors a backend produces (part of the embedding cache key)
+EMBED_MODEL_KEY = MODEL_NAME if EMBED_BACKEND == "torch" else f"{MODEL_NAME}:{os.path.basename(ONNX_MODEL_PATH)}"
 
 # Qdrant Client config
 QDRANT_HOST = "localhost"    # or IP
 QDRANT_PORT = 6333
 COLLECTION_NAME = "arabic_docs"
 
-# Path to the folder containing "_chunks.json" files
+# Vector store:
+#   "qdrant" -> the Qdrant server above
+#   "local"  -> in-process memory-mapped index in LOCAL_INDEX_FOLDER (see
+#               local_index.py), read directly by the Retrieval Service
+VECTOR_STORE = "qdrant"
+LOCAL_INDEX_FOLDER = "./local_index"
+LOCAL_INDEX_DTYPE = "float16"  # or "int8" (half the size, slightly lower recall)
+# k-means lists of the approximate (IVF) index built after indexing; 0 = exact search only
+LOCAL_INDEX_IVF_LISTS = 0
+
+# Path to the folder containing "_chunks.jsonl" (or legacy "_chunks.json") files
 CHUNKS_FOLDER = "./processed_chunks"
 
+# Points are upserted to Qdrant in batches of this size
+UPSERT_BATCH_SIZE = 256
+
+# Pipelined indexing: windows of UPSERT_BATCH_SIZE records in flight between
+# stages, and parallel upsert requests
+PIPELINE_QUEUE_SIZE = 4
+UPSERT_WORKERS = 4
+
+# Batched inference: texts are sorted by token length and cut into batches of
+# at most EMBED_BATCH_SIZE texts and EMBED_MAX_BATCH_TOKENS padded tokens, so
+# each batch is padded only to its own longest text.
+EMBED_BATCH_SIZE = 32
+EMBED_MAX_BATCH_TOKENS = 8192
+EMBED_MAX_LENGTH = 512
+
+# Client mode: when set, embed_text() posts to a running embedding server
+# (server.py, which micro-batches concurrent requests) instead of running the
+# model in this process. e.g. "http://localhost:8001"
+EMBED_SERVER_URL = None
+EMBED_SERVER_TIMEOUT_S = 10
+
+# Persistent embedding cache: SQLite maps (model + backend, pooling, sha256(text))
+# to a row of a memory-mapped matrix of EMBED_CACHE_MAX_ENTRIES vectors; the
+# least recently used rows are evicted when it is full. Hits skip tokenization
+# and inference. 500k x 768 float16 = ~730 MB on disk.
+USE_EMBED_CACHE = True
+EMBED_CACHE_FOLDER = "./embedding_cache"
+EMBED_CACHE_MAX_ENTRIES = 500_000
+EMBED_CACHE_DTYPE = "float16"  # or "float32" (exact, twice the size)
+EMBED_CACHE_POOLING = f"mask_mean:{EMBED_MAX_LENGTH}"
+
+# Out-of-band chunk text: texts go to a memory-mapped chunk store keyed by chunk
+# id (see chunk_store.py), read by the Retrieval Service; vector store payloads
+# keep only PAYLOAD_FIELDS. False = the full text + metadata in every payload.
+USE_CHUNK_STORE = True
+CHUNK_STORE_FOLDER = "./chunk_store"
+PAYLOAD_FIELDS = ["filename", "original_doc_id", "chunk_index", "page_start", "page_end", "source_docs"]
+# Compact the chunk store's data file when more than this fraction of it is garbage
+CHUNK_STORE_COMPACT_RATIO = 0.5
+
+# Incremental indexing (files inside CHUNKS_FOLDER):
+# - chunk ids the Data Processing Service dropped, to delete from Qdrant
+# - size/mtime of every chunk file already indexed, so unchanged files are skipped
+DELETE_LIST_NAME = "deleted_chunk_ids.txt"
+INDEX_MANIFEST_NAME = "index_manifest.json"
+
 # Vector size for the chosen model
 # For CAMeL BERT base: hidden size = 768
 VECTOR_SIZE = 768
 
-# Initialize Qdrant client (assumes Qdrant is up & running)
-qdrant_client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+
+# ------------------ LAZY INIT ------------------
+def load_tokenizer():
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(MODEL_NAME)
+
+
+def torch_device():
+    import torch
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def load_model():
+    from transformers import AutoModel
+    return AutoModel.from_pretrained(MODEL_NAME).eval().to(torch_device())
+
+
+def load_vector_store():
+    if VECTOR_STORE == "local":
+        from local_index import LocalVectorIndex
+        return LocalVectorIndex(LOCAL_INDEX_FOLDER, dtype=LOCAL_INDEX_DTYPE)
+    # Assumes Qdrant is up & running
+    from qdrant_client import QdrantClient
+    return QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+
+
+def load_chunk_store():
+    from chunk_store import ChunkStore
+    return ChunkStore(CHUNK_STORE_FOLDER)
+
+
+def load_embedding_cache() -> "EmbeddingCache":
+    return EmbeddingCache(
+        EMBED_CACHE_FOLDER, EMBED_MODEL_KEY, EMBED_CACHE_POOLING,
+        EMBED_CACHE_MAX_ENTRIES, VECTOR_SIZE, EMBED_CACHE_DTYPE
+    )
+
+
+RESOURCES = {
+    "tokenizer": LazyResource("tokenizer", load_tokenizer),
+    "model": LazyResource("model", load_model),
+    "onnx_session": LazyResource("onnx_session", lambda: load_onnx_session(ONNX_MODEL_PATH)),
+    "vector_store": LazyResource("vector_store", load_vector_store),
+    "embedding_cache": LazyResource("embedding_cache", load_embedding_cache),
+    "chunk_store": LazyResource("chunk_store", load_chunk_store),
+}
+
+
+def get_embedding_cache() -> Optional["EmbeddingCache"]:
+    """
+    The embedding cache, or None when USE_EMBED_CACHE is off.
+    """
+    return RESOURCES["embedding_cache"].get() if USE_EMBED_CACHE else None
+
+
+def warm_up() -> Dict[str, float]:
+    """
+    Loads the tokenizer, the EMBED_BACKEND model, the embedding cache and the
+    vector store client, and embeds one text, so the first real batch pays no
+    initialization. Returns seconds spent per step.
+    """
+    timings = {}
+    names = ["tokenizer", "model" if EMBED_BACKEND == "torch" else "onnx_session", "vector_store"]
+    if USE_EMBED_CACHE:
+        names.append("embedding_cache")
+    for name in names:
+        t0 = time.perf_counter()
+        RESOURCES[name].get()
+        timings[name] = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    encoded, lengths = tokenize_texts(["تهيئة"])
+    infer_encoded(encoded, lengths, 1, EMBED_MAX_BATCH_TOKENS)
+    timings["first_batch"] = time.perf_counter() - t0
+    return timings
+
+
+# ------------------ EMBEDDING CACHE ------------------
+class EmbeddingCache:
+    """
+    Disk-backed embedding cache for one (model, pooling) pair.
+    SQLite maps text hashes to rows ("slots") of a memory-mapped vector matrix
+    with max_entries rows; once all rows are taken, the least recently used
+    entries are evicted. Thread-safe, and several processes may share one
+    cache folder: slots are allocated, and looked up and read, inside SQLite
+    write transactions.
+    """
+
+    def __init__(self, folder: str, model: str, pooling: str, max_entries: int, dim: int, dtype: str):
+        os.makedirs(folder, exist_ok=True)
+        self.model = model
+        self.pooling = pooling
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.db = sqlite3.connect(os.path.join(folder, "index.sqlite"), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "model TEXT, pooling TEXT, text_hash TEXT, slot INTEGER UNIQUE, last_used INTEGER, "
+            "PRIMARY KEY (model, pooling, text_hash))"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+        # The matrix layout must match the one on disk, else start over
+        vectors_path = os.path.join(folder, "vectors.bin")
+        layout = json.dumps({"max_entries": max_entries, "dim": dim, "dtype": self.dtype.name})
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'layout'").fetchone()
+        if row is None or row[0] != layout or not os.path.exists(vectors_path):
+            if row is not None:
+                print(f"[WARN] Embedding cache layout changed; clearing {folder}.")
+            self.db.execute("DELETE FROM entries")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('layout', ?)", (layout,))
+            self.db.commit()
+            mode = "w+"
+        else:
+            mode = "r+"
+        self.vectors = np.memmap(vectors_path, dtype=self.dtype, mode=mode, shape=(max_entries, dim))
+
+        self.clock = self.db.execute("SELECT COALESCE(MAX(last_used), 0) FROM entries").fetchone()[0]
+
+    def find_slots(self, text_hashes: List[str]) -> dict:
+        """
+        text hash -> slot for the hashes present in the cache (lock held).
+        """
+        found = {}
+        unique = list(set(text_hashes))
+        for i in range(0, len(unique), 500):
+            part = unique[i:i + 500]
+            found.update(self.db.execute(
+                "SELECT text_hash, slot FROM entries WHERE model = ? AND pooling = ? "
+                f"AND text_hash IN ({','.join('?' * len(part))})",
+                (self.model, self.pooling, *part)
+            ).fetchall())
+        return found
+
+    def get_many(self, text_hashes: List[str]) -> List[Optional[List[float]]]:
+        """
+        Cached vector (or None) for every text hash, in order.
+        """
+        with self.lock:
+            # The write lock is held from the lookup to the read, so another
+            # process cannot evict a found slot and overwrite its row in between
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                found = self.find_slots(text_hashes)
+                if found:
+                    self.clock += 1
+                    self.db.executemany(
+                        "UPDATE entries SET last_used = ? WHERE slot = ?",
+                        [(self.clock, slot) for slot in found.values()]
+                    )
+                vectors = [
+                    self.vectors[found[h]].astype(np.float32).tolist() if h in found else None
+                    for h in text_hashes
+                ]
+            except BaseException:
+                self.db.rollback()
+                raise
+            self.db.commit()
+            hits = sum(1 for v in vectors if v is not None)
+            self.hits += hits
+            self.misses += len(vectors) - hits
+        return vectors
+
+    def put_many(self, text_hashes: List[str], vectors: List[List[float]]):
+        """
+        Stores vectors, evicting least recently used entries when full.
+        """
+        with self.lock:
+            # The write lock is taken up front, so another process sharing the
+            # cache cannot hand out the same slots or insert the same hashes
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.put_locked(text_hashes, vectors)
+            except BaseException:
+                self.db.rollback()
+                raise
+            self.db.commit()
+
+    def put_locked(self, text_hashes: List[str], vectors: List[List[float]]):
+        """
+        put_many inside its write transaction.
+        """
+        new = dict(zip(text_hashes, vectors))
+        for h in self.find_slots(list(new)):
+            del new[h]
+        if not new:
+            return
+        new = dict(list(new.items())[-self.max_entries:])
+
+        # Occupied slots are always 0..used-1: new entries take the next
+        # slot, evicted slots are reused right away
+        used, clock = self.db.execute(
+            "SELECT COALESCE(MAX(slot) + 1, 0), COALESCE(MAX(last_used), 0) FROM entries"
+        ).fetchone()
+        slots = list(range(used, min(self.max_entries, used + len(new))))
+        if len(slots) < len(new):
+            victims = self.db.execute(
+                "SELECT slot FROM entries ORDER BY last_used LIMIT ?", (len(new) - len(slots),)
+            ).fetchall()
+            self.db.executemany("DELETE FROM entries WHERE slot = ?", victims)
+            slots.extend(slot for (slot,) in victims)
+            self.evictions += len(victims)
+
+        # Vectors hit the disk before the index points at them
+        self.vectors[slots] = np.asarray(list(new.values()), dtype=self.dtype)
+        self.vectors.flush()
+        self.clock = max(self.clock, clock) + 1
+        self.db.executemany(
+            "INSERT INTO entries VALUES (?, ?, ?, ?, ?)",
+            [(self.model, self.pooling, h, slot, self.clock) for h, slot in zip(new, slots)]
+        )
+
+    def stats(self) -> dict:
+        """
+        Hit / miss / eviction counts since this process opened the cache.
+        """
+        lookups = self.hits + self.misses
+        with self.lock:
+            entries = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "max_entries": self.max_entries,
+        }
+
+
+def text_sha256(text: str) -> str:
+    """
+    Cache key of a text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def cache_lookup(text_hashes: List[str]) -> List[Optional[List[float]]]:
+    """
+    Cached vectors for text hashes (all None when the cache is disabled).
+    """
+    cache = get_embedding_cache()
+    if cache is None:
+        return [None] * len(text_hashes)
+    return cache.get_many(text_hashes)
+
+
+def cache_store(text_hashes: List[str], vectors: List[List[float]]):
+    """
+    Adds freshly computed vectors to the cache (no-op when disabled).
+    """
+    cache = get_embedding_cache()
+    if cache is not None and text_hashes:
+        cache.put_many(text_hashes, vectors)
 
 
 # ------------------ EMBEDDING FUNCTION ------------------
+def mean_pool(last_hidden_state: "torch.Tensor", attention_mask: "torch.Tensor") -> "torch.Tensor":
+    """
+    Attention-mask-weighted mean over the sequence dimension:
+    padding positions are ignored, so a text gets the same vector whether it
+    is embedded alone or in a padded batch.
+    [batch, seq_len, hidden] -> [batch, hidden]
+    """
+    mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+    summed = (last_hidden_state * mask).sum(dim=1)
+    return summed / mask.sum(dim=1).clamp(min=1e-9)
+
+
+def length_batches(lengths: List[int], batch_size: int, max_batch_tokens: int) -> List[List[int]]:
+    """
+    Groups text indices, sorted by token length, into batches of at most
+    `batch_size` texts whose padded size (count * longest) stays within
+    `max_batch_tokens`.
+    """
+    batches = []
+    current = []
+    for i in sorted(range(len(lengths)), key=lengths.__getitem__):
+        # Sorted ascending, so the newcomer is the longest text of the batch
+        if current and (len(current) >= batch_size or (len(current) + 1) * lengths[i] > max_batch_tokens):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def tokenize_texts(texts: List[str]):
+    """
+    Tokenizes texts (truncated to EMBED_MAX_LENGTH, unpadded) for infer_encoded.
+    Returns (encoded, lengths).
+    """
+    encoded = RESOURCES["tokenizer"].get()(texts, max_length=EMBED_MAX_LENGTH, truncation=True)
+    return encoded, [len(ids) for ids in encoded["input_ids"]]
+
+
+def forward_torch(inputs: dict) -> "torch.Tensor":
+    """
+    last_hidden_state of the PyTorch model for a padded batch.
+    """
+    import torch
+
+    model = RESOURCES["model"].get()
+    inputs = {k: v.to(model.device) for k, v in inputs.items()}
+    with torch.inference_mode():
+        return model(**inputs).last_hidden_state
+
+
+def load_onnx_session(path: str) -> "ort.InferenceSession":
+    """
+    CPU ONNX Runtime session for an exported model (see export_onnx).
+    """
+    import onnxruntime as ort
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; run `python export_onnx.py` first.")
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+    return ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+
+
+def forward_onnx(inputs: dict, session: Optional["ort.InferenceSession"] = None) -> "torch.Tensor":
+    """
+    last_hidden_state from ONNX Runtime for a padded batch; the session for
+    ONNX_MODEL_PATH is opened on first use.
+    """
+    import torch
+
+    if session is None:
+        session = RESOURCES["onnx_session"].get()
+    feeds = {i.name: inputs[i.name].numpy().astype(np.int64) for i in session.get_inputs()}
+    return torch.from_numpy(session.run(["last_hidden_state"], feeds)[0])
+
+
+def forward_batch(inputs: dict) -> "torch.Tensor":
+    """
+    last_hidden_state from the configured EMBED_BACKEND.
+    """
+    if EMBED_BACKEND == "onnx":
+        return forward_onnx(inputs)
+    return forward_torch(inputs)
+
+
+def infer_encoded(
+    encoded,
+    lengths: List[int],
+    batch_size: int = EMBED_BATCH_SIZE,
+    max_batch_tokens: int = EMBED_MAX_BATCH_TOKENS,
+    forward=None
+) -> List[List[float]]:
+    """
+    Runs the model over tokenize_texts output in length-sorted batches (see
+    length_batches) with mask-aware mean pooling. `forward` maps a padded
+    batch to last_hidden_state (default: forward_batch, the configured backend).
+    Returns one vector per text, in input order.
+    """
+    forward = forward or forward_batch
+    vectors = [None] * len(lengths)
+    for batch in length_batches(lengths, batch_size, max_batch_tokens):
+        inputs = RESOURCES["tokenizer"].get().pad(
+            {k: [encoded[k][i] for i in batch] for k in encoded.keys()},
+            return_tensors="pt"
+        )
+        hidden = forward(inputs)
+        pooled = mean_pool(hidden, inputs["attention_mask"].to(hidden.device)).cpu().tolist()
+        for i, vector in zip(batch, pooled):
+            vectors[i] = vector
+    return vectors
+
+
+def embed_texts(
+    texts: List[str],
+    batch_size: int = EMBED_BATCH_SIZE,
+    max_batch_tokens: int = EMBED_MAX_BATCH_TOKENS
+) -> List[List[float]]:
+    """
+    Embeds many texts with batched inference (see length_batches) and
+    mask-aware mean pooling over the last hidden states. Texts found in the
+    embedding cache are not tokenized or run through the model.
+    Returns one 768-dimensional list of floats per text, in input order.
+    """
+    if not texts:
+        return []
+    text_hashes = [text_sha256(text) for text in texts]
+    vectors = cache_lookup(text_hashes)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        encoded, lengths = tokenize_texts([texts[i] for i in missing])
+        fresh = infer_encoded(encoded, lengths, batch_size, max_batch_tokens)
+        cache_store([text_hashes[i] for i in missing], fresh)
+        for i, vector in zip(missing, fresh):
+            vectors[i] = vector
+    return vectors
+
+
+def embed_remote(texts: List[str], url: str) -> List[List[float]]:
+    """
+    Embeds texts with the embedding server at `url` (see server.py).
+    """
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/embed",
+        data=json.dumps({"texts": texts}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=EMBED_SERVER_TIMEOUT_S) as response:
+        return json.load(response)["vectors"]
+
+
 def embed_text(text: str) -> List[float]:
     """
-    Embeds the text using the loaded Transformer model.
+    Embeds the text using the loaded Transformer model, or the embedding
+    server when EMBED_SERVER_URL is set.
     Returns a 768-dimensional list of floats (for BERT base).
     Uses a simple "mean pooling" across the last hidden states.
     """
-    inputs = TOKENIZER(
-        text,
-        return_tensors="pt",
-        max_length=512,
-        truncation=True
-    )
-    # If using GPU:
-    inputs = {k: v.to(device) for k, v in inputs.items()}
+    if EMBED_SERVER_URL:
+        return embed_remote([text], EMBED_SERVER_URL)[0]
+    return embed_texts([text])[0]
+
 
-    with torch.no_grad():
-        outputs = MODEL(**inputs)
-    
-    # outputs.last_hidden_state: [batch_size, seq_len, hidden_dim]
-    # We'll do a simple mean of the seq_len dimension
-    hidden_states = outputs.last_hidden_state.squeeze(0)  # shape: [seq_len, 768]
-    embedding_vector = hidden_states.mean(dim=0)          # shape: [768]
-    
-    # Optionally move to CPU if using GPU
-    # embedding_vector = embedding_vector.cpu()
+# ------------------ ONNX EXPORT ------------------
+def export_onnx(out_dir: str = ONNX_MODEL_DIR, quantize: bool = True) -> List[str]:
+    """
+    Exports MODEL_NAME to out_dir/model.onnx (inputs: input_ids, attention_mask,
+    token_type_ids; output: last_hidden_state, dynamic batch & sequence axes),
+    plus an int8 dynamically quantized out_dir/model.int8.onnx.
+    Returns the written paths.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel
 
-    return embedding_vector.tolist()
+    class LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.model(
+                input_ids=input_ids, attention_mask=attention_mask, token_type_ids=token_type_ids
+            ).last_hidden_state
+
+    os.makedirs(out_dir, exist_ok=True)
+    model = AutoModel.from_pretrained(MODEL_NAME).eval()
+    sample = RESOURCES["tokenizer"].get()(["نص تجريبي للتصدير", "نص"], padding=True, return_tensors="pt")
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    dynamic_axes = {0: "batch", 1: "sequence"}
+    with torch.inference_mode():
+        torch.onnx.export(
+            LastHiddenState(model),
+            (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask", "token_type_ids"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": dynamic_axes,
+                "attention_mask": dynamic_axes,
+                "token_type_ids": dynamic_axes,
+                "last_hidden_state": dynamic_axes,
+            },
+            opset_version=17,
+        )
+    paths = [fp32_path]
+    if quantize:
+        int8_path = os.path.join(out_dir, "model.int8.onnx")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        paths.append(int8_path)
+    return paths
 
 
 # ------------------ QDRANT COLLECTION INIT ------------------
 def init_collection():
     """
-    Creates a Qdrant collection (if it doesn't exist) with
+    Creates a Qdrant (or local index) collection (if it doesn't exist) with
     a vector dimension of 768 and cosine similarity distance.
     """
+    from qdrant_client.models import VectorParams, Distance
+
     try:
-        qdrant_client.create_collection(
+        RESOURCES["vector_store"].get().create_collection(
             collection_name=COLLECTION_NAME,
             vectors_config=VectorParams(
                 size=VECTOR_SIZE,
@@ -85,78 +605,419 @@ def init_collection():
         print(f"[INFO] Collection '{COLLECTION_NAME}' might already exist: {e}")
 
 
+# ------------------ CHUNK FILES ------------------
+def list_chunk_files(chunks_folder: str) -> List[str]:
+    """
+    Returns the chunk file names in chunks_folder: "*_chunks.jsonl" files, plus
+    legacy "*_chunks.json" files that have no JSONL counterpart.
+    """
+    names = set(os.listdir(chunks_folder))
+    chunk_files = []
+    for f in sorted(names):
+        lower = f.lower()
+        if lower.endswith("_chunks.jsonl"):
+            chunk_files.append(f)
+        elif lower.endswith("_chunks.json") and f + "l" not in names:
+            chunk_files.append(f)
+    return chunk_files
+
+
+def iter_chunk_records(file_path: str) -> Iterator[dict]:
+    """
+    Lazily yields chunk records from a chunk file.
+    JSONL files are read line by line; legacy JSON arrays are loaded whole.
+    """
+    with open(file_path, "r", encoding="utf-8") as f:
+        if file_path.lower().endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+
+def load_index_manifest(chunks_folder: str) -> dict:
+    """
+    Loads the index manifest (chunk file name -> {size, mtime_ns, collection}).
+    """
+    manifest_path = os.path.join(chunks_folder, INDEX_MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"[WARN] Could not read index manifest {manifest_path}: {e}")
+        return {}
+
+
+def save_index_manifest(chunks_folder: str, manifest: dict):
+    """
+    Atomically writes the index manifest.
+    """
+    manifest_path = os.path.join(chunks_folder, INDEX_MANIFEST_NAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def apply_delete_list(chunks_folder: str):
+    """
+    Deletes the chunk ids listed in DELETE_LIST_NAME from Qdrant (and their
+    texts from the chunk store), in batches, then removes the list.
+    """
+    from qdrant_client.models import PointIdsList
+
+    delete_path = os.path.join(chunks_folder, DELETE_LIST_NAME)
+    if not os.path.exists(delete_path):
+        return
+    with open(delete_path, "r", encoding="utf-8") as f:
+        chunk_ids = [line.strip() for line in f if line.strip()]
+
+    for i in range(0, len(chunk_ids), UPSERT_BATCH_SIZE):
+        RESOURCES["vector_store"].get().delete(
+            collection_name=COLLECTION_NAME,
+            points_selector=PointIdsList(points=chunk_ids[i:i + UPSERT_BATCH_SIZE])
+        )
+    if USE_CHUNK_STORE:
+        RESOURCES["chunk_store"].get().delete_many(chunk_ids)
+    os.remove(delete_path)
+    print(f"[INFO] Deleted {len(chunk_ids)} stale chunks from '{COLLECTION_NAME}'.")
+
+
 # ------------------ INDEXING CHUNKS ------------------
+def build_points(records: List[dict], vectors: List[List[float]]) -> List["PointStruct"]:
+    """
+    Qdrant points for chunk records and their vectors. With USE_CHUNK_STORE
+    the payload is only the PAYLOAD_FIELDS of the metadata.
+    """
+    from qdrant_client.models import PointStruct
+
+    if USE_CHUNK_STORE:
+        payloads = [
+            {k: record["metadata"][k] for k in PAYLOAD_FIELDS if k in record["metadata"]}
+            for record in records
+        ]
+    else:
+        # Merge the chunk text with metadata so Qdrant stores it all
+        payloads = [{"text": record["text"], **record["metadata"]} for record in records]
+    return [
+        PointStruct(id=record["id"], vector=vector, payload=payload)
+        for record, vector, payload in zip(records, vectors, payloads)
+    ]
+
+
+def write_points(records: List[dict], vectors: List[List[float]]):
+    """
+    Stores the chunk texts (with USE_CHUNK_STORE), then upserts the points.
+    Texts go first, so a point is never found without its text.
+    """
+    if USE_CHUNK_STORE:
+        RESOURCES["chunk_store"].get().put_many([(record["id"], record["text"]) for record in records])
+    RESOURCES["vector_store"].get().upsert(
+        collection_name=COLLECTION_NAME,
+        points=build_points(records, vectors)
+    )
+
+
+def upsert_records(records: List[dict]):
+    """
+    Embeds a batch of chunk records (see embed_texts) and upserts them into Qdrant.
+    """
+    vectors = embed_texts([record["text"] for record in records])
+    write_points(records, vectors)
+
+
+# ------------------ INDEXING PIPELINE ------------------
+# reader -> tokenizer -> inference -> UPSERT_WORKERS upserters, one thread
+# each, joined by queues of at most PIPELINE_QUEUE_SIZE windows. A window is
+# up to UPSERT_BATCH_SIZE records of one chunk file, and is upserted as one
+# batch. Disk, tokenization, inference and network overlap; the bounded
+# queues keep memory flat when one stage is slower than the others.
+PIPELINE_DONE = object()
+
+
+class StageCounter:
+    """
+    Records, windows and busy time (excluding queue waits) of one pipeline stage.
+    """
+
+    def __init__(self, name: str, threads: int = 1):
+        self.name = name
+        self.threads = threads
+        self.records = 0
+        self.windows = 0
+        self.busy_s = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, records: int, seconds: float):
+        with self.lock:
+            self.records += records
+            self.windows += 1
+            self.busy_s += seconds
+
+    def summary(self, wall_s: float) -> dict:
+        return {
+            "records": self.records,
+            "windows": self.windows,
+            "busy_s": round(self.busy_s, 3),
+            "records_per_busy_s": round(self.records / self.busy_s, 1) if self.busy_s else None,
+            # Share of the wall time this stage's threads were working
+            "utilization": round(self.busy_s / max(wall_s * self.threads, 1e-9), 3),
+        }
+
+
+def pipeline_put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """
+    Blocking put that gives up (returns False) once the pipeline is stopping.
+    """
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def pipeline_get(q: queue.Queue, stop: threading.Event):
+    """
+    Blocking get; returns PIPELINE_DONE once the pipeline is stopping.
+    """
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return PIPELINE_DONE
+
+
+def index_files_pipelined(chunks_folder: str, chunk_files: List[Tuple[str, dict]], manifest: dict) -> dict:
+    """
+    Embeds and upserts `chunk_files` ((file name, manifest entry) pairs)
+    through the indexing pipeline. A file's manifest entry is saved once all
+    of its windows are upserted. Re-raises the first stage error.
+    Returns the per-stage counters (see StageCounter.summary).
+    """
+    stop = threading.Event()
+    errors = []
+    read_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    token_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    vector_q = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    counters = {
+        "read": StageCounter("read"),
+        "cache": StageCounter("cache"),
+        "tokenize": StageCounter("tokenize"),
+        "inference": StageCounter("inference"),
+        "upsert": StageCounter("upsert", UPSERT_WORKERS),
+    }
+
+    # Per file: windows sent by the reader (None until the file is fully read)
+    # and windows upserted so far
+    progress = {file_name: {"entry": entry, "total": None, "done": 0} for file_name, entry in chunk_files}
+    progress_lock = threading.Lock()
+    progress_bar = tqdm(total=len(chunk_files), desc="Indexing chunk files")
+
+    def window_done(file_name: str, total: Optional[int] = None):
+        with progress_lock:
+            state = progress[file_name]
+            if total is None:
+                state["done"] += 1
+            else:
+                state["total"] = total
+            if state["total"] is not None and state["done"] == state["total"]:
+                manifest[file_name] = state["entry"]
+                save_index_manifest(chunks_folder, manifest)
+                progress_bar.update(1)
+
+    def send_window(file_name: str, records: List[dict]) -> bool:
+        # Cache hits travel with the window and skip tokenize/inference
+        t0 = time.perf_counter()
+        text_hashes = [text_sha256(record["text"]) for record in records]
+        vectors = cache_lookup(text_hashes)
+        counters["cache"].add(len(records), time.perf_counter() - t0)
+        return pipeline_put(read_q, (file_name, records, text_hashes, vectors), stop)
+
+    def reader():
+        for file_name, _ in chunk_files:
+            windows = 0
+            records = []
+            t0 = time.perf_counter()
+            for record in iter_chunk_records(os.path.join(chunks_folder, file_name)):
+                if record["metadata"].get("duplicate_of"):
+                    # Near-duplicate of a canonical chunk indexed from another record
+                    continue
+                records.append(record)
+                if len(records) >= UPSERT_BATCH_SIZE:
+                    counters["read"].add(len(records), time.perf_counter() - t0)
+                    if not send_window(file_name, records):
+                        return
+                    windows += 1
+                    records = []
+                    t0 = time.perf_counter()
+            if records:
+                counters["read"].add(len(records), time.perf_counter() - t0)
+                if not send_window(file_name, records):
+                    return
+                windows += 1
+            window_done(file_name, total=windows)
+        pipeline_put(read_q, PIPELINE_DONE, stop)
+
+    def tokenizer():
+        while True:
+            item = pipeline_get(read_q, stop)
+            if item is PIPELINE_DONE:
+                break
+            file_name, records, text_hashes, vectors = item
+            missing = [i for i, vector in enumerate(vectors) if vector is None]
+            encoded, lengths = None, []
+            if missing:
+                t0 = time.perf_counter()
+                encoded, lengths = tokenize_texts([records[i]["text"] for i in missing])
+                counters["tokenize"].add(len(missing), time.perf_counter() - t0)
+            if not pipeline_put(token_q, (file_name, records, text_hashes, vectors, missing, encoded, lengths), stop):
+                return
+        pipeline_put(token_q, PIPELINE_DONE, stop)
+
+    def inference():
+        while True:
+            item = pipeline_get(token_q, stop)
+            if item is PIPELINE_DONE:
+                break
+            file_name, records, text_hashes, vectors, missing, encoded, lengths = item
+            if missing:
+                t0 = time.perf_counter()
+                fresh = infer_encoded(encoded, lengths)
+                counters["inference"].add(len(missing), time.perf_counter() - t0)
+                cache_store([text_hashes[i] for i in missing], fresh)
+                for i, vector in zip(missing, fresh):
+                    vectors[i] = vector
+            if not pipeline_put(vector_q, (file_name, records, vectors), stop):
+                return
+        for _ in range(UPSERT_WORKERS):
+            pipeline_put(vector_q, PIPELINE_DONE, stop)
+
+    def upserter():
+        while True:
+            item = pipeline_get(vector_q, stop)
+            if item is PIPELINE_DONE:
+                break
+            file_name, records, vectors = item
+            t0 = time.perf_counter()
+            write_points(records, vectors)
+            counters["upsert"].add(len(records), time.perf_counter() - t0)
+            window_done(file_name)
+
+    def run_stage(fn):
+        try:
+            fn()
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    stages = [reader, tokenizer, inference] + [upserter] * UPSERT_WORKERS
+    threads = [threading.Thread(target=run_stage, args=(fn,), daemon=True) for fn in stages]
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_s = time.perf_counter() - t0
+    progress_bar.close()
+
+    if errors:
+        raise errors[0]
+    return {"wall_s": round(wall_s, 3), **{name: c.summary(wall_s) for name, c in counters.items()}}
+
+
 def index_chunks(chunks_folder: str):
     """
-    Reads all *_chunks.json files in the chunks_folder, embeds their text,
-    and upserts them into Qdrant.
+    Reads all *_chunks.jsonl (and legacy *_chunks.json) files in the chunks_folder,
+    embeds their text with batched inference, and upserts them into Qdrant in
+    batches of UPSERT_BATCH_SIZE, through the indexing pipeline
+    (see index_files_pipelined), then prints per-stage throughput.
+    Stale chunk ids from the delete list are removed first, and chunk files
+    unchanged since they were last indexed into COLLECTION_NAME are skipped.
+    Records marked as duplicates ("duplicate_of") are not embedded.
     Each record is stored as:
       - id: record["id"]
       - vector: embedding
-      - payload: record["metadata"]
+      - payload: the PAYLOAD_FIELDS of record["metadata"], with the text in the
+        chunk store (USE_CHUNK_STORE), or else the text + all metadata
     """
-    # Gather all files that end with "_chunks.json"
-    all_chunk_files = [
-        f for f in os.listdir(chunks_folder)
-        if f.lower().endswith("_chunks.json")
-    ]
+    apply_delete_list(chunks_folder)
+
+    manifest = load_index_manifest(chunks_folder)
+    # Files indexed into Qdrant still need indexing into a local index, and vice versa
+    collection_key = COLLECTION_NAME if VECTOR_STORE == "qdrant" else f"local:{COLLECTION_NAME}"
+    all_chunk_files = []
+    for file_name in list_chunk_files(chunks_folder):
+        stat = os.stat(os.path.join(chunks_folder, file_name))
+        entry = {
+            "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "collection": collection_key,
+            # Switching payload layouts re-indexes every file
+            "payload": "slim" if USE_CHUNK_STORE else "full",
+        }
+        if manifest.get(file_name) != entry:
+            all_chunk_files.append((file_name, entry))
     if not all_chunk_files:
-        print(f"[INFO] No chunk files found in {chunks_folder}.")
+        print(f"[INFO] No new or changed chunk files found in {chunks_folder}.")
         return
 
-    print(f"[INFO] Found {len(all_chunk_files)} chunk files to index.")
-
-    for file_name in tqdm(all_chunk_files, desc="Indexing chunk files"):
-        file_path = os.path.join(chunks_folder, file_name)
-        with open(file_path, "r", encoding="utf-8") as f:
-            records = json.load(f)
-
-        # Optionally, you can embed in batch for efficiency.
-        # We'll do a simple loop for clarity.
-        # If you do batch embedding, you should tokenize multiple texts at once 
-        # and pass them to MODEL for faster inference on GPU.
-
-        points_to_upsert = []
-        for record in records:
-            text = record["text"]
-            record_id = record["id"]
-            # metadata = record.get("metadata", {})
-
-            # Embed text
-            vector = embed_text(text)
-
-            # Create a Qdrant PointStruct
-            point = PointStruct(
-                id=record_id,
-                vector=vector,
-                # Merge the chunk text with metadata so Qdrant stores it all
-                payload={
-                    "text": text,         # <-- Add the text here
-                    **record["metadata"]            # Spread the metadata keys
-                }
-            )
-            points_to_upsert.append(point)
+    print(f"[INFO] Found {len(all_chunk_files)} new or changed chunk files to index.")
 
-        # Batch upsert the entire list of points
-        qdrant_client.upsert(
-            collection_name=COLLECTION_NAME,
-            points=points_to_upsert
-        )
+    stats = index_files_pipelined(chunks_folder, all_chunk_files, manifest)
+    for name in ("read", "cache", "tokenize", "inference", "upsert"):
+        stage = stats[name]
+        print(f"[INFO] {name:>9}: {stage['records']} records, {stage['records_per_busy_s']} records/s busy, "
+              f"{stage['utilization']:.0%} utilization")
+    bottleneck = max(("read", "tokenize", "inference", "upsert"), key=lambda n: stats[n]["utilization"])
+    print(f"[INFO] Indexed in {stats['wall_s']}s; bottleneck stage: {bottleneck}.")
+    if USE_EMBED_CACHE:
+        cache = get_embedding_cache().stats()
+        print(f"[INFO] Embedding cache: {cache['hits']} hits / {cache['hits'] + cache['misses']} lookups "
+              f"({cache['hit_rate']:.1%}), {cache['evictions']} evictions, "
+              f"{cache['entries']}/{cache['max_entries']} entries.")
+    if USE_CHUNK_STORE:
+        compact_chunk_store()
+
+
+def compact_chunk_store():
+    """
+    Prints the chunk store size, and compacts it when garbage (overwritten or
+    deleted texts) exceeds CHUNK_STORE_COMPACT_RATIO of its data file.
+    """
+    store = RESOURCES["chunk_store"].get()
+    stats = store.stats()
+    garbage = stats["file_bytes"] - stats["live_bytes"]
+    print(f"[INFO] Chunk store: {stats['chunks']} texts, {stats['live_bytes'] / 2**20:.1f} MB live, "
+          f"{garbage / 2**20:.1f} MB garbage.")
+    if stats["file_bytes"] and garbage / stats["file_bytes"] > CHUNK_STORE_COMPACT_RATIO:
+        store.compact()
+        print(f"[INFO] Compacted the chunk store ({garbage / 2**20:.1f} MB reclaimed).")
 
 
 # ------------------ MAIN ------------------
 if __name__ == "__main__":
     """
     Usage:
-      1) Start Qdrant (on localhost:6333 or your chosen host/port).
-      2) Ensure you have chunked JSON files from the Data Processing Service 
-         in CHUNKS_FOLDER (each file ending with _chunks.json).
+      1) Start Qdrant (on localhost:6333 or your chosen host/port),
+         or set VECTOR_STORE = "local".
+      2) Ensure you have chunk files from the Data Processing Service 
+         in CHUNKS_FOLDER (each file ending with _chunks.jsonl or _chunks.json).
       3) python app.py
     """
-    # Step 1: Initialize Qdrant collection
+    # Step 1: Initialize Qdrant (or local index) collection
     init_collection()
 
     # Step 2: Index chunk files
     index_chunks(CHUNKS_FOLDER)
 
+    # Step 3: (local index) rebuild the approximate index if the collection changed
+    if VECTOR_STORE == "local" and LOCAL_INDEX_IVF_LISTS:
+        ivf = RESOURCES["vector_store"].get().build_ivf(COLLECTION_NAME, LOCAL_INDEX_IVF_LISTS)
+        if ivf["rebuilt"]:
+            print(f"[INFO] Built IVF index: {ivf['rows']} vectors in {ivf['lists']} lists.")
+
     print("[INFO] Embedding & indexing complete.")
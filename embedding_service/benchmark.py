@@ -0,0 +1,367 @@
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import numpy as np
+from qdrant_client.models import VectorParams, Distance
+import app as embedding
+from local_index import LocalVectorIndex
+from server import EMBED_SERVER_MAX_BATCH, EMBED_SERVER_MAX_WAIT_MS, MicroBatcher
+from app import (
+    CHUNKS_FOLDER,
+    COLLECTION_NAME,
+    VECTOR_SIZE,
+    LOCAL_INDEX_FOLDER,
+    ONNX_MODEL_DIR,
+    EMBED_BATCH_SIZE,
+    EMBED_MAX_BATCH_TOKENS,
+    list_chunk_files,
+    iter_chunk_records,
+    embed_text,
+    embed_texts,
+    tokenize_texts,
+    infer_encoded,
+    forward_torch,
+    forward_onnx,
+    load_onnx_session,
+    embed_remote,
+)
+
+# ---------------------- CONFIG ----------------------
+# Small MSA vocabulary for synthetic chunks (used when there are no chunk files)
+ARABIC_WORDS = [
+    "الجامعة", "الطالب", "القبول", "التسجيل", "السنة", "التحضيرية", "البرنامج",
+    "الدراسة", "الكلية", "المقرر", "الفصل", "الدراسي", "الاختبار", "النهائي",
+    "اللائحة", "المادة", "الساعات", "المعتمدة", "المعدل", "التراكمي", "الخطة",
+]
+
+
+# ---------------------- CORPUS ----------------------
+def load_chunk_texts(chunks_folder: str, limit: int) -> List[str]:
+    """
+    Up to `limit` chunk texts from the chunk files in `chunks_folder`.
+    """
+    texts = []
+    if not os.path.isdir(chunks_folder):
+        return texts
+    for file_name in list_chunk_files(chunks_folder):
+        for record in iter_chunk_records(os.path.join(chunks_folder, file_name)):
+            texts.append(record["text"])
+            if len(texts) >= limit:
+                return texts
+    return texts
+
+
+def synthetic_chunk_texts(n: int, seed: int = 0) -> List[str]:
+    """
+    `n` synthetic chunks of 20-400 words, so lengths vary like real chunks.
+    """
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(ARABIC_WORDS) for _ in range(rng.randint(20, 400))) for _ in range(n)]
+
+
+# ---------------------- VERIFY + BENCHMARK ----------------------
+def max_vector_diff(reference: List[List[float]], vectors: List[List[float]]) -> dict:
+    """
+    Largest absolute difference and lowest cosine similarity between two lists of vectors.
+    """
+    a = np.asarray(reference, dtype=np.float64)
+    b = np.asarray(vectors, dtype=np.float64)
+    cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return {
+        "max_abs_diff": float(np.abs(a - b).max()),
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+    }
+
+
+def benchmark_embedding(texts: List[str], batch_sizes: List[int], max_batch_tokens: int) -> dict:
+    """
+    chunks/sec of the one-at-a-time embed_text loop vs embed_texts at each
+    batch size, plus the vector differences against the loop.
+    The embedding cache is bypassed so every run does the full compute.
+    """
+    embedding.USE_EMBED_CACHE = False
+    # Warm-up (first call pays lazy initialization)
+    embed_texts(texts[:2])
+
+    t0 = time.perf_counter()
+    reference = [embed_text(text) for text in texts]
+    loop_s = time.perf_counter() - t0
+    report = {
+        "chunks": len(texts),
+        "loop": {"seconds": loop_s, "chunks_per_s": len(texts) / loop_s},
+        "batched": {},
+    }
+    for batch_size in batch_sizes:
+        t0 = time.perf_counter()
+        vectors = embed_texts(texts, batch_size=batch_size, max_batch_tokens=max_batch_tokens)
+        batched_s = time.perf_counter() - t0
+        report["batched"][str(batch_size)] = {
+            "seconds": batched_s,
+            "chunks_per_s": len(texts) / batched_s,
+            "speedup": loop_s / batched_s,
+            **max_vector_diff(reference, vectors),
+        }
+    return report
+
+
+def backend_forwards(onnx_dir: str) -> dict:
+    """
+    Backend name -> forward function (see infer_encoded) for PyTorch and
+    every exported ONNX model found in `onnx_dir`.
+    """
+    forwards = {"torch": forward_torch}
+    for name, file_name in (("onnx_fp32", "model.onnx"), ("onnx_int8", "model.int8.onnx")):
+        path = os.path.join(onnx_dir, file_name)
+        if not os.path.exists(path):
+            print(f"[WARN] {path} not found (run export_onnx.py); skipping {name}.", file=sys.stderr)
+            continue
+        session = load_onnx_session(path)
+        forwards[name] = lambda inputs, session=session: forward_onnx(inputs, session)
+    return forwards
+
+
+def benchmark_backends(texts: List[str], queries: List[str], onnx_dir: str, batch_size: int) -> dict:
+    """
+    Per backend: batched throughput over `texts`, single-query latency over
+    `queries`, and cosine parity of the chunk vectors with PyTorch.
+    """
+    encoded, lengths = tokenize_texts(texts)
+    encoded_queries = [tokenize_texts([query]) for query in queries]
+    report = {"chunks": len(texts), "queries": len(queries), "backends": {}}
+    reference = None
+    for name, forward in backend_forwards(onnx_dir).items():
+        # Warm-up
+        infer_encoded(*encoded_queries[0], 1, EMBED_MAX_BATCH_TOKENS, forward)
+
+        t0 = time.perf_counter()
+        vectors = infer_encoded(encoded, lengths, batch_size, EMBED_MAX_BATCH_TOKENS, forward)
+        batched_s = time.perf_counter() - t0
+
+        latencies = []
+        for query_encoded, query_lengths in encoded_queries:
+            t0 = time.perf_counter()
+            infer_encoded(query_encoded, query_lengths, 1, EMBED_MAX_BATCH_TOKENS, forward)
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+        if reference is None:
+            reference = vectors
+        report["backends"][name] = {
+            "chunks_per_s": len(texts) / batched_s,
+            "query_p50_ms": float(np.percentile(latencies, 50)),
+            "query_p95_ms": float(np.percentile(latencies, 95)),
+            "parity_vs_torch": max_vector_diff(reference, vectors),
+        }
+    return report
+
+
+def clustered_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    """
+    `n` synthetic vectors around n / 100 random centers, so an IVF has
+    structure to find (like topic clusters of real chunks).
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 100), dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), n)
+    return centers[labels] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> List[set]:
+    """
+    Ground truth: top-k row ids per query by float32 cosine similarity.
+    """
+    matrix = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    truth = []
+    for query in queries:
+        scores = matrix @ (query / np.linalg.norm(query))
+        truth.append(set(np.argpartition(-scores, k - 1)[:k].tolist()))
+    return truth
+
+
+def time_search(index: LocalVectorIndex, queries: np.ndarray, truth: List[set], k: int, nprobe: int) -> dict:
+    """
+    p50/p95 search latency and mean recall@k against `truth`.
+    """
+    latencies, recalls = [], []
+    for query, expected in zip(queries, truth):
+        t0 = time.perf_counter()
+        hits = index.search("bench", query.tolist(), limit=k, with_payload=False, nprobe=nprobe)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        recalls.append(len({int(hit.id) for hit in hits} & expected) / k)
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        f"recall@{k}": float(np.mean(recalls)),
+    }
+
+
+def benchmark_local_index(
+    vectors: np.ndarray, queries: np.ndarray, k: int, dtypes: List[str], n_lists: int, nprobes: List[int],
+    ram_mb: int
+) -> dict:
+    """
+    Per storage dtype: exact search, then IVF search at each nprobe, against
+    exact float32 search over the same vectors.
+    """
+    truth = exact_top_k(vectors, queries, k)
+    report = {"vectors": len(vectors), "dim": vectors.shape[1], "queries": len(queries), "dtypes": {}}
+    for dtype in dtypes:
+        folder = tempfile.mkdtemp(prefix="local_index_bench_")
+        try:
+            index = LocalVectorIndex(folder, dtype=dtype, ram_mb=ram_mb)
+            index.create_collection("bench", VectorParams(size=vectors.shape[1], distance=Distance.COSINE))
+            collection = index.collection("bench")
+            t0 = time.perf_counter()
+            for start in range(0, len(vectors), 4096):
+                rows = range(start, min(start + 4096, len(vectors)))
+                collection.upsert([str(i) for i in rows], vectors[start:start + 4096], [None] * len(rows))
+            result = {"load_s": time.perf_counter() - t0, "exact": time_search(index, queries, truth, k, 0)}
+            if n_lists:
+                t0 = time.perf_counter()
+                index.build_ivf("bench", n_lists)
+                result["ivf_build_s"] = time.perf_counter() - t0
+                result["ivf"] = {
+                    str(nprobe): time_search(index, queries, truth, k, nprobe) for nprobe in nprobes
+                }
+            report["dtypes"][dtype] = result
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+    return report
+
+
+def time_concurrent(embed_one: Callable[[str], List[float]], queries: List[str], concurrency: int) -> dict:
+    """
+    Embeds every query from `concurrency` client threads; throughput and
+    per-request latency percentiles.
+    """
+    def timed(query):
+        t0 = time.perf_counter()
+        embed_one(query)
+        return (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(timed, queries))
+    wall_s = time.perf_counter() - t0
+    return {
+        "requests_per_s": len(queries) / wall_s,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+def benchmark_server(
+    queries: List[str], concurrency_levels: List[int], url: str, max_batch: int, max_wait_ms: float
+) -> dict:
+    """
+    Single-query embedding under concurrent load: one forward pass per request
+    vs micro-batching (in-process MicroBatcher), or a running server at `url`.
+    """
+    if url:
+        modes = {"http": lambda query: embed_remote([query], url)}
+    else:
+        batchers = {"unbatched": MicroBatcher(1, 0), "micro_batched": MicroBatcher(max_batch, max_wait_ms)}
+        modes = {name: (lambda query, b=b: b.submit([query]).result()) for name, b in batchers.items()}
+    report = {"requests": len(queries), "max_batch": max_batch, "max_wait_ms": max_wait_ms, "modes": {}}
+    for name, embed_one in modes.items():
+        embed_one(queries[0])  # Warm-up
+        report["modes"][name] = {str(c): time_concurrent(embed_one, queries, c) for c in concurrency_levels}
+        if not url:
+            report["modes"][name]["batcher"] = batchers[name].stats()
+    return report
+
+
+# ---------------------- MAIN ----------------------
+if __name__ == "__main__":
+    """
+    Usage (from this folder):
+      python benchmark.py embed [--chunks-folder ./processed_chunks] [--limit 512] [--batch-sizes 8 16 32 64]
+      python benchmark.py backends [--onnx-dir ./onnx_model] [--limit 256] [--queries 100]
+      python benchmark.py local-index [--vectors 100000 | --from-index] [--lists 1024] [--nprobes 4 8 16 32]
+      python benchmark.py server [--concurrency 1 8 32] [--requests 512] [--url http://localhost:8001]
+    Falls back to synthetic chunks when the folder has no chunk files.
+    """
+    parser = argparse.ArgumentParser(description="Embedding benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    embed_parser = subparsers.add_parser("embed", help="embed_text loop vs batched embed_texts")
+    embed_parser.add_argument("--chunks-folder", default=CHUNKS_FOLDER)
+    embed_parser.add_argument("--limit", type=int, default=512, help="chunks to embed")
+    embed_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 16, EMBED_BATCH_SIZE, 64])
+    embed_parser.add_argument("--max-batch-tokens", type=int, default=EMBED_MAX_BATCH_TOKENS)
+
+    backends_parser = subparsers.add_parser("backends", help="PyTorch vs ONNX fp32 vs ONNX int8: parity, latency, throughput")
+    backends_parser.add_argument("--chunks-folder", default=CHUNKS_FOLDER)
+    backends_parser.add_argument("--onnx-dir", default=ONNX_MODEL_DIR)
+    backends_parser.add_argument("--limit", type=int, default=256, help="chunks to embed")
+    backends_parser.add_argument("--queries", type=int, default=100, help="single-query latency samples")
+    backends_parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+
+    local_parser = subparsers.add_parser("local-index", help="local vector index: exact vs IVF recall@k and latency")
+    local_parser.add_argument("--vectors", type=int, default=100_000, help="synthetic vectors to index")
+    local_parser.add_argument("--from-index", action="store_true",
+                              help=f"use the vectors of {COLLECTION_NAME} in LOCAL_INDEX_FOLDER instead")
+    local_parser.add_argument("--queries", type=int, default=200)
+    local_parser.add_argument("--k", type=int, default=10)
+    local_parser.add_argument("--dtypes", nargs="+", default=["float16", "int8"])
+    local_parser.add_argument("--lists", type=int, default=1024, help="IVF lists (0 = exact only)")
+    local_parser.add_argument("--nprobes", type=int, nargs="+", default=[4, 8, 16, 32])
+    local_parser.add_argument("--ram-mb", type=int, default=0,
+                              help="search from a float32 copy in RAM when it fits (0 = always from the memmap)")
+
+    server_parser = subparsers.add_parser("server", help="per-request inference vs micro-batching under concurrency")
+    server_parser.add_argument("--chunks-folder", default=CHUNKS_FOLDER)
+    server_parser.add_argument("--requests", type=int, default=512)
+    server_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    server_parser.add_argument("--max-batch", type=int, default=EMBED_SERVER_MAX_BATCH)
+    server_parser.add_argument("--max-wait-ms", type=float, default=EMBED_SERVER_MAX_WAIT_MS)
+    server_parser.add_argument("--url", default=None, help="benchmark a running server.py instead")
+
+    args = parser.parse_args()
+    if args.command == "server":
+        embedding.USE_EMBED_CACHE = False
+        texts = load_chunk_texts(args.chunks_folder, args.requests)
+        if not texts:
+            print(f"[WARN] No chunk files in {args.chunks_folder}; using synthetic chunks.", file=sys.stderr)
+            texts = synthetic_chunk_texts(args.requests)
+        # Query-sized inputs: the first few words of the chunks
+        queries = [" ".join(text.split()[:12]) for text in texts]
+        report = benchmark_server(queries, args.concurrency, args.url, args.max_batch, args.max_wait_ms)
+        print(json.dumps(report, indent=2))
+    elif args.command == "local-index":
+        if args.from_index:
+            collection = LocalVectorIndex(LOCAL_INDEX_FOLDER).collection(COLLECTION_NAME)
+            vectors = collection.read_rows(0, collection.count)
+        else:
+            vectors = clustered_vectors(args.vectors, VECTOR_SIZE)
+        # Queries: perturbed corpus vectors, so each has close but not identical neighbours
+        rng = np.random.default_rng(1)
+        queries = vectors[rng.choice(len(vectors), args.queries)]
+        queries = queries + 0.3 * np.abs(queries).mean() * rng.standard_normal(queries.shape).astype(np.float32)
+        report = benchmark_local_index(vectors, queries, args.k, args.dtypes, args.lists, args.nprobes, args.ram_mb)
+        print(json.dumps(report, indent=2))
+    elif args.command == "backends":
+        embedding.USE_EMBED_CACHE = False
+        texts = load_chunk_texts(args.chunks_folder, args.limit)
+        if not texts:
+            print(f"[WARN] No chunk files in {args.chunks_folder}; using synthetic chunks.", file=sys.stderr)
+            texts = synthetic_chunk_texts(args.limit)
+        # Query-sized inputs: the first few words of the chunks
+        queries = [" ".join(text.split()[:12]) for text in texts][:args.queries]
+        report = benchmark_backends(texts, queries, args.onnx_dir, args.batch_size)
+        print(json.dumps(report, indent=2))
+    elif args.command == "embed":
+        texts = load_chunk_texts(args.chunks_folder, args.limit)
+        if not texts:
+            print(f"[WARN] No chunk files in {args.chunks_folder}; using synthetic chunks.", file=sys.stderr)
+            texts = synthetic_chunk_texts(args.limit)
+        report = benchmark_embedding(texts, args.batch_sizes, args.max_batch_tokens)
+        print(json.dumps(report, indent=2))
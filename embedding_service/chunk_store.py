@@ -0,0 +1,155 @@
+import os
+import mmap
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List, Tuple
+
+
+# ------------------ CHUNK STORE ------------------
+class ChunkStore:
+    """
+    Chunk texts keyed by chunk id, kept outside the vector store so its
+    payloads only hold filterable fields.
+    Texts are appended back to back as UTF-8 to texts.<generation>.bin, which
+    readers memory-map; SQLite maps each chunk id to (offset, length) and the
+    sha256 of its text. Overwritten and deleted texts stay in the data file
+    until compact() rewrites it as the next generation; the previous
+    generation's file is kept until the compaction after that, for readers
+    in other processes that still use its offsets.
+    Thread-safe; other processes' writes are seen on the next read.
+    """
+
+    def __init__(self, folder: str):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(folder, "index.sqlite"), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, offset INTEGER, length INTEGER, text_hash TEXT)"
+        )
+        self.db.execute("INSERT OR IGNORE INTO meta VALUES ('generation', 0)")
+        self.db.commit()
+        self.map = None
+        self.map_generation = None
+
+    def data_path(self, generation: int) -> str:
+        return os.path.join(self.folder, f"texts.{generation}.bin")
+
+    def read_generation(self) -> int:
+        return self.db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+
+    def mapped(self, generation: int, end: int) -> mmap.mmap:
+        """
+        Read-only map of the data file of `generation`, re-mapped when it is
+        another generation or shorter than `end` bytes (the file grew).
+        """
+        if self.map is None or self.map_generation != generation or len(self.map) < end:
+            if self.map is not None:
+                self.map.close()
+            with open(self.data_path(generation), "rb") as f:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.map_generation = generation
+        return self.map
+
+    def lookup(self, ids: List[str], columns: str) -> List[tuple]:
+        rows = []
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            marks = ",".join("?" * len(batch))
+            rows += self.db.execute(f"SELECT id, {columns} FROM chunks WHERE id IN ({marks})", batch).fetchall()
+        return rows
+
+    def put_many(self, items: List[Tuple[str, str]]):
+        """
+        Stores (chunk id, text) pairs. Texts already stored unchanged are not rewritten.
+        """
+        with self.lock:
+            stored = dict(self.lookup([chunk_id for chunk_id, _ in items], "text_hash"))
+            rows = []
+            with open(self.data_path(self.read_generation()), "ab") as f:
+                offset = f.tell()
+                for chunk_id, text in items:
+                    data = text.encode("utf-8")
+                    text_hash = hashlib.sha256(data).hexdigest()
+                    if stored.get(chunk_id) == text_hash:
+                        continue
+                    f.write(data)
+                    rows.append((chunk_id, offset, len(data), text_hash))
+                    stored[chunk_id] = text_hash
+                    offset += len(data)
+            if rows:
+                self.db.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?)", rows)
+                self.db.commit()
+
+    def get_many(self, ids: List[str]) -> Dict[str, str]:
+        """
+        chunk id -> text for the ids that are stored.
+        """
+        if not ids:
+            return {}
+        with self.lock:
+            for attempt in range(2):
+                while True:
+                    generation = self.read_generation()
+                    rows = self.lookup(list(ids), "offset, length")
+                    # A compaction in between moved the texts: read the offsets again
+                    if self.read_generation() == generation:
+                        break
+                end = max((offset + length for _, offset, length in rows), default=0)
+                if end == 0:
+                    return {chunk_id: "" for chunk_id, _, _ in rows}
+                try:
+                    data = self.mapped(generation, end)
+                except FileNotFoundError:
+                    # Two compactions since the generation was read: start over
+                    if attempt:
+                        raise
+                    continue
+                return {chunk_id: data[offset:offset + length].decode("utf-8") for chunk_id, offset, length in rows}
+
+    def delete_many(self, ids: List[str]):
+        with self.lock:
+            for i in range(0, len(ids), 500):
+                batch = ids[i:i + 500]
+                self.db.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch)
+            self.db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Stored texts, their bytes, and the size of the data file (live + garbage).
+        """
+        with self.lock:
+            count, live_bytes = self.db.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks").fetchone()
+            path = self.data_path(self.read_generation())
+            file_bytes = os.path.getsize(path) if os.path.exists(path) else 0
+        return {"chunks": count, "live_bytes": live_bytes, "file_bytes": file_bytes}
+
+    def compact(self):
+        """
+        Rewrites the live texts into a new data file, dropping overwritten and
+        deleted ones, and switches readers to it. The file this replaces is
+        kept until the next compaction; the one before it is removed.
+        """
+        with self.lock:
+            generation = self.read_generation()
+            rows = self.db.execute("SELECT id, offset, length FROM chunks ORDER BY offset").fetchall()
+            old_path, new_path = self.data_path(generation - 1), self.data_path(generation + 1)
+            moved = []
+            with open(new_path, "wb") as out:
+                end = max((offset + length for _, offset, length in rows), default=0)
+                if end:
+                    data = self.mapped(generation, end)
+                    for chunk_id, offset, length in rows:
+                        moved.append((out.tell(), chunk_id))
+                        out.write(data[offset:offset + length])
+            self.db.executemany("UPDATE chunks SET offset = ? WHERE id = ?", moved)
+            self.db.execute("UPDATE meta SET value = ? WHERE key = 'generation'", (generation + 1,))
+            self.db.commit()
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            if os.path.exists(old_path):
+                os.remove(old_path)
@@ -0,0 +1,18 @@
+import argparse
+
+from app import ONNX_MODEL_DIR, export_onnx
+
+if __name__ == "__main__":
+    """
+    Usage (from this folder):
+      python export_onnx.py [--out-dir ./onnx_model] [--no-quantize]
+    Writes model.onnx and (unless --no-quantize) the int8 model.int8.onnx used
+    when EMBED_BACKEND = "onnx". Check parity & speed with `python benchmark.py backends`.
+    """
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX")
+    parser.add_argument("--out-dir", default=ONNX_MODEL_DIR)
+    parser.add_argument("--no-quantize", action="store_true", help="skip the int8 model")
+    args = parser.parse_args()
+
+    for path in export_onnx(args.out_dir, quantize=not args.no_quantize):
+        print(f"[INFO] Wrote {path}")
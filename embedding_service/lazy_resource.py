@@ -0,0 +1,42 @@
+import time
+import threading
+from typing import Any, Callable, Dict
+
+# Lazily built models and clients, shared by the Embedding Service (app.py) and
+# the Retrieval Service. Kept out of app.py so it can be imported without the
+# embedding pipeline and its dependencies.
+
+
+# ------------------ LAZY INIT ------------------
+class LazyResource:
+    """
+    A model or client built by `loader` on first use. Thread-safe: when several
+    threads ask at once, one loads and the others wait for it.
+    """
+
+    def __init__(self, name: str, loader: Callable[[], Any]):
+        self.name = name
+        self.loader = loader
+        self.value = None
+        self.error = None
+        self.load_seconds = None
+        self.lock = threading.Lock()
+
+    def get(self) -> Any:
+        if self.value is None:
+            with self.lock:
+                if self.value is None:
+                    t0 = time.perf_counter()
+                    try:
+                        value = self.loader()
+                    except Exception as e:
+                        self.error = f"{type(e).__name__}: {e}"
+                        raise
+                    self.load_seconds = time.perf_counter() - t0
+                    self.error = None
+                    self.value = value
+                    print(f"[INFO] Loaded {self.name} in {self.load_seconds:.2f}s")
+        return self.value
+
+    def status(self) -> Dict[str, Any]:
+        return {"loaded": self.value is not None, "load_seconds": self.load_seconds, "error": self.error}
@@ -0,0 +1,442 @@
+import os
+import json
+import sqlite3
+import threading
+from collections import namedtuple
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# ------------------ CONFIG ------------------
+# Rows scored per matrix product in exact search (8192 x 768 float32 = 24 MB)
+SEARCH_BLOCK_ROWS = 8192
+# Rows allocated when a collection is created; the matrix doubles when full
+INITIAL_CAPACITY = 1024
+# k-means over at most this many sampled rows per list when building the IVF
+IVF_SAMPLE_PER_LIST = 256
+IVF_ITERATIONS = 10
+
+# Search hit, shaped like qdrant_client's ScoredPoint
+ScoredPoint = namedtuple("ScoredPoint", ["id", "score", "payload", "vector"])
+
+
+# ------------------ COLLECTION ------------------
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """
+    L2-normalized float32 copy of a (n, dim) matrix, so dot product = cosine.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class LocalCollection:
+    """
+    One collection on disk (a folder):
+      - vectors.bin: memory-mapped (capacity, dim) matrix of L2-normalized
+        vectors, float16, or int8 with a float32 per-row scale in scales.bin
+      - index.sqlite: point id -> row and the JSON payload of every point,
+        plus the layout (dim, dtype, capacity, count) and a version that
+        every write bumps
+      - ivf.npz (optional): k-means centroids and inverted lists, valid for
+        the version they were built at (see build_ivf)
+    Occupied rows are always 0..count-1: a deleted row is filled with the last
+    row. Writes are serialized by a lock; writes from another process are
+    picked up by refresh().
+    When the decoded float32 matrix fits in `ram_bytes`, searches use an
+    in-memory copy of it instead of decoding memmap blocks per query.
+    """
+
+    def __init__(self, folder: str, dim: Optional[int] = None, dtype: str = "float16", ram_bytes: int = 0):
+        self.folder = folder
+        self.ram_bytes = ram_bytes
+        self.decoded = None
+        self.lock = threading.RLock()
+        exists = os.path.exists(os.path.join(folder, "index.sqlite"))
+        if not exists and dim is None:
+            raise ValueError(f"Collection not found: {folder}")
+        os.makedirs(folder, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(folder, "index.sqlite"), check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS points (id TEXT PRIMARY KEY, row INTEGER UNIQUE, payload TEXT)")
+        if not exists:
+            if dtype not in ("float16", "int8"):
+                raise ValueError(f"Unsupported dtype: {dtype} (use float16 or int8)")
+            layout = {"dim": dim, "dtype": dtype, "capacity": INITIAL_CAPACITY, "count": 0, "version": 0}
+            self.db.executemany("INSERT INTO meta VALUES (?, ?)", [(k, json.dumps(v)) for k, v in layout.items()])
+            self.db.commit()
+        meta = self.read_meta()
+        self.dim = meta["dim"]
+        self.dtype = meta["dtype"]
+        self.version = None
+        self.ivf = None
+        self.ivf_built = None
+        self.refresh()
+
+    # ---- storage ----
+    def read_meta(self) -> Dict[str, Any]:
+        return {k: json.loads(v) for k, v in self.db.execute("SELECT key, value FROM meta")}
+
+    def open_matrix(self, capacity: int):
+        """
+        Memory-maps vectors.bin (and scales.bin) with `capacity` rows, growing
+        the files when they are smaller.
+        """
+        files = [("vectors.bin", np.dtype(self.dtype), (capacity, self.dim))]
+        if self.dtype == "int8":
+            files.append(("scales.bin", np.dtype(np.float32), (capacity,)))
+        maps = []
+        for name, dtype, shape in files:
+            path = os.path.join(self.folder, name)
+            size = int(np.prod(shape)) * dtype.itemsize
+            with open(path, "ab") as f:
+                if f.tell() < size:
+                    f.truncate(size)
+            maps.append(np.memmap(path, dtype=dtype, mode="r+", shape=shape))
+        self.vectors = maps[0]
+        self.scales = maps[1] if self.dtype == "int8" else None
+        self.capacity = capacity
+
+    def refresh(self):
+        """
+        Re-opens the matrix and the IVF if another process changed the
+        collection or built a new IVF.
+        """
+        with self.lock:
+            meta = self.read_meta()
+            if meta["version"] != self.version:
+                self.open_matrix(meta["capacity"])
+                self.count = meta["count"]
+                self.version = meta["version"]
+                self.decoded = None
+            elif meta.get("ivf_built") == self.ivf_built:
+                return
+            self.ivf_built = meta.get("ivf_built")
+            self.ivf = self.load_ivf()
+
+    def commit(self):
+        self.version += 1
+        self.decoded = None
+        # The IVF lists no longer cover the rows: exact search until rebuilt
+        self.ivf = None
+        self.db.executemany(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+            [(k, json.dumps(v)) for k, v in
+             (("capacity", self.capacity), ("count", self.count), ("version", self.version))]
+        )
+        self.vectors.flush()
+        if self.scales is not None:
+            self.scales.flush()
+        self.db.commit()
+
+    def write_rows(self, rows: np.ndarray, vectors: np.ndarray):
+        if self.dtype == "int8":
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+            self.vectors[rows] = np.round(vectors / scales[:, None]).astype(np.int8)
+            self.scales[rows] = scales
+        else:
+            self.vectors[rows] = vectors.astype(np.float16)
+
+    def read_rows(self, start: int, end: int) -> np.ndarray:
+        block = self.vectors[start:end].astype(np.float32)
+        if self.scales is not None:
+            block *= self.scales[start:end, None]
+        return block
+
+    def decoded_matrix(self) -> Optional[np.ndarray]:
+        """
+        The (count, dim) float32 matrix in RAM if it fits in ram_bytes, else None.
+        """
+        if self.decoded is None and self.count * self.dim * 4 <= self.ram_bytes:
+            self.decoded = np.concatenate(
+                [self.read_rows(start, min(start + SEARCH_BLOCK_ROWS, self.count))
+                 for start in range(0, self.count, SEARCH_BLOCK_ROWS)]
+            ) if self.count else np.empty((0, self.dim), dtype=np.float32)
+        return self.decoded
+
+    def take_rows(self, rows: np.ndarray) -> np.ndarray:
+        if self.decoded is not None:
+            return self.decoded[rows]
+        block = self.vectors[rows].astype(np.float32)
+        if self.scales is not None:
+            block *= self.scales[rows, None]
+        return block
+
+    # ---- writes ----
+    def upsert(self, ids: List[str], vectors: np.ndarray, payloads: List[Optional[dict]]):
+        """
+        Inserts or overwrites points. Within one call the last occurrence of an id wins.
+        """
+        latest = {point_id: i for i, point_id in enumerate(ids)}
+        order = list(latest.values())
+        ids = [ids[i] for i in order]
+        payloads = [payloads[i] for i in order]
+        vectors = normalize_rows(vectors)[order]
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Vector size {vectors.shape[1]} != collection size {self.dim}")
+        with self.lock:
+            self.refresh()
+            rows = []
+            for point_id in ids:
+                found = self.db.execute("SELECT row FROM points WHERE id = ?", (point_id,)).fetchone()
+                if found is None:
+                    rows.append(self.count)
+                    self.count += 1
+                else:
+                    rows.append(found[0])
+            if self.count > self.capacity:
+                capacity = self.capacity
+                while capacity < self.count:
+                    capacity *= 2
+                self.open_matrix(capacity)
+            self.write_rows(np.asarray(rows), vectors)
+            self.db.executemany(
+                "INSERT OR REPLACE INTO points VALUES (?, ?, ?)",
+                [(point_id, row, json.dumps(payload or {}, ensure_ascii=False))
+                 for point_id, row, payload in zip(ids, rows, payloads)]
+            )
+            self.commit()
+
+    def delete(self, ids: List[str]):
+        """
+        Deletes points by id (unknown ids are ignored).
+        """
+        with self.lock:
+            self.refresh()
+            for point_id in ids:
+                found = self.db.execute("SELECT row FROM points WHERE id = ?", (point_id,)).fetchone()
+                if found is None:
+                    continue
+                row, last = found[0], self.count - 1
+                self.db.execute("DELETE FROM points WHERE id = ?", (point_id,))
+                if row != last:
+                    self.vectors[row] = self.vectors[last]
+                    if self.scales is not None:
+                        self.scales[row] = self.scales[last]
+                    self.db.execute("UPDATE points SET row = ? WHERE row = ?", (row, last))
+                self.count -= 1
+            self.commit()
+
+    # ---- search ----
+    def exact_scores(self, query: np.ndarray, limit: int):
+        """
+        Top `limit` (rows, scores) over all rows: one product with the decoded
+        matrix, or block by block from the memmap.
+        """
+        decoded = self.decoded_matrix()
+        if decoded is not None:
+            scores = decoded @ query
+            top = np.argpartition(-scores, limit - 1)[:limit] if len(scores) > limit else np.arange(len(scores))
+            return top, scores[top]
+        best_rows, best_scores = [], []
+        for start in range(0, self.count, SEARCH_BLOCK_ROWS):
+            end = min(start + SEARCH_BLOCK_ROWS, self.count)
+            scores = self.read_rows(start, end) @ query
+            if len(scores) > limit:
+                top = np.argpartition(-scores, limit - 1)[:limit]
+            else:
+                top = np.arange(len(scores))
+            best_rows.append(top + start)
+            best_scores.append(scores[top])
+        if not best_rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return np.concatenate(best_rows), np.concatenate(best_scores)
+
+    def ivf_scores(self, query: np.ndarray, nprobe: int):
+        """
+        (rows, scores) of the rows in the `nprobe` inverted lists whose
+        centroids are closest to the query.
+        """
+        centroids, order, offsets = self.ivf["centroids"], self.ivf["order"], self.ivf["offsets"]
+        nprobe = min(nprobe, len(centroids))
+        lists = np.argpartition(-(centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.sort(np.concatenate([order[offsets[i]:offsets[i + 1]] for i in lists]))
+        return rows, self.take_rows(rows) @ query
+
+    def search(self, query_vector, limit: int, nprobe: int = 0):
+        """
+        Top `limit` (row, score) pairs by cosine similarity: approximate over
+        `nprobe` IVF lists when an up-to-date IVF exists and nprobe > 0,
+        exact otherwise.
+        """
+        self.refresh()
+        query = normalize_rows(np.asarray(query_vector)[None, :])[0]
+        with self.lock:
+            self.decoded_matrix()
+            if nprobe and self.ivf is not None:
+                rows, scores = self.ivf_scores(query, nprobe)
+            else:
+                rows, scores = self.exact_scores(query, limit)
+        top = np.argsort(-scores, kind="stable")[:limit]
+        return rows[top], scores[top]
+
+    def points_at(self, rows: List[int]) -> Dict[int, tuple]:
+        """
+        row -> (id, payload JSON) for the given rows.
+        """
+        marks = ",".join("?" * len(rows))
+        with self.lock:
+            found = self.db.execute(f"SELECT row, id, payload FROM points WHERE row IN ({marks})", rows).fetchall()
+        return {row: (point_id, payload) for row, point_id, payload in found}
+
+    # ---- IVF ----
+    def load_ivf(self) -> Optional[Dict[str, np.ndarray]]:
+        path = os.path.join(self.folder, "ivf.npz")
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if int(data["version"]) != self.version:
+                return None
+            return {
+                "centroids": data["centroids"], "order": data["order"], "offsets": data["offsets"],
+                "version": self.version,
+            }
+
+    def build_ivf(self, n_lists: int, seed: int = 0) -> Dict[str, Any]:
+        """
+        Spherical k-means into `n_lists` lists, trained on a sample of rows,
+        then every row is assigned to its nearest centroid. The IVF is saved
+        for the current version and ignored (exact search) after any later
+        write, until it is rebuilt.
+        """
+        with self.lock:
+            self.refresh()
+            ivf = self.ivf
+            if ivf is not None and ivf["version"] == self.version and len(ivf["centroids"]) == n_lists:
+                return {"lists": n_lists, "rows": self.count, "rebuilt": False}
+            if self.count == 0:
+                return {"lists": 0, "rows": 0, "rebuilt": False}
+            n_lists = max(1, min(n_lists, self.count))
+            rng = np.random.default_rng(seed)
+            sample_rows = np.sort(rng.choice(self.count, min(self.count, n_lists * IVF_SAMPLE_PER_LIST), replace=False))
+            sample = self.take_rows(sample_rows)
+            centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+            for _ in range(IVF_ITERATIONS):
+                labels = np.argmax(sample @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sample)
+                empty = np.bincount(labels, minlength=n_lists) == 0
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+                centroids = normalize_rows(sums)
+
+            labels = np.empty(self.count, dtype=np.int32)
+            for start in range(0, self.count, SEARCH_BLOCK_ROWS):
+                end = min(start + SEARCH_BLOCK_ROWS, self.count)
+                labels[start:end] = np.argmax(self.read_rows(start, end) @ centroids.T, axis=1)
+            order = np.argsort(labels, kind="stable").astype(np.int64)
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))])
+
+            tmp_path = os.path.join(self.folder, "ivf.tmp.npz")
+            np.savez(tmp_path, centroids=centroids, order=order, offsets=offsets, version=self.version)
+            os.replace(tmp_path, os.path.join(self.folder, "ivf.npz"))
+            self.ivf = {"centroids": centroids, "order": order, "offsets": offsets, "version": self.version}
+            # Tells readers in other processes to load the new IVF
+            self.ivf_built = (self.ivf_built or 0) + 1
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('ivf_built', ?)", (json.dumps(self.ivf_built),))
+            self.db.commit()
+            return {"lists": n_lists, "rows": self.count, "rebuilt": True}
+
+
+# ------------------ CLIENT ------------------
+class LocalVectorIndex:
+    """
+    In-process, memory-mapped vector index with the part of the QdrantClient
+    interface the services use, so either can sit behind the same code:
+    create_collection, get_collection, upsert, delete, search, count.
+    Distance is always cosine. Collections are folders under `folder`.
+    `nprobe` > 0 makes search approximate once build_ivf has been run.
+    Collections up to `ram_mb` MB (as float32) are searched from RAM.
+    """
+
+    def __init__(self, folder: str, dtype: str = "float16", nprobe: int = 0, ram_mb: int = 0):
+        self.folder = folder
+        self.dtype = dtype
+        self.nprobe = nprobe
+        self.ram_bytes = ram_mb << 20
+        self.collections = {}
+        self.lock = threading.Lock()
+
+    def collection(self, collection_name: str) -> LocalCollection:
+        with self.lock:
+            if collection_name not in self.collections:
+                self.collections[collection_name] = LocalCollection(
+                    os.path.join(self.folder, collection_name), ram_bytes=self.ram_bytes
+                )
+            return self.collections[collection_name]
+
+    def collection_exists(self, collection_name: str) -> bool:
+        return os.path.exists(os.path.join(self.folder, collection_name, "index.sqlite"))
+
+    def create_collection(self, collection_name: str, vectors_config):
+        """
+        Creates an empty collection of vectors_config.size dimensions (a
+        qdrant VectorParams or anything with .size / .distance).
+        Raises ValueError if it already exists, like Qdrant.
+        """
+        distance = str(getattr(vectors_config.distance, "value", vectors_config.distance))
+        if distance.lower() != "cosine":
+            raise ValueError(f"Only cosine distance is supported, got {distance}")
+        if self.collection_exists(collection_name):
+            raise ValueError(f"Collection {collection_name} already exists")
+        with self.lock:
+            self.collections[collection_name] = LocalCollection(
+                os.path.join(self.folder, collection_name), dim=vectors_config.size, dtype=self.dtype,
+                ram_bytes=self.ram_bytes
+            )
+        return True
+
+    def get_collection(self, collection_name: str) -> Dict[str, Any]:
+        collection = self.collection(collection_name)
+        collection.refresh()
+        return {
+            "points_count": collection.count,
+            "size": collection.dim,
+            "dtype": collection.dtype,
+            "ivf_lists": len(collection.ivf["centroids"]) if collection.ivf is not None else 0,
+        }
+
+    def count(self, collection_name: str) -> int:
+        return self.get_collection(collection_name)["points_count"]
+
+    def upsert(self, collection_name: str, points: list, wait: bool = True):
+        """
+        Points are qdrant PointStructs (or anything with .id, .vector, .payload).
+        """
+        if points:
+            self.collection(collection_name).upsert(
+                [str(p.id) for p in points], np.asarray([p.vector for p in points]), [p.payload for p in points]
+            )
+
+    def delete(self, collection_name: str, points_selector, wait: bool = True):
+        """
+        points_selector is a qdrant PointIdsList (or anything with .points).
+        """
+        self.collection(collection_name).delete([str(point_id) for point_id in points_selector.points])
+
+    def search(
+        self,
+        collection_name: str,
+        query_vector: List[float],
+        limit: int = 10,
+        with_payload: bool = True,
+        with_vectors: bool = False,
+        nprobe: Optional[int] = None,
+    ) -> List[ScoredPoint]:
+        """
+        Top `limit` points by cosine similarity, best first.
+        """
+        collection = self.collection(collection_name)
+        rows, scores = collection.search(query_vector, limit, self.nprobe if nprobe is None else nprobe)
+        points = collection.points_at(rows.tolist())
+        results = []
+        for row, score in zip(rows.tolist(), scores.tolist()):
+            if row not in points:  # moved by a concurrent delete
+                continue
+            point_id, payload = points[row]
+            vector = collection.take_rows(np.asarray([row]))[0].tolist() if with_vectors else None
+            results.append(ScoredPoint(point_id, score, json.loads(payload) if with_payload else None, vector))
+        return results
+
+    def build_ivf(self, collection_name: str, n_lists: int) -> Dict[str, Any]:
+        return self.collection(collection_name).build_ivf(n_lists)
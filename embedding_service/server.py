@@ -0,0 +1,175 @@
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import List, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from app import EMBED_MAX_BATCH_TOKENS, tokenize_texts, infer_encoded
+
+# ------------------ CONFIG ------------------
+# Concurrent /embed requests are coalesced into micro-batches: the first
+# request of a batch waits at most EMBED_SERVER_MAX_WAIT_MS for others, and a
+# batch is cut once it holds EMBED_SERVER_MAX_BATCH texts. Each batch is one
+# padded forward pass (split further only by EMBED_MAX_BATCH_TOKENS).
+EMBED_SERVER_MAX_BATCH = 64
+EMBED_SERVER_MAX_WAIT_MS = 5
+EMBED_SERVER_MAX_TEXTS_PER_REQUEST = 256
+EMBED_SERVER_HOST = "0.0.0.0"
+EMBED_SERVER_PORT = 8001
+
+
+# ------------------ MICRO-BATCHING ------------------
+class MicroBatcher:
+    """
+    Collects texts from concurrent callers into micro-batches on one worker
+    thread and embeds each batch with a single inference call.
+    submit() returns a Future with one vector per submitted text.
+    """
+
+    def __init__(self, max_batch: int = EMBED_SERVER_MAX_BATCH, max_wait_ms: float = EMBED_SERVER_MAX_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_ms / 1000
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.texts = 0
+        self.busy_s = 0.0
+        self.worker = threading.Thread(target=self.run, name="micro-batcher", daemon=True)
+        self.worker.start()
+
+    def submit(self, texts: List[str]) -> Future:
+        future = Future()
+        if not texts:
+            future.set_result([])
+        else:
+            self.requests.put((texts, future))
+        return future
+
+    def next_batch(self) -> List[Tuple[List[str], Future]]:
+        """
+        Blocks for the first request, then takes more until the batch is full
+        or max_wait_s has passed since the first one arrived. Requests already
+        queued by then are still taken (so max_wait_ms = 0 batches whatever
+        arrived during the previous forward pass).
+        """
+        batch = [self.requests.get()]
+        n_texts = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait_s
+        while n_texts < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            n_texts += len(item[0])
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            texts = [text for request_texts, _ in batch for text in request_texts]
+            t0 = time.perf_counter()
+            try:
+                encoded, lengths = tokenize_texts(texts)
+                vectors = infer_encoded(encoded, lengths, len(texts), EMBED_MAX_BATCH_TOKENS)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            with self.lock:
+                self.batches += 1
+                self.texts += len(texts)
+                self.busy_s += time.perf_counter() - t0
+            start = 0
+            for request_texts, future in batch:
+                future.set_result(vectors[start:start + len(request_texts)])
+                start += len(request_texts)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "batches": self.batches,
+                "texts": self.texts,
+                "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+                "busy_s": round(self.busy_s, 3),
+                "queued": self.requests.qsize(),
+            }
+
+
+# ------------------ SERVER ------------------
+app = FastAPI(title="Embedding Service", version="1.0.0")
+batcher = None
+ready = threading.Event()
+
+
+def warm_up():
+    """
+    Loads the tokenizer and model through one batch, then marks the server ready.
+    """
+    t0 = time.perf_counter()
+    batcher.submit(["تهيئة"]).result()
+    ready.set()
+    print(f"[INFO] Embedding server ready in {time.perf_counter() - t0:.2f}s.")
+
+
+@app.on_event("startup")
+def start_batcher():
+    global batcher
+    batcher = MicroBatcher()
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+@app.post("/embed")
+async def embed_endpoint(request: Request):
+    """
+    Input: {"texts": ["...", ...]}. Output: {"vectors": [[...], ...]}, one
+    vector per text, in order (same vectors as embed_texts).
+    """
+    data = await request.json()
+    texts = data.get("texts")
+    if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+        return JSONResponse({"error": "'texts' must be a list of strings"}, status_code=400)
+    if len(texts) > EMBED_SERVER_MAX_TEXTS_PER_REQUEST:
+        return JSONResponse(
+            {"error": f"at most {EMBED_SERVER_MAX_TEXTS_PER_REQUEST} texts per request"}, status_code=400
+        )
+    vectors = await asyncio.wrap_future(batcher.submit(texts))
+    return {"vectors": vectors}
+
+
+@app.get("/health")
+def health_endpoint():
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+def ready_endpoint():
+    """
+    200 once the model is loaded and has embedded a first batch, 503 before.
+    """
+    return JSONResponse({"ready": ready.is_set()}, status_code=200 if ready.is_set() else 503)
+
+
+@app.get("/stats")
+def stats_endpoint():
+    return batcher.stats()
+
+
+# ------------------ MAIN ------------------
+if __name__ == "__main__":
+    """
+    Usage (from this folder):
+      python server.py
+    Or:
+      uvicorn server:app --host 0.0.0.0 --port 8001
+    Run a single worker: every worker process loads its own model copy.
+    Clients: set EMBED_SERVER_URL in this service's app.py (embed_text) or in
+    the Retrieval Service (embed_query).
+    """
+    import uvicorn
+    uvicorn.run(app, host=EMBED_SERVER_HOST, port=EMBED_SERVER_PORT)
@@ -1,17 +1,65 @@
 import os
 import sys
+import time
+import threading
 from typing import Dict, Any, List
 
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 
 # --------------------------------------------------------------------
 # Optionally, if the retrieval & LLM code is outside this folder, e.g.:
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(project_root)
-from llm_generation_service.app import generate_answer, retrieve_context 
+from llm_generation_service.app import generate_answer, retrieve_context
+from retrieval_service.app import DENSE_SEARCH_RESOURCES, warm_up, readiness
 # --------------------------------------------------------------------
 
+# Models and clients load lazily. On startup a background thread warms them
+# up (retrying every WARM_UP_RETRY_SECONDS, e.g. while Qdrant is still down);
+# /ready answers 503 until it succeeds.
+WARM_UP_ON_STARTUP = True
+WARM_UP_RETRY_SECONDS = 10
+
 app = FastAPI(title="RAG API Service", version="1.0.0")
+
+
+# ------------------ WARM-UP / READINESS ------------------
+def warm_up_until_ready():
+    while True:
+        try:
+            # Answers only use dense_search, so the reranker is not loaded
+            timings = warm_up(DENSE_SEARCH_RESOURCES)
+            print(f"[INFO] Warm-up done: {', '.join(f'{k} {v:.2f}s' for k, v in timings.items())}")
+            return
+        except Exception as e:
+            print(f"[WARN] Warm-up failed ({type(e).__name__}: {e}); retrying in {WARM_UP_RETRY_SECONDS}s.")
+            time.sleep(WARM_UP_RETRY_SECONDS)
+
+
+@app.on_event("startup")
+def start_warm_up():
+    if WARM_UP_ON_STARTUP:
+        threading.Thread(target=warm_up_until_ready, name="warm-up", daemon=True).start()
+
+
+@app.get("/health")
+def health_endpoint():
+    """
+    Liveness: the process is up and serving requests.
+    """
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+def ready_endpoint():
+    """
+    Readiness: 200 once models and clients are warmed up, 503 before that.
+    Gate traffic on this during rolling restarts.
+    """
+    status = readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
    
 # ------------------ ACTUAL FASTAPI ENDPOINT ------------------
 @app.post("/query")
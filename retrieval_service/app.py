@@ -1,19 +1,25 @@
 import os
+import sys
 import json
-from typing import List, Dict, Any
+import time
+import threading
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Dict, Any, Callable, Optional, Tuple
 
-import torch
-from transformers import (
-    AutoTokenizer,
-    AutoModel,
-    AutoTokenizer,
-    AutoModelForSequenceClassification
-)
+import numpy as np
 
-from qdrant_client import QdrantClient
-from qdrant_client.http import models as qmodels
+# LazyResource, the local index and the chunk store live in the Embedding
+# Service, the query normalizer in the Data Processing Service
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+from embedding_service.lazy_resource import LazyResource
 
-from opensearchpy import OpenSearch
+# torch, transformers, onnxruntime and the Qdrant / OpenSearch clients are
+# imported by the loaders below, so importing this module (and the services
+# that import it) stays cheap.
 
 
 # ------------- CONFIG ----------------
@@ -22,6 +28,17 @@ QDRANT_HOST = "localhost"
 QDRANT_PORT = 6333
 COLLECTION_NAME = "arabic_docs"
 
+# Vector store: "qdrant" (the server above) or "local" (the memory-mapped index
+# the Embedding Service writes with VECTOR_STORE = "local"; no server needed)
+VECTOR_STORE = "qdrant"
+LOCAL_INDEX_FOLDER = "../embedding_service/local_index"
+LOCAL_INDEX_NPROBE = 8  # IVF lists scanned per query once an IVF is built; 0 = always exact
+LOCAL_INDEX_RAM_MB = 512  # search from a float32 copy in RAM when the index fits
+
+# Chunk texts written by the Embedding Service with USE_CHUNK_STORE (payloads
+# then hold no text); results get their text from here (see hydrate_texts)
+CHUNK_STORE_FOLDER = "../embedding_service/chunk_store"
+
 # OpenSearch
 OS_HOST = "localhost"
 OS_PORT = 9200
@@ -33,59 +50,294 @@ EMBED_MODEL_NAME = "CAMeL-Lab/bert-base-arabic-camelbert-msa"
 RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 # For Arabic re-ranking, replace with a suitable cross-encoder if available.
 
+# Query embedding backend: "torch" or "onnx" (the int8 model exported by
+# the Embedding Service's export_onnx.py; must match the backend used for indexing)
+EMBED_BACKEND = "torch"
+EMBED_ONNX_PATH = "../embedding_service/onnx_model/model.int8.onnx"
+# Query embeddings from the shared embedding server (embedding_service/server.py)
+# instead of a model copy in this process; e.g. "http://localhost:8001"
+EMBED_SERVER_URL = None
+EMBED_SERVER_TIMEOUT_S = 5
+
+# Query embedding cache: queries are normalized with the Data Processing
+# Service's clean_arabic_text (diacritics, tatweel, Alef forms, whitespace...),
+# so repeats that differ only in those skip the model. LRU-bounded; entries
+# expire QUERY_CACHE_TTL_S seconds after they were computed.
+USE_QUERY_CACHE = True
+QUERY_CACHE_MAX_ENTRIES = 10_000  # float32 vectors, ~3 KB each at 768 dims
+QUERY_CACHE_TTL_S = 3600
+
 TOP_K = 10  # how many results to fetch from each system before combining
 FINAL_TOP_N = 5  # how many final results we want after re-ranking
 
+# Hybrid search: dense and sparse searches run concurrently, each with its own
+# timeout (a backend that times out or fails is left out). Candidates are
+# deduplicated by chunk id and fused with reciprocal rank fusion,
+# sum(1 / (RRF_K + rank)); only the top RERANK_TOP_M go to the cross-encoder.
+DENSE_TIMEOUT_S = 2.0
+SPARSE_TIMEOUT_S = 1.0
+RRF_K = 60
+RERANK_TOP_M = 10
+SEARCH_WORKERS = 8  # threads shared by concurrent hybrid_search calls
+
+# Resources loaded by warm_up() (see LAZY INIT); anything else loads on first use.
+# Callers that only run dense_search warm up DENSE_SEARCH_RESOURCES instead.
+WARM_UP_RESOURCES = ["embedder", "reranker", "vector_store"]
+DENSE_SEARCH_RESOURCES = ["embedder", "vector_store"]
+
+
+# ------------- LAZY INIT ----------------
+def torch_device():
+    import torch
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def load_embedder() -> Dict[str, Any]:
+    """
+    Query embedding tokenizer plus either the PyTorch model or an ONNX Runtime
+    session, depending on EMBED_BACKEND (same approach as your Embedding Service).
+    """
+    from transformers import AutoTokenizer
+    embedder = {"tokenizer": AutoTokenizer.from_pretrained(EMBED_MODEL_NAME), "model": None, "session": None}
+    if EMBED_BACKEND == "onnx":
+        import onnxruntime as ort
+        embedder["session"] = ort.InferenceSession(EMBED_ONNX_PATH, providers=["CPUExecutionProvider"])
+    else:
+        from transformers import AutoModel
+        embedder["device"] = torch_device()
+        embedder["model"] = AutoModel.from_pretrained(EMBED_MODEL_NAME).eval().to(embedder["device"])
+    return embedder
+
+
+def load_reranker() -> Dict[str, Any]:
+    """
+    Cross-encoder re-ranker model and tokenizer.
+    """
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+    device = torch_device()
+    model = AutoModelForSequenceClassification.from_pretrained(RERANK_MODEL_NAME).eval().to(device)
+    return {"tokenizer": AutoTokenizer.from_pretrained(RERANK_MODEL_NAME), "model": model, "device": device}
+
 
-# ------------- INIT CLIENTS ----------------
+def load_vector_store():
+    if VECTOR_STORE == "local":
+        from embedding_service.local_index import LocalVectorIndex
+        return LocalVectorIndex(LOCAL_INDEX_FOLDER, nprobe=LOCAL_INDEX_NPROBE, ram_mb=LOCAL_INDEX_RAM_MB)
+    from qdrant_client import QdrantClient
+    return QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
 
-# Qdrant client
-qdrant_client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
 
-# OpenSearch client
-# os_client = OpenSearch(
-#     hosts=[{"host": OS_HOST, "port": OS_PORT}],
-#     http_compress=True
-# )
+def load_chunk_store():
+    from embedding_service.chunk_store import ChunkStore
+    return ChunkStore(CHUNK_STORE_FOLDER)
 
-# Load query embedding model (same approach as your Embedding Service)
-embed_tokenizer = AutoTokenizer.from_pretrained(EMBED_MODEL_NAME)
-embed_model = AutoModel.from_pretrained(EMBED_MODEL_NAME)
-embed_model.eval()
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-embed_model.to(device)
 
-# Load cross-encoder re-ranker model
-ranker_tokenizer = AutoTokenizer.from_pretrained(RERANK_MODEL_NAME)
-ranker_model = AutoModelForSequenceClassification.from_pretrained(RERANK_MODEL_NAME)
-ranker_model.eval()
-ranker_model.to(device)
+def load_normalizer() -> Callable[[str], str]:
+    from data_processing_service.normalize import clean_arabic_text
+    return clean_arabic_text
+
+
+def load_os_client():
+    from opensearchpy import OpenSearch
+    return OpenSearch(hosts=[{"host": OS_HOST, "port": OS_PORT}], http_compress=True)
+
+
+RESOURCES = {
+    "embedder": LazyResource("embedder", load_embedder),
+    "reranker": LazyResource("reranker", load_reranker),
+    "vector_store": LazyResource("vector_store", load_vector_store),
+    "opensearch": LazyResource("opensearch", load_os_client),
+    "chunk_store": LazyResource("chunk_store", load_chunk_store),
+    "normalizer": LazyResource("normalizer", load_normalizer),
+}
+
+warm_up_state = {"ready": False, "error": None, "seconds": None}
+
+
+def warm_up(resources: Optional[List[str]] = None) -> Dict[str, float]:
+    """
+    Loads `resources` (default WARM_UP_RESOURCES) and runs one dummy call
+    through each, so the first real query pays no initialization (model load,
+    kernel setup, vector store connection). Marks the service ready on success.
+    Returns seconds spent per resource.
+    """
+    if resources is None:
+        resources = WARM_UP_RESOURCES
+    timings = {}
+    t_start = time.perf_counter()
+    try:
+        for name in resources:
+            t0 = time.perf_counter()
+            if name != "embedder" or not EMBED_SERVER_URL:
+                RESOURCES[name].get()
+            if name == "embedder":
+                RESOURCES["normalizer"].get()
+                compute_query_embedding("تهيئة")  # bypasses the query cache
+            elif name == "reranker":
+                re_rank("تهيئة", [{"text": "تهيئة"}])
+            elif name == "vector_store":
+                RESOURCES["vector_store"].get().get_collection(COLLECTION_NAME)
+            elif name == "opensearch":
+                RESOURCES["opensearch"].get().info()
+            timings[name] = time.perf_counter() - t0
+    except Exception as e:
+        warm_up_state["error"] = f"{type(e).__name__}: {e}"
+        raise
+    warm_up_state.update(ready=True, error=None, seconds=time.perf_counter() - t_start)
+    return timings
+
+
+def readiness() -> Dict[str, Any]:
+    """
+    Whether warm_up() has completed, plus the load status of every resource
+    and the query embedding cache statistics.
+    """
+    return {
+        **warm_up_state,
+        "resources": {name: resource.status() for name, resource in RESOURCES.items()},
+        "query_cache": QUERY_CACHE.stats(),
+    }
+
+
+# ------------- QUERY EMBEDDING CACHE ----------------
+class QueryEmbeddingCache:
+    """
+    Query vectors keyed by (embedding backend, normalized query), least
+    recently used first out once max_entries are held. An entry expires ttl_s
+    seconds after it was computed. Vectors are kept as float32 arrays (the
+    precision they are computed in), so a hit returns the same vector.
+    Thread-safe.
+    """
+
+    def __init__(self, max_entries: int = QUERY_CACHE_MAX_ENTRIES, ttl_s: float = QUERY_CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.entries = OrderedDict()  # key -> (expires_at, vector)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple[str, str]) -> Optional[List[float]]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self.entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return entry[1].tolist()
+
+    def put(self, key: Tuple[str, str], vector: List[float]):
+        entry = (time.monotonic() + self.ttl_s, np.asarray(vector, dtype=np.float32))
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+
+QUERY_CACHE = QueryEmbeddingCache()
 
 
 # ------------- HELPER FUNCTIONS ----------------
 def embed_query(text: str) -> List[float]:
     """
-    Embeds the query text using the same approach as your embedding service (mean pooling).
+    Embeds the query after the same Arabic normalization as the indexed chunks
+    (clean_arabic_text). Repeat queries are served from QUERY_CACHE without
+    running the model. Returns a list of floats (vector).
+    """
+    query = RESOURCES["normalizer"].get()(text)
+    if not USE_QUERY_CACHE:
+        return compute_query_embedding(query)
+    key = (EMBED_SERVER_URL or EMBED_BACKEND, query)
+    vector = QUERY_CACHE.get(key)
+    if vector is None:
+        vector = compute_query_embedding(query)
+        QUERY_CACHE.put(key, vector)
+    return vector
+
+
+def compute_query_embedding(text: str) -> List[float]:
+    """
+    Embeds the text using the same approach as your embedding service (mean pooling),
+    or with the embedding server when EMBED_SERVER_URL is set.
     Returns a list of floats (vector).
     """
-    inputs = embed_tokenizer(text, return_tensors="pt", truncation=True, max_length=512)
-    inputs = {k: v.to(device) for k, v in inputs.items()}
+    if EMBED_SERVER_URL:
+        request = urllib.request.Request(
+            f"{EMBED_SERVER_URL.rstrip('/')}/embed",
+            data=json.dumps({"texts": [text]}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=EMBED_SERVER_TIMEOUT_S) as response:
+            return json.load(response)["vectors"][0]
+
+    embedder = RESOURCES["embedder"].get()
+    if embedder["session"] is not None:
+        session = embedder["session"]
+        inputs = embedder["tokenizer"](text, return_tensors="np", truncation=True, max_length=512)
+        feeds = {i.name: inputs[i.name].astype(np.int64) for i in session.get_inputs()}
+        hidden_states = session.run(["last_hidden_state"], feeds)[0][0]  # [seq_len, hidden_size]
+        return hidden_states.mean(axis=0).tolist()
+
+    import torch
+    inputs = embedder["tokenizer"](text, return_tensors="pt", truncation=True, max_length=512)
+    inputs = {k: v.to(embedder["device"]) for k, v in inputs.items()}
     with torch.no_grad():
-        outputs = embed_model(**inputs)  # last_hidden_state shape: [1, seq_len, hidden_size]
+        outputs = embedder["model"](**inputs)  # last_hidden_state shape: [1, seq_len, hidden_size]
     # Mean pool
     hidden_states = outputs.last_hidden_state.squeeze(0)  # [seq_len, hidden_size]
     mean_vec = hidden_states.mean(dim=0)  # [hidden_size]
     return mean_vec.cpu().tolist()
 
 
-def dense_search(query: str, top_k: int = TOP_K) -> List[Dict[str, Any]]:
+def hydrate_texts(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Fills in "text" from the chunk store for results that have none
+    (payloads without text), with one lookup for all of them.
     """
-    Searches Qdrant for semantic matches.
-    Returns a list of dicts: { "text": ..., "score": ..., "metadata": ... }
+    missing = [r for r in results if r.get("text") is None and r.get("id") is not None]
+    if missing:
+        texts = RESOURCES["chunk_store"].get().get_many([r["id"] for r in missing])
+        for r in missing:
+            r["text"] = texts.get(r["id"])
+    return results
+
+
+def dense_search(query: str, top_k: int = TOP_K, hydrate: bool = True) -> List[Dict[str, Any]]:
+    """
+    Searches Qdrant (or the local index) for semantic matches.
+    Returns a list of dicts: { "id": ..., "text": ..., "score": ..., "metadata": ... }
+    With hydrate=False, "text" is None unless the payload holds it; callers
+    that only keep some results hydrate those (see hydrate_texts).
     """
     query_vector = embed_query(query)
     # Use "search" method from Qdrant
-    search_result = qdrant_client.search(
+    search_result = RESOURCES["vector_store"].get().search(
         collection_name=COLLECTION_NAME,
         query_vector=query_vector,
         limit=top_k,
@@ -96,21 +348,23 @@ def dense_search(query: str, top_k: int = TOP_K) -> List[Dict[str, Any]]:
     # search_result is a list of ScoredPoint
     results = []
     for point in search_result:
-        payload = point.payload or {}
-        text_val = payload.get("text", None)  # If you stored text in the payload, or store it differently
+        payload = dict(point.payload or {})
+        text_val = payload.pop("text", None)  # Payloads from before the chunk store hold the text
         score = point.score
         results.append({
+            "id": str(point.id),
             "text": text_val,
             "score": score,       # Qdrant's similarity score
             "metadata": payload
         })
-    return results
+    return hydrate_texts(results) if hydrate else results
 
 
 def sparse_search(query: str, top_k: int = TOP_K) -> List[Dict[str, Any]]:
     """
     Searches OpenSearch for keyword matches (multi_match on "text" + "metadata.*").
-    Returns a list of dicts: { "text": ..., "score": ..., "metadata": ... }
+    Returns a list of dicts: { "id": ..., "text": ..., "score": ..., "metadata": ... }
+    The id is the chunk id ("id" in the document, else the OpenSearch _id).
     """
     search_body = {
         "size": top_k,
@@ -122,13 +376,14 @@ def sparse_search(query: str, top_k: int = TOP_K) -> List[Dict[str, Any]]:
         }
     }
 
-    resp = os_client.search(index=OS_INDEX, body=search_body)
+    resp = RESOURCES["opensearch"].get().search(index=OS_INDEX, body=search_body)
     hits = resp["hits"]["hits"]
 
     results = []
     for hit in hits:
         source = hit["_source"]
         results.append({
+            "id": str(source.get("id", hit["_id"])),
             "text": source.get("text", ""),
             "score": hit["_score"],
             "metadata": source.get("metadata", {})
@@ -146,22 +401,28 @@ def re_rank(query: str, candidates: List[Dict[str, Any]], top_n: int = FINAL_TOP
     if not candidates:
         return []
 
+    # The cross-encoder reads the text of every candidate
+    hydrate_texts(candidates)
+
     # Prepare batch inputs for the cross-encoder
     # The cross-encoder needs pairs: (query, doc_text)
     pairs = [(query, c["text"] if c["text"] else "") for c in candidates]
     
+    import torch
+    reranker = RESOURCES["reranker"].get()
+
     # Tokenize in batch
-    batch = ranker_tokenizer.batch_encode_plus(
+    batch = reranker["tokenizer"].batch_encode_plus(
         pairs,
         truncation=True,
         max_length=512,
         return_tensors="pt",
         padding=True
     )
-    batch = {k: v.to(device) for k, v in batch.items()}
+    batch = {k: v.to(reranker["device"]) for k, v in batch.items()}
 
     with torch.no_grad():
-        outputs = ranker_model(**batch)
+        outputs = reranker["model"](**batch)
         # For a typical cross-encoder for ranking, the logits shape is [batch_size, 1].
         # We take the first (or only) dimension as the score.
         scores = outputs.logits.squeeze(-1)  # shape: [batch_size]
@@ -180,23 +441,66 @@ def re_rank(query: str, candidates: List[Dict[str, Any]], top_n: int = FINAL_TOP
     return candidates[:top_n]
 
 
-def hybrid_search(query: str, top_k: int = TOP_K) -> List[Dict[str, Any]]:
+SEARCH_POOL = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+
+
+def reciprocal_rank_fusion(result_lists: Dict[str, List[Dict[str, Any]]], k: int = RRF_K) -> List[Dict[str, Any]]:
     """
-    Combines dense + sparse retrieval, then re-ranks with cross-encoder.
+    Merges ranked result lists (backend name -> results, best first) into one
+    list sorted by RRF score, sum over backends of 1 / (k + rank).
+    Results with the same chunk id (or, without an id, the same text) are
+    merged: the first one seen is kept, filled in with the text and metadata
+    of the others, and gets a "<backend>_score" per list it appears in.
+    "score" becomes the RRF score.
+    """
+    fused = {}
+    for backend, results in result_lists.items():
+        for rank, result in enumerate(results, start=1):
+            key = result.get("id") or result.get("text")
+            candidate = fused.get(key)
+            if candidate is None:
+                candidate = fused[key] = {**result, "rrf_score": 0.0}
+            else:
+                if candidate.get("text") is None:
+                    candidate["text"] = result.get("text")
+                candidate["metadata"] = {**(result.get("metadata") or {}), **(candidate.get("metadata") or {})}
+            candidate[f"{backend}_score"] = result.get("score")
+            candidate["rrf_score"] += 1.0 / (k + rank)
+    ranked = sorted(fused.values(), key=lambda c: c["rrf_score"], reverse=True)
+    for candidate in ranked:
+        candidate["score"] = candidate["rrf_score"]
+    return ranked
+
+
+def hybrid_search(query: str, top_k: int = TOP_K, top_m: int = RERANK_TOP_M) -> List[Dict[str, Any]]:
+    """
+    Runs dense and sparse search concurrently, fuses them with reciprocal rank
+    fusion (deduplicated by chunk id) and re-ranks the top_m candidates with
+    the cross-encoder. Latency is about the slower backend (bounded by its
+    timeout) plus re-ranking top_m texts.
     Returns final top_n hits.
     """
-    dense_results = dense_search(query, top_k)
-    sparse_results = sparse_search(query, top_k)
-
-    # Combine them (we could do a union or just a list)
-    combined = dense_results + sparse_results
-
-    # Optionally deduplicate if the same text appears in both results 
-    # (we can deduplicate by doc ID or text).
-    # For demo, we'll skip that step.
-
-    # Re-rank them with cross-encoder
-    final_ranked = re_rank(query, combined, top_n=FINAL_TOP_N)
+    t0 = time.perf_counter()
+    searches = {
+        "dense": (SEARCH_POOL.submit(dense_search, query, top_k, False), DENSE_TIMEOUT_S),
+        "sparse": (SEARCH_POOL.submit(sparse_search, query, top_k), SPARSE_TIMEOUT_S),
+    }
+    result_lists, errors = {}, {}
+    for backend, (future, timeout_s) in searches.items():
+        try:
+            result_lists[backend] = future.result(timeout=max(0.0, timeout_s - (time.perf_counter() - t0)))
+        except FutureTimeoutError:
+            errors[backend] = TimeoutError(f"{backend} search took longer than {timeout_s}s")
+        except Exception as e:
+            errors[backend] = e
+        if backend in errors:
+            print(f"[WARN] Hybrid search without {backend} results: {type(errors[backend]).__name__}: {errors[backend]}")
+    if not result_lists:
+        raise errors["dense"]
+
+    # Deduplicate + fuse, then re-rank only the best top_m with the cross-encoder
+    candidates = reciprocal_rank_fusion(result_lists)[:top_m]
+    final_ranked = re_rank(query, candidates, top_n=FINAL_TOP_N)
     return final_ranked
 
 